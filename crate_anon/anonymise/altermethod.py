@@ -32,21 +32,23 @@ import datetime
 import html
 import logging
 import os
-import traceback
-from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 from cardinal_pythonlib.datetimefunc import (
     coerce_to_datetime,
     truncate_date_to_first_of_month,
 )
-from cardinal_pythonlib.extract_text import (
-    document_to_text,
-    TextProcessingConfig,
-)
+from cardinal_pythonlib.timing import MultiTimerContext, timer
 import regex
 
 # don't import config: circular dependency would have to be sorted out
 from crate_anon.anonymise.constants import ALTERMETHOD
+from crate_anon.anonymise.extracttext import (
+    extract_text_from_source,
+    ExtractionResult,
+    TextExtractionSource,
+    TIMING_EXTRACT_TEXT,
+)
 
 if TYPE_CHECKING:
     from cardinal_pythonlib.hash import GenericHasher
@@ -63,6 +65,11 @@ log = logging.getLogger(__name__)
 
 HTML_TAG_RE = regex.compile('<[^>]*>')
 
+AlterFunc = Callable[
+    [Any, List[Any], Optional["Patient"], Optional[ExtractionResult]],
+    Tuple[Any, bool]
+]  # value, row, patient, extracted_text -> newvalue, skiprow
+
 
 # =============================================================================
 # AlterMethod
@@ -259,7 +266,9 @@ class AlterMethod(object):
               ddr: "DataDictionaryRow",  # corresponding DataDictionaryRow
               row: List[Any],  # all values in row
               ddrows: List["DataDictionaryRow"],  # all of them
-              patient: "Patient" = None) -> Tuple[Any, bool]:
+              patient: "Patient" = None,
+              extracted_text: Tuple[Optional[str], bool] = None) \
+            -> Tuple[Any, bool]:
         """
         Performs the alteration.
 
@@ -275,6 +284,11 @@ class AlterMethod(object):
                 all data dictionary rows
             patient:
                 :class:`crate_anon.anonymise.patient.Patient` object
+            extracted_text:
+                for text extraction: optional ``text, extracted`` tuple
+                already obtained (e.g. from a
+                :class:`crate_anon.anonymise.extracttext.TextExtractionPool`);
+                if ``None``, text is extracted here
 
         Returns:
             tuple: ``newvalue, skiprow``
@@ -296,36 +310,115 @@ class AlterMethod(object):
         :class:`crate_anon.anonymise.ddr.DataDictionaryRow`.
 
         """
+        return self.get_alter_func(ddr, ddrows)(
+            value, row, patient, extracted_text)
+
+    def get_alter_func(self,
+                       ddr: "DataDictionaryRow",
+                       ddrows: List["DataDictionaryRow"]) -> AlterFunc:
+        """
+        Returns a function that performs this alteration for a particular
+        data dictionary row. The choice of transformation (see :meth:`alter`)
+        is made once, here, rather than for every value.
+
+        Args:
+            ddr:
+                corresponding
+                :class:`crate_anon.anonymise.ddr.DataDictionaryRow`
+            ddrows:
+                all data dictionary rows (in the order of the values in the
+                source rows that will be passed to the function)
 
+        Returns:
+            a function ``func(value, row, patient, extracted_text)``, with
+            arguments as for :meth:`alter`, returning ``newvalue, skiprow``
+
+        """
+        # The functions' unused arguments are there to give them a common
+        # signature.
         if self.scrub:
-            return self._scrub_func(value, patient), False
+            scrub_func = self._scrub_func
+
+            # noinspection PyUnusedLocal
+            def scrub(value: Any, row: List[Any], patient: "Patient",
+                      extracted_text: ExtractionResult) -> Tuple[Any, bool]:
+                return scrub_func(value, patient), False
+
+            return scrub
 
         if self.truncate_date:
-            return self._truncate_date_func(value), False
+            truncate_date_func = self._truncate_date_func
+
+            # noinspection PyUnusedLocal
+            def truncate_date(value: Any, row: List[Any], patient: "Patient",
+                              extracted_text: ExtractionResult) \
+                    -> Tuple[Any, bool]:
+                return truncate_date_func(value), False
+
+            return truncate_date
 
         if self.extract_text:
-            value, extracted = self._extract_text_func(value, row, ddrows)
-            if not extracted and ddr.skip_row_if_extract_text_fails:
-                log.debug("Skipping row as text extraction failed")
-                return None, True
-            return value, False
+            extract_text_func = self._extract_text_func
+            skip_if_extract_fails = ddr.skip_row_if_extract_text_fails
+
+            # noinspection PyUnusedLocal
+            def extract_text(value: Any, row: List[Any], patient: "Patient",
+                             extracted_text: ExtractionResult) \
+                    -> Tuple[Any, bool]:
+                if extracted_text is None:
+                    extracted_text = extract_text_func(value, row, ddrows)
+                value, extracted = extracted_text
+                if not extracted and skip_if_extract_fails:
+                    log.debug("Skipping row as text extraction failed")
+                    return None, True
+                return value, False
+
+            return extract_text
 
         if self.hash:
-            assert self.hasher is not None
-            return self.hasher.hash(value), False
+            hasher = self.hasher
+            assert hasher is not None
+
+            # noinspection PyUnusedLocal
+            def hash_(value: Any, row: List[Any], patient: "Patient",
+                      extracted_text: ExtractionResult) -> Tuple[Any, bool]:
+                return hasher.hash(value), False
+
+            return hash_
 
         # if alter_method.html_escape:
         #     return html.escape(value), False
 
         if self.html_unescape:
-            return html.unescape(value), False
+            # noinspection PyUnusedLocal
+            def html_unescape(value: Any, row: List[Any], patient: "Patient",
+                              extracted_text: ExtractionResult) \
+                    -> Tuple[Any, bool]:
+                return html.unescape(value), False
+
+            return html_unescape
 
         if self.html_untag:
-            return self._html_untag_func(value), False
+            html_untag_func = self._html_untag_func
 
-        if self.skip_if_text_extract_fails:
-            # Modifies other alter methods; doesn't do anything itself
-            return value, True
+            # noinspection PyUnusedLocal
+            def html_untag(value: Any, row: List[Any], patient: "Patient",
+                           extracted_text: ExtractionResult) \
+                    -> Tuple[Any, bool]:
+                return html_untag_func(value), False
+
+            return html_untag
+
+        # noinspection PyUnusedLocal
+        def pass_through(value: Any, row: List[Any], patient: "Patient",
+                         extracted_text: ExtractionResult) \
+                -> Tuple[Any, bool]:
+            return value, skiprow
+
+        # skip_if_text_extract_fails modifies other alter methods; it doesn't
+        # do anything itself.
+        skiprow = self.skip_if_text_extract_fails
+        return pass_through
 
     @staticmethod
     def _scrub_func(value: Any, patient: "Patient") -> Optional[str]:
@@ -394,6 +487,36 @@ class AlterMethod(object):
         Returns:
             tuple: ``value, extracted``
 
+        """
+        source = self.get_text_extraction_source(value, row, ddrows)
+        if source is None:
+            return None, False
+        with MultiTimerContext(timer, TIMING_EXTRACT_TEXT):
+            return extract_text_from_source(
+                source,
+                plain=self.config.extract_text_plain,
+                width=self.config.extract_text_width
+            )
+
+    def get_text_extraction_source(
+            self, value: Any, row: List[Any],
+            ddrows: List["DataDictionaryRow"]) \
+            -> Optional[TextExtractionSource]:
+        """
+        For file-related fields, work out where the document is (a filename or
+        a BLOB) and what type it is, without extracting any text. Used by
+        :func:`_extract_text_func`, and to send documents to a pool of worker
+        processes.
+
+        Args:
+            value: source field contents
+            row: all values in the same source row
+            ddrows: all data dictionary rows
+
+        Returns:
+            a :class:`crate_anon.anonymise.extracttext.TextExtractionSource`,
+            or ``None`` if there is nothing we can or may extract text from
+
         """
         use_filename = False
         filename = None
@@ -456,30 +579,17 @@ class AlterMethod(object):
         # Is it a permissible file type?
         if not self.config.extract_text_extension_permissible(extension):
             log.info(f"Extension {extension!r} not permissible; skipping")
-            return None, False
+            return None
 
         if use_filename:
             if not filename:
                 log.error("No filename; skipping")
-                return None, False
+                return None
 
             if not os.path.isfile(filename):
                 log.error(f"Filename {filename!r} is not a file; skipping")
-                return None, False
+                return None
 
-        # Extract text from the file (given its filename), or from a BLOB.
-        try:
-            textconfig = TextProcessingConfig(
-                plain=self.config.extract_text_plain,
-                width=self.config.extract_text_width,
-            )
-            value = document_to_text(filename=filename,
-                                     blob=blob,
-                                     extension=extension,
-                                     config=textconfig)
-        except Exception as e:
-            # Runtime error
-            traceback.print_exc()  # full details, please
-            log.error(f"Caught exception from document_to_text: {e}")
-            return None, False
-        return value, True
+        return TextExtractionSource(filename=filename,
+                                    blob=blob,
+                                    extension=extension)
@@ -33,21 +33,36 @@ using a data dictionary.**
 # Imports
 # =============================================================================
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import logging
+import queue
 import random
 import sys
+import threading
 from datetime import datetime
-from typing import Any, Dict, Iterable, Generator, List, Tuple, Union
+from typing import (
+    Any, Dict, Iterable, Generator, List, Optional, Set, Tuple, Union,
+)
 
 from cardinal_pythonlib.datetimefunc import get_now_utc_pendulum
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.sqlalchemy.core_query import count_star, exists_plain
+from cardinal_pythonlib.sqlalchemy.dialect import SqlaDialectName
 from cardinal_pythonlib.sqlalchemy.schema import (
     add_index,
     get_column_names,
+    index_exists,
 )
+from cardinal_pythonlib.timing import MultiTimer, MultiTimerContext, timer
 from sortedcontainers import SortedSet
-from sqlalchemy.schema import Column, Index, MetaData, Table
+from sqlalchemy.engine.base import Connection, Engine
+from sqlalchemy.engine.result import RowProxy
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.session import Session
+from sqlalchemy.schema import Column, DDL, Index, MetaData, Table
 from sqlalchemy.sql import column, func, or_, select, table, text
+from sqlalchemy.sql.expression import ColumnElement, Delete, Select
 
 from crate_anon.anonymise.config_singleton import config
 from crate_anon.anonymise.constants import (
@@ -55,27 +70,72 @@ from crate_anon.anonymise.constants import (
     DEFAULT_CHUNKSIZE,
     DEFAULT_REPORT_EVERY,
     INDEX,
+    MAX_PKS_PER_DELETE,
+    MAX_WORK_QUEUE_RANGES_PER_TABLE,
     TABLE_KWARGS,
     SEP,
 )
 from crate_anon.anonymise.models import (
+    ExtractedTextCacheEntry,
     OptOutMpid,
     OptOutPid,
     PatientInfo,
+    ProcessStatus,
+    ProgressLedgerEntry,
+    TimingRecord,
     TridRecord,
+    WorkQueueItem,
+    WorkQueueKind,
 )
-from crate_anon.anonymise.patient import Patient
+from crate_anon.anonymise.status import ProcessPhase, StatusPublisher
+from crate_anon.anonymise.patient import Patient, PatientBatchValues
 from crate_anon.anonymise.ddr import DataDictionaryRow
+from crate_anon.anonymise.extracttext import (
+    gen_extracted_in_process,
+    TextExtractionPool,
+    TextExtractionSource,
+)
+from crate_anon.anonymise.tableplan import TablePlan
+from crate_anon.anonymise.textcache import ExtractedTextCache
 from crate_anon.common.file_io import (
     gen_integers_from_file,
     gen_words_from_file,
 )
 from crate_anon.common.formatting import print_record_counts
-from crate_anon.common.parallel import is_my_job_by_hash, is_my_job_by_int
-from crate_anon.common.sql import matches_tabledef
+from crate_anon.common.parallel import (
+    allocate_longest_first,
+    is_my_job_by_hash,
+    is_my_job_by_int,
+)
+from crate_anon.common.sql import BatchedInserter, matches_tabledef
 
 log = logging.getLogger(__name__)
 
+TIMING_ALTER = "alter"
+TIMING_COMMIT_ADMIN = "commit_admin"
+TIMING_DEST_LOOKUP = "dest_lookup"
+TIMING_HASH_SOURCE_ROW = "hash_source_row"
+TIMING_SOURCE_COUNT = "source_count"
+TIMING_SOURCE_SELECT = "source_select"
+
+
+# =============================================================================
+# Timing
+# =============================================================================
+
+def get_timing_totals(
+        multitimer: MultiTimer) -> Dict[str, Tuple[int, float]]:
+    """
+    Returns the totals from a :class:`MultiTimer` (whose timers should all
+    have been stopped, e.g. by its ``report()`` method), as a dictionary
+    mapping timer name to ``n_calls, total_s``.
+    """
+    # noinspection PyProtectedMember
+    return {
+        name: (multitimer._count[name], duration.total_seconds())
+        for name, duration in multitimer._totaldurations.items()
+    }
+
 
 # =============================================================================
 # Database queries
@@ -117,6 +177,125 @@ def identical_record_exists_by_pk(dest_table: str,
                         column(pkfield) == pkvalue)
 
 
+class DestinationRecordLookup(object):
+    """
+    Bulk alternative to :func:`identical_record_exists_by_hash` and
+    :func:`identical_record_exists_by_pk`, for incremental updates.
+
+    Rather than querying the destination once per source row, we fetch
+    ``(pk, source_hash)`` pairs from the destination table in bulk, and answer
+    subsequent questions from memory.
+
+    - If ``restriction`` is given (e.g. "rows with this patient's RID"), all
+      matching destination records are fetched in one query, on first use.
+    - Otherwise, if ``window_size`` is positive and the PK is an integer, PKs
+      are fetched in aligned windows of ``window_size`` PK values, so memory
+      use stays bounded. This works best if the source rows are processed in
+      PK order, so each window is fetched once.
+    - Otherwise, we fall back to one query per source row.
+    """
+    def __init__(self,
+                 dest_table: str,
+                 pkfield: str,
+                 with_hash: bool,
+                 restriction: ColumnElement = None,
+                 window_size: int = 0,
+                 tasknum: int = 0,
+                 ntasks: int = 1,
+                 pk_range: Tuple[int, int] = None) -> None:
+        """
+        Args:
+            dest_table: name of the destination table
+            pkfield: name of the primary key (PK) column in the destination
+                table
+            with_hash: fetch the source hash column too?
+            restriction: optional SQLAlchemy WHERE condition restricting the
+                destination records of interest (e.g. to one patient)
+            window_size: number of integer PK values per fetch, in the
+                absence of ``restriction``; 0 to disable windowing
+            tasknum: task number of this process (for dividing up work)
+            ntasks: total number of processes (for dividing up work); if >1,
+                windowed fetches are restricted to
+                ``pk % ntasks == tasknum``, as for :func:`gen_rows`
+            pk_range: optional ``first, last`` tuple (inclusive); if given,
+                windowed fetches are restricted to this range of PKs, as for
+                :func:`gen_rows`
+        """
+        self.dest_table = dest_table
+        self.pkfield = pkfield
+        self.with_hash = with_hash
+        self.restriction = restriction
+        self.window_size = window_size
+        self.tasknum = tasknum
+        self.ntasks = ntasks
+        self.pk_range = pk_range
+        self._records = None  # type: Optional[Dict[Any, Optional[str]]]
+        self._window_start = None  # type: Optional[int]
+
+    def _load(self, *conditions: ColumnElement) -> None:
+        """
+        Fetches ``(pk, source_hash)`` pairs (or just PKs) matching the
+        conditions, replacing any previously fetched records.
+        """
+        columns = [column(self.pkfield)]
+        if self.with_hash:
+            columns.append(column(config.source_hash_fieldname))
+        q = select(columns).select_from(table(self.dest_table))
+        for condition in conditions:
+            q = q.where(condition)
+        result = config.destdb.session.execute(q)
+        if self.with_hash:
+            self._records = {row[0]: row[1] for row in result}
+        else:
+            self._records = {row[0]: None for row in result}
+
+    def _loaded_for(self, pkvalue: Any) -> bool:
+        """
+        Ensures that the records relevant to ``pkvalue`` are in memory, if
+        possible.
+
+        Returns:
+            whether we can answer questions about ``pkvalue`` from memory
+        """
+        if self.restriction is not None:
+            if self._records is None:
+                self._load(self.restriction)
+            return True
+        if self.window_size > 0 and isinstance(pkvalue, int):
+            start = pkvalue - pkvalue % self.window_size
+            if start != self._window_start:
+                pkcol = column(self.pkfield)
+                conditions = [pkcol >= start,
+                              pkcol < start + self.window_size]
+                if self.ntasks > 1:
+                    conditions.append(pkcol % self.ntasks == self.tasknum)
+                if self.pk_range is not None:
+                    conditions.append(pkcol.between(*self.pk_range))
+                self._load(*conditions)
+                self._window_start = start
+            return True
+        return False
+
+    def exists_by_hash(self, pkvalue: Any, hashvalue: str) -> bool:
+        """
+        Is there a destination record with this PK and source hash?
+        """
+        if not self._loaded_for(pkvalue):
+            return identical_record_exists_by_hash(
+                self.dest_table, self.pkfield, pkvalue, hashvalue)
+        return (pkvalue in self._records and
+                self._records[pkvalue] == hashvalue)
+
+    def exists_by_pk(self, pkvalue: Any) -> bool:
+        """
+        Is there a destination record with this PK?
+        """
+        if not self._loaded_for(pkvalue):
+            return identical_record_exists_by_pk(
+                self.dest_table, self.pkfield, pkvalue)
+        return pkvalue in self._records
+
+
 # =============================================================================
 # Database actions
 # =============================================================================
@@ -208,6 +387,17 @@ def delete_dest_rows_with_no_src_row(
         log.info("... Table marked as addition-only; not deleting anything")
         return
 
+    if (config.incremental_delete_by_merge and
+            config.dd.get_int_pk_ddr(srcdbname, src_table) is pkddr and
+            not pkddr.primary_pid and not pkddr.master_pid and
+            not pkddr.alter_methods):
+        # Source and destination PKs are the same integers, so we can
+        # compare them in order.
+        delete_dest_rows_with_no_src_row_by_merge(
+            srcdbname, src_table, pkddr, dest_table,
+            report_every=report_every, chunksize=chunksize)
+        return
+
     # Drop/create temporary table
     pkfield = 'srcpk'
     temptable = Table(
@@ -274,6 +464,194 @@ def delete_dest_rows_with_no_src_row(
     commit_destdb()
 
 
+def gen_int_pk_chunks_in_order(
+        session: Session,
+        sqla_table: Table,
+        pkname: str,
+        chunksize: int = DEFAULT_CHUNKSIZE) \
+        -> Generator[List[int], None, None]:
+    """
+    Generates the (integer) PK values of a table, in ascending order, in
+    chunks. Each chunk is fetched by a separate query that carries on from
+    the end of the previous one (keyset pagination), so no long-running
+    cursor is kept open and rows may be deleted between chunks.
+
+    Args:
+        session: SQLAlchemy session for the table's database
+        sqla_table: SQLAlchemy table
+        pkname: name of the PK column
+        chunksize: number of PKs per chunk
+
+    Yields:
+        non-empty lists of PKs
+    """
+    pkcol = sqla_table.columns[pkname]
+    last = None  # type: Optional[int]
+    while True:
+        q = (
+            select([pkcol]).
+            select_from(sqla_table).
+            order_by(pkcol).
+            limit(chunksize)
+        )
+        if last is not None:
+            q = q.where(pkcol > last)
+        pks = [row[0] for row in session.execute(q).fetchall()]
+        if not pks:
+            return
+        yield pks
+        last = pks[-1]
+
+
+def gen_in_background_thread(iterable: Iterable[Any],
+                             maxsize: int = 2) -> Generator[Any, None, None]:
+    """
+    Iterates through ``iterable`` in a background thread, reading ahead by up
+    to ``maxsize`` items, and yields its items. Exceptions in the background
+    thread are re-raised here. If we stop early, the background thread is
+    stopped too (after its current item).
+
+    Useful to overlap I/O from two databases.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item_ in iterable:
+                if not put((item_, None)):
+                    return
+            put((finished, None))
+        except Exception as e:
+            put((None, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exc = q.get()
+            if exc is not None:
+                raise exc
+            if item is finished:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def delete_dest_rows_with_no_src_row_by_merge(
+        srcdbname: str,
+        src_table: str,
+        pkddr: DataDictionaryRow,
+        dest_table: Table,
+        report_every: int = DEFAULT_REPORT_EVERY,
+        chunksize: int = DEFAULT_CHUNKSIZE) -> None:
+    """
+    Implements :func:`delete_dest_rows_with_no_src_row` for tables whose
+    integer PK is copied unchanged from source to destination, by reading
+    source and destination PKs in ascending order (simultaneously) and
+    merging the two lists. Destination PKs not in the source are deleted in
+    batches.
+
+    Args:
+        srcdbname: name (as per the data dictionary) of the source database
+        src_table: name of the source table
+        pkddr: data dictionary row for the source table's PK
+        dest_table: SQLAlchemy destination table
+        report_every: report to the Python log every *n* records
+        chunksize: fetch PKs in chunks of *n*
+    """
+    start = (
+        f"delete_dest_rows_with_no_src_row_by_merge: "
+        f"{srcdbname}.{src_table} -> {config.destdb.name}.{dest_table.name}: "
+    )
+    log.info(start + "comparing sorted PKs")
+    srcdb = config.sources[srcdbname]
+    destsession = config.destdb.session
+    srcchunks = gen_in_background_thread(gen_int_pk_chunks_in_order(
+        srcdb.session, srcdb.metadata.tables[src_table],
+        pkddr.src_field, chunksize))
+    srcpks = (pk for chunk in srcchunks for pk in chunk)
+    destpkcol = dest_table.columns[pkddr.dest_field]
+    orphans = []  # type: List[int]
+    n_dest = 0
+    n_deleted = 0
+
+    def delete_orphans() -> None:
+        nonlocal n_deleted
+        log.debug(start + f"... deleting {len(orphans)} records")
+        destsession.execute(dest_table.delete().where(destpkcol.in_(orphans)))
+        commit_destdb()
+        n_deleted += len(orphans)
+        orphans.clear()
+
+    try:
+        srcpk = next(srcpks, None)
+        for destchunk in gen_int_pk_chunks_in_order(
+                destsession, dest_table, pkddr.dest_field, chunksize):
+            for destpk in destchunk:
+                n_dest += 1
+                if report_every and n_dest % report_every == 0:
+                    log.debug(start + f"... dest row# {n_dest}")
+                while srcpk is not None and srcpk < destpk:
+                    srcpk = next(srcpks, None)
+                if srcpk != destpk:
+                    orphans.append(destpk)
+                    if len(orphans) >= MAX_PKS_PER_DELETE:
+                        delete_orphans()
+        if orphans:
+            delete_orphans()
+    finally:
+        srcchunks.close()  # stops the background thread
+    log.info(start + f"deleted {n_deleted} of {n_dest} records")
+
+
+def delete_in_batches(connection: Connection,
+                      query: Delete,
+                      batch_size: int = 0) -> int:
+    """
+    Executes a ``DELETE`` statement, optionally in batches of up to
+    ``batch_size`` rows (where the dialect supports that), committing after
+    each batch. That avoids very large transactions and (under SQL Server)
+    lock escalation.
+
+    Args:
+        connection: SQLAlchemy connection (not in a transaction)
+        query: SQLAlchemy ``DELETE`` statement
+        batch_size: maximum rows per batch, or 0 to delete in one go
+
+    Returns:
+        the number of rows deleted
+    """
+    dialect = connection.engine.dialect
+    if batch_size and dialect.name == SqlaDialectName.MSSQL:
+        batch_query = query.prefix_with(f"TOP ({batch_size})")
+    elif batch_size and dialect.name == SqlaDialectName.MYSQL:
+        # SQLAlchemy 1.3 can't add LIMIT to DELETE; our queries have no
+        # parameters, so we can safely compile them.
+        batch_query = text(
+            str(query.compile(dialect=dialect)) + f" LIMIT {batch_size}")
+    else:
+        return connection.execute(query).rowcount  # autocommits
+    n_deleted = 0
+    while True:
+        n = connection.execute(batch_query).rowcount  # autocommits
+        n_deleted += n
+        if n < batch_size:
+            return n_deleted
+
+
 def commit_destdb() -> None:
     """
     Execute a ``COMMIT`` on the destination database, and reset row counts.
@@ -285,7 +663,18 @@ def commit_admindb() -> None:
     """
     Execute a ``COMMIT`` on the admin database, which is using ORM sessions.
     """
-    config.admindb.session.commit()
+    with MultiTimerContext(timer, TIMING_COMMIT_ADMIN):
+        config.admindb.session.commit()
+
+
+def set_status_phase(phase: str) -> None:
+    """
+    Publishes what this process is now doing (see
+    :class:`crate_anon.anonymise.status.ProcessPhase`), if we are publishing
+    our progress.
+    """
+    if config.status_publisher is not None:
+        config.status_publisher.set_phase(phase)
 
 
 # =============================================================================
@@ -765,6 +1154,55 @@ def get_pids_from_field_limits(field: str, low: int, high: int) -> List[Any]:
 # script can scale to databases of arbitrary size.
 # =============================================================================
 
+def gen_patient_id_batches(
+        tasknum: int = 0,
+        ntasks: int = 1,
+        specified_pids: List[Any] = None,
+        batch_size: int = 1) -> Generator[List[Any], None, None]:
+    """
+    Generate patient IDs in batches, as per :func:`gen_patient_ids`.
+
+    Args:
+        tasknum: task number of this process (for dividing up work)
+        ntasks: total number of processes (for dividing up work)
+        specified_pids: optional list of PIDs to restrict ourselves to
+        batch_size: maximum number of PIDs per batch
+
+    Yields:
+        non-empty lists of patient IDs (PIDs)
+    """
+    batch = []  # type: List[Any]
+    for pid in gen_patient_ids(tasknum, ntasks,
+                               specified_pids=specified_pids):
+        batch.append(pid)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []  # type: List[Any]
+    if batch:
+        yield batch
+
+
+def gen_uncompleted_pid_batches(
+        pid_batches: Iterable[List[Any]],
+        completed_pids: Set[Any]) -> Generator[List[Any], None, None]:
+    """
+    When resuming an interrupted run, removes patients already completed (see
+    :class:`crate_anon.anonymise.models.ProgressLedgerEntry`) from batches of
+    patient IDs.
+
+    Args:
+        pid_batches: lists of patient IDs (PIDs)
+        completed_pids: PIDs of patients already completed
+
+    Yields:
+        non-empty lists of PIDs not yet completed
+    """
+    for pids in pid_batches:
+        pids = [pid for pid in pids if pid not in completed_pids]
+        if pids:
+            yield pids
+
+
 def gen_patient_ids(
         tasknum: int = 0,
         ntasks: int = 1,
@@ -899,6 +1337,45 @@ def estimate_count_patients() -> int:
     return count
 
 
+def gen_source_row_batches(dbname: str,
+                           query: Select) -> Generator[List[RowProxy],
+                                                       None, None]:
+    """
+    Executes a query on a source database and generates its results in
+    batches, via ``fetchmany()``.
+
+    If the source database's ``stream_results`` option is set, the query is
+    executed with a server-side (unbuffered) cursor, so that the database
+    driver does not load the entire result set into memory before the first
+    row is returned. (Note that, for some drivers, e.g. MySQL, no other query
+    can be issued on the same connection until the result has been consumed
+    or closed.)
+
+    Args:
+        dbname: name (as per the data dictionary) of the source database
+        query: SQLAlchemy SELECT query
+
+    Yields:
+        non-empty lists of result rows, of up to ``fetch_chunksize`` rows each
+
+    """
+    db = config.sources[dbname]
+    srccfg = db.srccfg
+    if srccfg.stream_results:
+        query = query.execution_options(stream_results=True)
+    with MultiTimerContext(timer, TIMING_SOURCE_SELECT):
+        result = db.session.execute(query)
+    try:
+        while True:
+            with MultiTimerContext(timer, TIMING_SOURCE_SELECT):
+                rows = result.fetchmany(srccfg.fetch_chunksize)
+            if not rows:
+                return
+            yield rows
+    finally:
+        result.close()  # http://docs.sqlalchemy.org/en/latest/core/connections.html  # noqa
+
+
 def gen_rows(dbname: str,
              sourcetable: str,
              sourcefields: Iterable[str],
@@ -906,7 +1383,10 @@ def gen_rows(dbname: str,
              intpkname: str = None,
              tasknum: int = 0,
              ntasks: int = 1,
-             debuglimit: int = 0) -> Generator[List[Any], None, None]:
+             debuglimit: int = 0,
+             order_by_intpk: bool = False,
+             pk_range: Tuple[int, int] = None) \
+        -> Generator[List[Any], None, None]:
     """
     Generates rows from a source table:
     - ... each row being a list of values
@@ -926,6 +1406,10 @@ def gen_rows(dbname: str,
         tasknum: task number of this process (for dividing up work)
         ntasks: total number of processes (for dividing up work)
         debuglimit: if specified, the maximum number of rows to process
+        order_by_intpk: return rows in order of ``intpkname``? (Otherwise, they
+            are not ordered.)
+        pk_range: optional ``first, last`` tuple (inclusive) restricting
+            ``intpkname``, for non-patient tables
 
     Yields:
         lists, each representing one row and containing values for each of the
@@ -933,41 +1417,51 @@ def gen_rows(dbname: str,
     """
     t = config.sources[dbname].metadata.tables[sourcetable]
     q = select([column(c) for c in sourcefields]).select_from(t)
-    # not ordered
+    # not ordered (unless order_by_intpk is set; see below)
 
     # Restrict to one patient?
     if pid is not None:
         pidcol_name = config.dd.get_pid_name(dbname, sourcetable)
         q = q.where(column(pidcol_name) == pid)
     else:
+        # For non-patient tables: a range of PKs?
+        if intpkname is not None and pk_range is not None:
+            q = q.where(column(intpkname).between(*pk_range))
         # For non-patient tables: divide up rows across tasks?
         if intpkname is not None and ntasks > 1:
             q = q.where(column(intpkname) % ntasks == tasknum)
             # This does not require a user-defined PK to be unique. But other
             # constraints do: see delete_dest_rows_with_no_src_row().
+    if intpkname is not None and order_by_intpk:
+        q = q.order_by(column(intpkname))
 
     db_table_tuple = (dbname, sourcetable)
-    result = config.sources[dbname].session.execute(q)
-    for row in result:
-        if 0 < debuglimit <= config.rows_inserted_per_table[db_table_tuple]:
-            if not config.warned_re_limits[db_table_tuple]:
-                log.warning(
-                    f"Table {dbname}.{sourcetable}: not fetching more than "
-                    f"{debuglimit} rows (in total for this process) "
-                    f"due to debugging limits")
-                config.warned_re_limits[db_table_tuple] = True
-            result.close()  # http://docs.sqlalchemy.org/en/latest/core/connections.html  # noqa
-            return
-        config.notify_src_bytes_read(sys.getsizeof(row))  # ... approximate!
-        yield list(row)
-        # yield dict(zip(row.keys(), row))
-        # see also http://stackoverflow.com/questions/19406859
-        config.rows_inserted_per_table[db_table_tuple] += 1
+    for rows in gen_source_row_batches(dbname, q):
+        # Byte count is per batch (rows of one query are the same shape).
+        config.notify_src_bytes_read(
+            sys.getsizeof(rows[0]) * len(rows),  # ... approximate!
+            n_rows=len(rows))
+        for row in rows:
+            if 0 < debuglimit <= config.rows_inserted_per_table[
+                    db_table_tuple]:
+                if not config.warned_re_limits[db_table_tuple]:
+                    log.warning(
+                        f"Table {dbname}.{sourcetable}: not fetching more "
+                        f"than {debuglimit} rows (in total for this process) "
+                        f"due to debugging limits")
+                    config.warned_re_limits[db_table_tuple] = True
+                return  # closes the generator, and thus the result
+            yield list(row)
+            # yield dict(zip(row.keys(), row))
+            # see also http://stackoverflow.com/questions/19406859
+            config.rows_inserted_per_table[db_table_tuple] += 1
 
 
 def count_rows(dbname: str,
                sourcetable: str,
-               pid: Union[int, str] = None) -> int:
+               pid: Union[int, str] = None,
+               intpkname: str = None,
+               pk_range: Tuple[int, int] = None) -> int:
     """
     Count the number of rows in a table for a given PID.
 
@@ -975,6 +1469,9 @@ def count_rows(dbname: str,
         dbname: name (as per the data dictionary) of the source database
         sourcetable: name of the source table
         pid: patient ID (PID)
+        intpkname: name of the integer PK column, for ``pk_range``
+        pk_range: optional ``first, last`` tuple (inclusive) restricting
+            ``intpkname``
 
     Returns:
         the number of records
@@ -986,7 +1483,10 @@ def count_rows(dbname: str,
     if pid is not None:
         pidcol_name = config.dd.get_pid_name(dbname, sourcetable)
         query = query.where(column(pidcol_name) == pid)
-    return session.execute(query).scalar()
+    elif intpkname is not None and pk_range is not None:
+        query = query.where(column(intpkname).between(*pk_range))
+    with MultiTimerContext(timer, TIMING_SOURCE_COUNT):
+        return session.execute(query).scalar()
 
 
 def gen_index_row_sets_by_table(
@@ -1076,9 +1576,202 @@ def gen_pks(srcdbname: str,
     db = config.sources[srcdbname]
     t = db.metadata.tables[tablename]
     q = select([column(pkname)]).select_from(t)
-    result = db.session.execute(q)
-    for row in result:
-        yield row[0]
+    for rows in gen_source_row_batches(srcdbname, q):
+        for row in rows:
+            yield row[0]
+
+
+# =============================================================================
+# Work queue, for distributing work dynamically across processes
+# =============================================================================
+
+def get_int_pk_ranges(srcdbname: str,
+                      tablename: str,
+                      pkname: str,
+                      range_size: int,
+                      max_ranges: int = None) -> List[Tuple[int, int]]:
+    """
+    Divides a table into contiguous ranges of its integer PK.
+
+    The ranges are aligned to multiples of ``range_size`` (so the same PK
+    always falls in the same range, even if rows are added while processes are
+    working out their ranges), and the range containing PK ``x`` can be
+    numbered ``x // range_size``. Ranges containing no rows are skipped, so a
+    sparse PK doesn't give a vast number of empty ranges.
+
+    Args:
+        srcdbname: name (as per the data dictionary) of the database
+        tablename: name of the table
+        pkname: name of the integer PK column
+        range_size: number of PK values (not necessarily rows) per range
+        max_ranges: if there would be more ranges than this, merge adjacent
+            ones (so they are no longer aligned, or all the same size)
+
+    Returns:
+        list of ``first, last`` tuples (inclusive), in order, covering all
+        rows; empty if the table is empty
+    """
+    session = config.sources[srcdbname].session
+    pkcol = column(pkname)
+    # One row per non-empty range. (SQL's modulo may truncate towards zero,
+    # unlike Python's, so ranges either side of zero may share a row; we
+    # work out the aligned ranges below.)
+    query = (
+        select([func.min(pkcol), func.max(pkcol)]).
+        select_from(table(tablename)).
+        where(pkcol.isnot(None)).
+        group_by(pkcol - pkcol % range_size)
+    )
+    firsts = set()  # type: Set[int]
+    for pk_min, pk_max in session.execute(query):
+        firsts.update(range(pk_min - pk_min % range_size, pk_max + 1,
+                            range_size))
+    ranges = [(first, first + range_size - 1) for first in sorted(firsts)]
+    if max_ranges and len(ranges) > max_ranges:
+        n_per_range = -(-len(ranges) // max_ranges)  # ceiling division
+        ranges = [
+            (ranges[i][0], ranges[min(i + n_per_range, len(ranges)) - 1][1])
+            for i in range(0, len(ranges), n_per_range)
+        ]
+    return ranges
+
+
+def fill_work_queue(specified_pids: List[Any] = None) -> None:
+    """
+    Empties and refills the work queue in the admin database (see
+    :class:`crate_anon.anonymise.models.WorkQueueItem`), for worker processes
+    that distribute work dynamically. Only run one copy of this!
+
+    The queue holds every patient, every non-patient table without an integer
+    PK, and ranges (of size ``config.nonpatient_pk_range_size``, or larger
+    for very big tables; see :func:`get_int_pk_ranges`) of every non-patient
+    table with an integer PK.
+
+    Args:
+        specified_pids: if specified, restrict to specific PIDs
+    """
+    log.info(SEP + "Filling work queue")
+    session = config.admindb.session
+    # noinspection PyUnresolvedReferences
+    WorkQueueItem.__table__.create(config.admindb.engine, checkfirst=True)
+    WorkQueueItem.clear(session)
+    n_patients = WorkQueueItem.add_patients(
+        session, gen_patient_ids(specified_pids=specified_pids))
+    log.info(f"... {n_patients} patients")
+    for (d, t, pkname) in gen_nonpatient_tables_with_int_pk():
+        ranges = get_int_pk_ranges(d, t, pkname,
+                                   config.nonpatient_pk_range_size,
+                                   max_ranges=MAX_WORK_QUEUE_RANGES_PER_TABLE)
+        WorkQueueItem.add_table_ranges(session, d, t, pkname, ranges)
+        log.info(f"... {len(ranges)} PK ranges for table {d}.{t}")
+    for (d, t) in gen_nonpatient_tables_without_int_pk():
+        WorkQueueItem.add_table(session, d, t)
+        log.info(f"... table {d}.{t}")
+    commit_admindb()
+
+
+def requeue_unfinished_work(incremental: bool = False) -> None:
+    """
+    Releases work-queue items that were claimed but not finished (e.g. when a
+    run was interrupted), so that worker processes will claim them again.
+    Items that were finished are not repeated. Only run this when no worker
+    processes are running.
+
+    Some of the work for unfinished items may have been committed already, so
+    (unless we are doing an incremental update, which copes with that) their
+    destination data is deleted first.
+
+    Args:
+        incremental: perform an incremental update, rather than a full run?
+    """
+    log.info(SEP + "Releasing unfinished work-queue items")
+    session = config.admindb.session
+    if not incremental:
+        items = WorkQueueItem.get_unfinished(session)
+        wipe_destination_data_for_patients([
+            item.pid for item in items
+            if item.kind == WorkQueueKind.PATIENT
+        ])
+        for item in items:
+            if item.kind == WorkQueueKind.TABLE:
+                wipe_destination_data_for_nonpatient_unit(
+                    item.src_db, item.src_table,
+                    pkname=item.pk_name,
+                    pk_range=(
+                        (item.pk_first, item.pk_last)
+                        if item.pk_name is not None else None
+                    ))
+    n_released = WorkQueueItem.release_unfinished(session)
+    commit_admindb()
+    log.info(f"... released {n_released} items")
+
+
+def gen_work_queue_items(kind: str, batch_size: int) \
+        -> Generator[List[WorkQueueItem], None, None]:
+    """
+    Claims batches of items from the work queue, until there are none left.
+
+    Once the caller has finished with a batch (i.e. when the next batch is
+    requested), all outstanding work is committed and the batch is marked as
+    done. (So, if a process is interrupted, at worst the batch it was working
+    on is repeated.)
+
+    Args:
+        kind: a :class:`crate_anon.anonymise.models.WorkQueueKind` value
+        batch_size: maximum number of items per batch
+
+    Yields:
+        non-empty lists of claimed items
+    """
+    session = config.admindb.session
+    while True:
+        items = WorkQueueItem.claim_items(session, kind, batch_size)
+        if not items:
+            return
+        yield items
+        commit_destdb()
+        WorkQueueItem.mark_done(session, items)
+
+
+# =============================================================================
+# Extracted text cache
+# =============================================================================
+
+def get_extracted_text_cache(pid: Union[int, str] = None) \
+        -> Optional[ExtractedTextCache]:
+    """
+    Returns an object to fetch/store extracted text in the cache, or ``None``
+    if the cache is not in use (see the config option
+    ``extracted_text_cache_max_mb``).
+
+    Args:
+        pid: PID of the patient being processed, if any
+    """
+    if not config.extracted_text_cache_max_mb:
+        return None
+    return ExtractedTextCache(
+        engine=config.admindb.engine,
+        passphrase=config.extracted_text_cache_encryption_phrase,
+        plain=config.extract_text_plain,
+        width=config.extract_text_width,
+        pid=pid
+    )
+
+
+def prune_extracted_text_cache() -> None:
+    """
+    Deletes the least recently used entries from the extracted text cache,
+    to bring it within its size limit.
+    """
+    if not config.extracted_text_cache_max_mb:
+        log.info("Extracted text cache not in use")
+        return
+    session = config.admindb.session
+    max_bytes = config.extracted_text_cache_max_mb * 1024 * 1024
+    n_deleted = ExtractedTextCacheEntry.prune(session, max_bytes)
+    commit_admindb()
+    log.info(f"Pruned extracted text cache: deleted {n_deleted} entries; "
+             f"{ExtractedTextCacheEntry.total_bytes(session)} bytes remain")
 
 
 # =============================================================================
@@ -1088,6 +1781,23 @@ def gen_pks(srcdbname: str,
 # - KEY THREADING RULE: ALL THREADS MUST HAVE FULLY INDEPENDENT DATABASE
 #   CONNECTIONS.
 
+@lru_cache(maxsize=None)
+def get_table_plan(sourcedbname: str,
+                   sourcetable: str,
+                   patient_table: bool,
+                   free_text_limit: int = None,
+                   exclude_scrubbed_fields: bool = False) -> TablePlan:
+    """
+    Returns the (cached) :class:`crate_anon.anonymise.tableplan.TablePlan`
+    for processing a source table. Arguments are as for
+    :class:`crate_anon.anonymise.tableplan.TablePlan`.
+    """
+    return TablePlan(config, sourcedbname, sourcetable,
+                     patient_table=patient_table,
+                     free_text_limit=free_text_limit,
+                     exclude_scrubbed_fields=exclude_scrubbed_fields)
+
+
 def process_table(sourcedbname: str,
                   sourcetable: str,
                   patient: Patient = None,
@@ -1096,7 +1806,8 @@ def process_table(sourcedbname: str,
                   tasknum: int = 0,
                   ntasks: int = 1,
                   free_text_limit: int = None,
-                  exclude_scrubbed_fields: bool = False) -> None:
+                  exclude_scrubbed_fields: bool = False,
+                  pk_range: Tuple[int, int] = None) -> None:
     """
     Process a table. This can either be a patient table (in which case the
     patient's scrubber is applied and only rows for that patient are processed)
@@ -1122,6 +1833,10 @@ def process_table(sourcedbname: str,
             If specified, any text field longer than this will be excluded
         exclude_scrubbed_fields:
             Exclude all text fields which are being scrubbed.
+        pk_range:
+            for non-patient tables: optional ``first, last`` tuple (inclusive)
+            restricting ``intpkname`` (e.g. a range claimed from the work
+            queue)
     """
     start = f"process_table: {sourcedbname}.{sourcetable}:"
     pid = None if patient is None else patient.pid
@@ -1136,194 +1851,472 @@ def process_table(sourcedbname: str,
     else:
         debuglimit = 0
 
-    ddrows = config.dd.get_rows_for_src_table(sourcedbname, sourcetable)
-    if all(ddr.omit for ddr in ddrows):
-        return
-    addhash = any(ddr.add_src_hash for ddr in ddrows)
-    addtrid = any(ddr.primary_pid and not ddr.omit for ddr in ddrows)
-    constant = any(ddr.constant for ddr in ddrows)
-    # If addhash or constant is true AND we are not omitting all rows, then
-    # the non-omitted rows will include the source PK (by the data dictionary's
-    # validation process).
-    ddrows = [ddr for ddr in ddrows
-              if (
-                  (not ddr.omit) or  # used for data
-                  (addhash and ddr.scrub_src) or  # used for hash
-                  ddr.inclusion_values or  # used for filter
-                  ddr.exclusion_values  # used for filter
-              )]
-    # Exclude all text fields over a chosen length
-    if free_text_limit is not None:
-        ddrows = [ddr for ddr in ddrows
-                  if (ddr.src_textlength is None) or
-                  (ddr.src_textlength <= free_text_limit)]
-    # Exclude all scrubbed fields if requested
-    if exclude_scrubbed_fields:
-        ddrows = [ddr for ddr in ddrows
-                  if (not ddr.src_is_textual) or (not ddr.being_scrubbed)]
-    if not ddrows:
+    plan = get_table_plan(sourcedbname, sourcetable,
+                          patient_table=patient is not None,
+                          free_text_limit=free_text_limit,
+                          exclude_scrubbed_fields=exclude_scrubbed_fields)
+    if plan.nothing_to_do:
         # No columns to process at all.
         return
-    dest_table = ddrows[0].dest_table
-    sourcefields = []  # type: List[str]
-    pkfield_index = None
-    src_pk_name = None
-    dest_pk_name = None
-    for i, ddr in enumerate(ddrows):
-        # log.debug(f"DD row: {str(ddr)}")
-        if ddr.pk:
-            pkfield_index = i
-            src_pk_name = ddr.src_field
-            dest_pk_name = ddr.dest_field
-        sourcefields.append(ddr.src_field)
-    srchash = None
-    timefield = config.timefield
-    add_mrid_wherever_rid_added = config.add_mrid_wherever_rid_added
-    mrid_fieldname = config.master_research_id_fieldname
-    sqla_table = config.dd.get_dest_sqla_table(dest_table, timefield,
-                                               add_mrid_wherever_rid_added)
+    # Publish progress as we go through non-patient tables. (For patients,
+    # we do so between batches, when the admin database has been
+    # committed; see patient_processing_fn().)
+    status_publisher = config.status_publisher
+    if status_publisher is not None:
+        status_publisher.set_table(sourcedbname, sourcetable)
+        if patient is not None:
+            status_publisher = None
+    ddrows = plan.ddrows
+    addhash = plan.addhash
+    constant = plan.constant
+    dest_table = plan.dest_table
+    pkfield_index = plan.pkfield_index
+    src_pk_name = plan.src_pk_name
+    dest_pk_name = plan.dest_pk_name
+    dest_rid_name = plan.dest_rid_name
+    timefield = plan.timefield
     session = config.destdb.session
+    inserter = BatchedInserter(
+        session=session,
+        statement=plan.insert_statement,
+        max_rows_per_batch=config.max_rows_per_insert,
+        max_bytes_per_batch=config.max_bytes_per_insert,
+        on_flush=config.notify_dest_db_transaction  # may trigger a COMMIT
+    )
+
+    # For incremental updates, look up existing destination records in bulk.
+    dest_lookup = None  # type: Optional[DestinationRecordLookup]
+    order_by_intpk = False
+    if incremental and (addhash or constant):
+        if patient is not None:
+            # All destination records for this patient, or one query per row
+            # if we can't identify them.
+            dest_lookup = DestinationRecordLookup(
+                dest_table=dest_table,
+                pkfield=dest_pk_name,
+                with_hash=addhash,
+                restriction=(
+                    column(dest_rid_name) == patient.rid
+                    if dest_rid_name and config.incremental_pk_window > 0
+                    else None
+                )
+            )
+        else:
+            # Windows of integer PKs; fetch source rows in the same order.
+            dest_lookup = DestinationRecordLookup(
+                dest_table=dest_table,
+                pkfield=dest_pk_name,
+                with_hash=addhash,
+                window_size=config.incremental_pk_window,
+                tasknum=tasknum,
+                ntasks=ntasks,
+                pk_range=pk_range
+            )
+            order_by_intpk = (intpkname is not None and
+                              config.incremental_pk_window > 0)
 
     # Count what we'll do, so we can give a better indication of progress
-    count = count_rows(sourcedbname, sourcetable, pid)
-    n = 0
-    recnum = tasknum or 0
+    count = count_rows(sourcedbname, sourcetable, pid,
+                       intpkname=intpkname, pk_range=pk_range)
+
+    def gen_rows_to_process() -> Generator[Tuple[List[Any], Optional[str]],
+                                           None, None]:
+        """
+        Yields ``row, srchash`` for source rows that pass the row filters and
+        are not unchanged (for incremental updates), logging progress.
+        """
+        n = 0
+        recnum = tasknum or 0
+        for row_ in gen_rows(sourcedbname, sourcetable, plan.sourcefields,
+                             pid, debuglimit=debuglimit,
+                             intpkname=intpkname, tasknum=tasknum,
+                             ntasks=ntasks, order_by_intpk=order_by_intpk,
+                             pk_range=pk_range):
+            n += 1
+            if n % config.report_every_n_rows == 0:
+                log.info(
+                    f"{start} processing record {recnum + 1}/{count}"
+                    f"{' for this patient' if pid is not None else ''} "
+                    f"({config.overall_progress()})")
+            if status_publisher is not None:
+                status_publisher.maybe_publish()
+            recnum += ntasks or 1
+            if plan.skip_row(row_):
+                # Inclusion/exclusion filters come first, before any hashing
+                # or destination lookups.
+                # log.debug("skipping row based on inclusion/exclusion values")
+                continue
+            srchash_ = None
+            if addhash:
+                with MultiTimerContext(timer, TIMING_HASH_SOURCE_ROW):
+                    srchash_ = config.hash_object(row_)
+                if incremental:
+                    with MultiTimerContext(timer, TIMING_DEST_LOOKUP):
+                        unchanged = dest_lookup.exists_by_hash(
+                            row_[pkfield_index], srchash_)
+                else:
+                    unchanged = False
+                if unchanged:
+                    log.debug(
+                        f"... ... skipping unchanged record (identical by "
+                        f"hash): "
+                        f"{sourcedbname}.{sourcetable}.{src_pk_name} = "
+                        f"(destination) {dest_table}.{dest_pk_name} = "
+                        f"{row_[pkfield_index]}")
+                    continue
+            if constant:
+                if incremental:
+                    with MultiTimerContext(timer, TIMING_DEST_LOOKUP):
+                        unchanged = dest_lookup.exists_by_pk(
+                            row_[pkfield_index])
+                else:
+                    unchanged = False
+                if unchanged:
+                    log.debug(
+                        f"... ... skipping unchanged record (identical by PK "
+                        f"and marked as constant): "
+                        f"{sourcedbname}.{sourcetable}.{src_pk_name} = "
+                        f"(destination) {dest_table}.{dest_pk_name} = "
+                        f"{row_[pkfield_index]}")
+                    continue
+            yield row_, srchash_
+
+    # Fields whose first alteration is text extraction can have their
+    # documents converted ahead of time by a pool of worker processes, and/or
+    # fetched from the extracted text cache.
+    extract_indexes = plan.extract_indexes
+    pool = None  # type: Optional[TextExtractionPool]
+    text_cache = None  # type: Optional[ExtractedTextCache]
+    if extract_indexes:
+        pool = config.get_text_extraction_pool()
+        text_cache = get_extracted_text_cache(pid)
+    prefetch_text = pool is not None or text_cache is not None
+    if prefetch_text:
+
+        def get_extraction_sources(
+                item: Tuple[List[Any], Optional[str]]) \
+                -> Dict[int, TextExtractionSource]:
+            row_ = item[0]
+            sources = {}  # type: Dict[int, TextExtractionSource]
+            for i_ in extract_indexes:
+                am = ddrows[i_].alter_methods[0]
+                source = am.get_text_extraction_source(row_[i_], row_, ddrows)
+                if source is not None:
+                    sources[i_] = source
+            return sources
+
+        if pool is not None:
+            rows_to_process = pool.gen_extracted(
+                gen_rows_to_process(), get_extraction_sources,
+                cache=text_cache)
+        else:
+            rows_to_process = gen_extracted_in_process(
+                gen_rows_to_process(), get_extraction_sources,
+                plain=config.extract_text_plain,
+                width=config.extract_text_width,
+                cache=text_cache)
+    else:
+        rows_to_process = ((item, {}) for item in gen_rows_to_process())
 
     # Process the rows
-    for row in gen_rows(sourcedbname, sourcetable, sourcefields,
-                        pid, debuglimit=debuglimit,
-                        intpkname=intpkname, tasknum=tasknum, ntasks=ntasks):
-        n += 1
-        if n % config.report_every_n_rows == 0:
-            log.info(
-                f"{start} processing record {recnum + 1}/{count}"
-                f"{' for this patient' if pid is not None else ''} "
-                f"({config.overall_progress()})")
-        recnum += ntasks or 1
-        if addhash:
-            srchash = config.hash_object(row)
-            if incremental and identical_record_exists_by_hash(
-                    dest_table, dest_pk_name, row[pkfield_index], srchash):
-                log.debug(
-                    f"... ... skipping unchanged record (identical by hash): "
-                    f"{sourcedbname}.{sourcetable}.{src_pk_name} = "
-                    f"(destination) {dest_table}.{dest_pk_name} = "
-                    f"{row[pkfield_index]}")
-                continue
-        if constant:
-            if incremental and identical_record_exists_by_pk(
-                    dest_table, dest_pk_name, row[pkfield_index]):
-                log.debug(
-                    f"... ... skipping unchanged record (identical by PK and "
-                    f"marked as constant): "
-                    f"{sourcedbname}.{sourcetable}.{src_pk_name} = "
-                    f"(destination) {dest_table}.{dest_pk_name} = "
-                    f"{row[pkfield_index]}")
-                continue
+    columns = plan.columns
+    for (row, srchash), extracted in rows_to_process:
         destvalues = {}  # type: Dict[str, Any]
-        skip_row = False
-        for i, ddr in enumerate(ddrows):
-            value = row[i]
-            if ddr.skip_row_by_value(value):
-                # log.debug("skipping row based on inclusion/exclusion values")
-                skip_row = True
-                break  # skip row
-            # NOTE: would be most efficient if ddrows were ordered with
-            # inclusion/exclusion fields first. (Not yet done automatically.)
-            if ddr.omit:
-                continue  # skip column
-
-            if ddr.primary_pid:
-                assert(value == patient.pid)
-                value = patient.rid
-            elif ddr.master_pid:
-                value = config.encrypt_master_pid(value)
-
-            for alter_method in ddr.alter_methods:
-                value, skiprow = alter_method.alter(
-                    value=value, ddr=ddr, row=row,
-                    ddrows=ddrows, patient=patient)
-                if skiprow:
-                    break  # from alter method loop
-
-            if skip_row:
-                break  # from data dictionary row (field) loop
-
-            destvalues[ddr.dest_field] = value
-
-            if timefield:
-                destvalues[timefield] = datetime.utcnow()
-
-        if skip_row or not destvalues:
+        scrub_fields = []  # type: List[str]
+        scrub_texts = []  # type: List[str]
+        with MultiTimerContext(timer, TIMING_ALTER):
+            for col in columns:
+                value = row[col.index]
+
+                if col.primary_pid:
+                    assert(value == patient.pid)
+                    value = patient.rid
+                elif col.master_pid:
+                    value = config.encrypt_master_pid(value)
+
+                if prefetch_text and col.extract_text_first:
+                    # Text already extracted (or found not to be extractable).
+                    extracted_text = extracted.get(col.index, (None, False))
+                else:
+                    extracted_text = None
+                for alter_func in col.alter_funcs:
+                    value, skiprow = alter_func(value, row, patient,
+                                                extracted_text)
+                    extracted_text = None  # only for the first alter method
+                    if skiprow:
+                        break  # from alter method loop
+
+                if col.scrub_together and value is not None:
+                    scrub_fields.append(col.dest_field)
+                    scrub_texts.append(str(value))
+                    # ... destination value filled in below
+                destvalues[col.dest_field] = value
+
+        if not destvalues:
             continue  # next row
+        if timefield:
+            destvalues[timefield] = datetime.utcnow()
+
+        if scrub_texts:
+            for dest_field, scrubbed in zip(scrub_fields,
+                                            patient.scrub_many(scrub_texts)):
+                destvalues[dest_field] = scrubbed
 
         if addhash:
             destvalues[config.source_hash_fieldname] = srchash
-        if addtrid:
+        if plan.addtrid:
             destvalues[config.trid_fieldname] = patient.trid
-            if add_mrid_wherever_rid_added:
-                destvalues[mrid_fieldname] = patient.mrid
-
-        q = sqla_table.insert_on_duplicate().values(destvalues)
-        session.execute(q)
+            if plan.add_mrid_wherever_rid_added:
+                destvalues[config.master_research_id_fieldname] = patient.mrid
 
-        # Trigger an early commit?
-        config.notify_dest_db_transaction(
-            n_rows=1, n_bytes=sys.getsizeof(destvalues))  # ... approximate!
+        # Buffer the row; batches are written (and may trigger an early
+        # commit) when full.
+        inserter.add(destvalues,
+                     n_bytes=sys.getsizeof(destvalues))  # ... approximate!
         # ... quicker than e.g. len(repr(...)), as judged by a timeit() call.
 
+    inserter.flush()
     log.debug(f"{start} finished: pid={pid}")
     commit_destdb()
 
 
-def create_indexes(tasknum: int = 0, ntasks: int = 1) -> None:
+# Rough relative costs of building indexes; see estimate_index_cost().
+INDEX_COST_NONTEXT_WIDTH = 8  # e.g. an integer or a date
+INDEX_COST_MAX_TEXT_WIDTH = 1000  # long text fields are rarely full
+INDEX_COST_FULLTEXT_FACTOR = 10  # full-text indexes are much slower
+
+# Options for building indexes with less locking, tried in order (with the
+# last, empty, option being the fallback) for each dialect.
+ONLINE_INDEX_OPTIONS = {
+    SqlaDialectName.MSSQL: [
+        " WITH (ONLINE = ON, SORT_IN_TEMPDB = ON)",  # Enterprise edition
+        " WITH (SORT_IN_TEMPDB = ON)",
+        "",
+    ],
+    SqlaDialectName.MYSQL: [
+        " ALGORITHM=INPLACE LOCK=NONE",
+        " ALGORITHM=INPLACE",
+        "",
+    ],
+}
+ONLINE_FULLTEXT_INDEX_OPTIONS = {
+    SqlaDialectName.MYSQL: [
+        ", ALGORITHM=INPLACE",
+        "",
+    ],
+}
+
+
+class IndexBuildJob(object):
+    """
+    An index to be built on a destination table. (Under SQL Server, there is
+    one full-text index per table, which may cover several columns.)
+    """
+    def __init__(self,
+                 columns: List[Column],
+                 unique: bool = False,
+                 fulltext: bool = False,
+                 length: int = None,
+                 cost: float = 0) -> None:
+        """
+        Args:
+            columns: SQLAlchemy columns to index (all in the same table)
+            unique: make a ``UNIQUE`` index?
+            fulltext: make a ``FULLTEXT`` index?
+            length: index length to use, if any
+            cost: estimated (relative) cost of building the index
+        """
+        assert columns
+        self.columns = columns
+        self.unique = unique
+        self.fulltext = fulltext
+        self.length = length
+        self.cost = cost
+
+    def __str__(self) -> str:
+        colnames = ", ".join(c.name for c in self.columns)
+        return (
+            f"{'full-text ' if self.fulltext else ''}index on "
+            f"{self.columns[0].table.name}({colnames})"
+        )
+
+
+def estimate_index_cost(nrows: int,
+                        width: Optional[int],
+                        fulltext: bool = False) -> float:
     """
-    Create indexes for the destination tables.
+    Estimates the relative cost of building an index, from the number of rows
+    in the table and the width of the column.
 
     Args:
-        tasknum: task number of this process (for dividing up work)
-        ntasks: total number of processes (for dividing up work)
+        nrows: number of rows in the table
+        width: (maximum) length of a text column, or index length, or
+            ``None`` for non-text columns
+        fulltext: is it a ``FULLTEXT`` index?
     """
-    log.info(SEP + "Create indexes")
-    engine = config.get_destdb_engine_outside_transaction()
-    mssql = engine.dialect.name == 'mssql'
-    mssql_fulltext_columns_by_table = []  # type: List[List[Column]]
-    for (tablename, tablerows) in gen_index_row_sets_by_table(tasknum=tasknum,
-                                                              ntasks=ntasks):
+    if width:
+        width = min(width, INDEX_COST_MAX_TEXT_WIDTH)
+    else:
+        width = INDEX_COST_NONTEXT_WIDTH
+    cost = nrows * width
+    if fulltext:
+        cost *= INDEX_COST_FULLTEXT_FACTOR
+    return cost
+
+
+def get_index_build_jobs(engine: Engine) -> List[IndexBuildJob]:
+    """
+    Returns all the indexes to be built on destination tables, with their
+    estimated costs.
+
+    Args:
+        engine: SQLAlchemy engine for the destination database
+    """
+    mssql = engine.dialect.name == SqlaDialectName.MSSQL
+    session = config.destdb.session
+    jobs = []  # type: List[IndexBuildJob]
+    for tablename, tablerows in gen_index_row_sets_by_table():
         sqla_table = config.dd.get_dest_sqla_table(
             tablename, config.timefield, config.add_mrid_wherever_rid_added)
+        nrows = count_star(session, tablename)
         mssql_fulltext_columns = []  # type: List[Column]
+        mssql_fulltext_cost = 0
         for tr in tablerows:
             sqla_column = sqla_table.columns[tr.dest_field]
             fulltext = (tr.index is INDEX.FULLTEXT)
+            cost = estimate_index_cost(
+                nrows, tr.indexlen or tr.src_textlength, fulltext)
             if fulltext and mssql:
                 # Special processing: we can only create one full-text index
                 # per table under SQL Server, but it can cover multiple
                 # columns; see below
                 mssql_fulltext_columns.append(sqla_column)
+                mssql_fulltext_cost += cost
             else:
-                add_index(engine=engine,
-                          sqla_column=sqla_column,
-                          unique=(tr.index is INDEX.UNIQUE),
-                          fulltext=fulltext,
-                          length=tr.indexlen)
+                jobs.append(IndexBuildJob(
+                    columns=[sqla_column],
+                    unique=(tr.index is INDEX.UNIQUE),
+                    fulltext=fulltext,
+                    length=tr.indexlen,
+                    cost=cost))
             # Extra indexes for TRID, MRID?
             if tr.primary_pid:
-                add_index(engine, sqla_table.columns[config.trid_fieldname],
-                          unique=(tr.index is INDEX.UNIQUE))
+                jobs.append(IndexBuildJob(
+                    columns=[sqla_table.columns[config.trid_fieldname]],
+                    unique=(tr.index is INDEX.UNIQUE),
+                    cost=estimate_index_cost(nrows, None)))
                 if config.add_mrid_wherever_rid_added:
-                    add_index(
-                        engine,
-                        sqla_table.columns[config.master_research_id_fieldname],  # noqa
-                        unique=False  # see docs
-                    )
+                    jobs.append(IndexBuildJob(
+                        columns=[
+                            sqla_table.columns[
+                                config.master_research_id_fieldname]
+                        ],
+                        unique=False,  # see docs
+                        cost=estimate_index_cost(nrows, None)))
         if mssql_fulltext_columns:
-            mssql_fulltext_columns_by_table.append(mssql_fulltext_columns)
-    # Special processing for SQL Server FULLTEXT indexes, if any:
-    for multiple_sqla_columns in mssql_fulltext_columns_by_table:
-        add_index(engine=engine,
-                  multiple_sqla_columns=multiple_sqla_columns,
-                  fulltext=True)
+            jobs.append(IndexBuildJob(columns=mssql_fulltext_columns,
+                                      fulltext=True,
+                                      cost=mssql_fulltext_cost))
+    commit_destdb()
+    return jobs
+
+
+def build_index(engine: Engine, job: IndexBuildJob) -> None:
+    """
+    Builds an index. Where the database supports it, we ask for the index to
+    be built "online" (with less locking) or with other options that make it
+    faster, falling back to a plain build if those options are refused.
+
+    Args:
+        engine: SQLAlchemy engine for the destination database, outside a
+            transaction
+        job: the index to build
+    """
+    dialect = engine.dialect.name
+    if job.fulltext:
+        options_list = ONLINE_FULLTEXT_INDEX_OPTIONS.get(dialect)
+    else:
+        options_list = ONLINE_INDEX_OPTIONS.get(dialect)
+    if not options_list:
+        # Use the standard method.
+        if len(job.columns) == 1:
+            add_index(engine=engine,
+                      sqla_column=job.columns[0],
+                      unique=job.unique,
+                      fulltext=job.fulltext,
+                      length=job.length)
+        else:
+            add_index(engine=engine,
+                      multiple_sqla_columns=job.columns,
+                      fulltext=job.fulltext)
+        return
+
+    # Same naming conventions as add_index():
+    preparer = engine.dialect.identifier_preparer
+    sqla_table = job.columns[0].table
+    colnames = [c.name for c in job.columns]
+    idxname = ("_idxft_" if job.fulltext else "_idx_") + "_".join(colnames)
+    if index_exists(engine, sqla_table.name, idxname):
+        log.info(f"Skipping creation of index {idxname} on table "
+                 f"{sqla_table.name}; already exists")
+        return
+    colspecs = []  # type: List[str]
+    for c in job.columns:
+        colspec = preparer.quote(c.name)
+        if job.length and dialect == SqlaDialectName.MYSQL:
+            colspec += f"({job.length})"
+        colspecs.append(colspec)
+    if job.fulltext:  # MySQL
+        stem = (
+            f"ALTER TABLE {preparer.format_table(sqla_table)} "
+            f"ADD FULLTEXT INDEX {preparer.quote(idxname)} "
+            f"({', '.join(colspecs)})"
+        )
+    else:
+        stem = (
+            f"CREATE {'UNIQUE ' if job.unique else ''}INDEX "
+            f"{preparer.quote(idxname)} "
+            f"ON {preparer.format_table(sqla_table)} ({', '.join(colspecs)})"
+        )
+    log.info(f"Creating {job}")
+    for i, options in enumerate(options_list):
+        try:
+            DDL(stem + options, bind=engine).execute()
+            return
+        except DBAPIError as e:
+            if i == len(options_list) - 1:
+                raise
+            log.info(f"... index options {options.strip()!r} not accepted "
+                     f"({e.orig}); trying again")
+
+
+def create_indexes(tasknum: int = 0, ntasks: int = 1) -> None:
+    """
+    Create indexes for the destination tables.
+
+    Every process estimates the cost of every index (from row counts and
+    column widths) and works out the same plan: indexes are allocated to
+    processes largest first, each going to the process with the least work so
+    far (longest-processing-time-first scheduling), so that one huge index
+    doesn't leave other processes idle at the end. Each process then builds
+    its indexes largest first.
+
+    Args:
+        tasknum: task number of this process (for dividing up work)
+        ntasks: total number of processes (for dividing up work)
+    """
+    log.info(SEP + "Create indexes")
+    engine = config.get_destdb_engine_outside_transaction()
+    jobs = get_index_build_jobs(engine)
+    allocation = allocate_longest_first([job.cost for job in jobs], ntasks)
+    my_jobs = [jobs[i] for i in allocation[tasknum]]
+    log.info(f"Building {len(my_jobs)} of {len(jobs)} indexes")
+    for job in my_jobs:
+        start = get_now_utc_pendulum()
+        build_index(engine, job)
+        time_taken = get_now_utc_pendulum() - start
+        log.info(f"... {job}: {time_taken.total_seconds()} s "
+                 f"(estimated relative cost {job.cost})")
 
 
 def patient_processing_fn(tasknum: int = 0,
@@ -1331,7 +2324,8 @@ def patient_processing_fn(tasknum: int = 0,
                           incremental: bool = False,
                           specified_pids: List[int] = None,
                           free_text_limit: int = None,
-                          exclude_scrubbed_fields: bool = False) -> None:
+                          exclude_scrubbed_fields: bool = False,
+                          use_work_queue: bool = False) -> None:
     """
     Main function to anonymise patient data.
 
@@ -1347,68 +2341,141 @@ def patient_processing_fn(tasknum: int = 0,
         specified_pids: if specified, restrict to specific PIDs
         free_text_limit: as per :func:`process_table`
         exclude_scrubbed_fields: as per :func:`process_table`
+        use_work_queue: claim patients from the work queue (see
+            :func:`fill_work_queue`), rather than dividing them up by task
+            number; ``specified_pids`` is then ignored (it applies when the
+            queue is filled)
     """
-    n_patients = estimate_count_patients() // ntasks
+    n_patients_total = estimate_count_patients()
+    n_patients = n_patients_total // ntasks
     i = 0
-    for pid in gen_patient_ids(tasknum, ntasks,
-                               specified_pids=specified_pids):
-        # gen_patient_ids() assigns the work to the appropriate thread/process
-        # Check for an abort signal once per patient processed
-        i += 1
-        log.info(
-            f"Processing patient ID: {pid} (incremental={incremental}; "
-            f"patient {i}/~{n_patients} for this process; "
-            f"{config.overall_progress()})")
-
+    batch_size = config.patient_batch_size
+    if use_work_queue:
+        pid_batches = (
+            [item.pid for item in items]
+            for items in gen_work_queue_items(WorkQueueKind.PATIENT,
+                                              batch_size)
+        )
+    else:
+        pid_batches = gen_patient_id_batches(tasknum, ntasks,
+                                             specified_pids=specified_pids,
+                                             batch_size=batch_size)
+    if config.resume:
+        completed_pids = ProgressLedgerEntry.completed_pids(
+            config.admindb.session, config.process_cluster)
+        log.info(f"Resuming: skipping {len(completed_pids)} patients "
+                 f"already completed")
+    else:
+        completed_pids = set()  # type: Set[Any]
+    if config.status_publisher is not None:
+        # Patients completed by a previous run aren't counted as done by this
+        # one, so don't count them as still to do, either.
+        config.status_publisher.set_patients_estimated(
+            max(n_patients_total - len(completed_pids), 0))
+    if completed_pids:
+        pid_batches = gen_uncompleted_pid_batches(pid_batches, completed_pids)
+    for pids in pid_batches:
+        if config.resume and not incremental:
+            # The interrupted run may have committed some of these patients'
+            # data without recording them in the ledger; start afresh. (An
+            # incremental run skips or replaces such data anyway.)
+            wipe_destination_data_for_patients(pids)
         # Opt out based on PID?
-        if opting_out_pid(pid):
-            log.info("... opt out based on PID")
-            continue
-        # MPID information won't be present until we scan all the fields (which
-        # we do as we build the scrubber).
+        # MPID information won't be present until we scan all the fields
+        # (which we do as we build the scrubber).
+        opted_out_pids = set(pid for pid in pids if opting_out_pid(pid))
+        # Fetch scrub-source information for the whole batch at once?
+        if batch_size > 1:
+            batch_values = PatientBatchValues(
+                pid for pid in pids if pid not in opted_out_pids)
+        else:
+            batch_values = None
 
-        # Gather scrubbing information for a patient. (Will save.)
-        patient = Patient(pid)
+        for pid in pids:
+            i += 1
+            log.info(
+                f"Processing patient ID: {pid} (incremental={incremental}; "
+                f"patient {i}/~{n_patients} for this process; "
+                f"{config.overall_progress()})")
 
-        if patient.mandatory_scrubbers_unfulfilled:
-            log.warning(
-                f"Skipping patient with PID={pid} as the following scrub_src "
-                f"fields are required and had no data: "
-                f"{patient.mandatory_scrubbers_unfulfilled}")
-            continue
+            if pid in opted_out_pids:
+                log.info("... opt out based on PID")
+                continue
 
-        # Opt out based on MPID?
-        if opting_out_mpid(patient.mpid):
-            log.info("... opt out based on MPID")
-            continue
+            # Gather scrubbing information for a patient. (Will save.)
+            patient = Patient(pid, batch_values=batch_values)
 
-        patient_unchanged = patient.is_unchanged()
-        if incremental:
-            if patient_unchanged:
-                log.debug("Scrubber unchanged; may save some time")
-            else:
-                log.debug("Scrubber new or changed; reprocessing in full")
-
-        # For each source database/table...
-        for d in config.dd.get_source_databases():
-            log.debug(f"Patient {pid}, processing database: {d}")
-            for t in config.dd.get_patient_src_tables_with_active_dest(d):
-                log.debug(f"Patient {pid}, processing table {d}.{t}")
-                try:
-                    process_table(
-                        d, t,
-                        patient=patient,
-                        incremental=(incremental and patient_unchanged),
-                        free_text_limit=free_text_limit,
-                        exclude_scrubbed_fields=exclude_scrubbed_fields)
-                except Exception:
-                    log.critical("Error whilst processing - "
-                                 f"db: {d} table: {t}, patient id: {pid}")
-                    raise
+            if patient.mandatory_scrubbers_unfulfilled:
+                log.warning(
+                    f"Skipping patient with PID={pid} as the following "
+                    f"scrub_src fields are required and had no data: "
+                    f"{patient.mandatory_scrubbers_unfulfilled}")
+                continue
+
+            # Opt out based on MPID?
+            if opting_out_mpid(patient.mpid):
+                log.info("... opt out based on MPID")
+                continue
+
+            patient_unchanged = patient.is_unchanged()
+            if incremental:
+                if patient_unchanged:
+                    log.debug("Scrubber unchanged; may save some time")
+                else:
+                    log.debug(
+                        "Scrubber new or changed; reprocessing in full")
+
+            # For each source database/table...
+            for d in config.dd.get_source_databases():
+                log.debug(f"Patient {pid}, processing database: {d}")
+                for t in config.dd.get_patient_src_tables_with_active_dest(d):
+                    log.debug(f"Patient {pid}, processing table {d}.{t}")
+                    try:
+                        process_table(
+                            d, t,
+                            patient=patient,
+                            incremental=(incremental and patient_unchanged),
+                            free_text_limit=free_text_limit,
+                            exclude_scrubbed_fields=exclude_scrubbed_fields)
+                    except Exception:
+                        log.critical(
+                            "Error whilst processing - "
+                            f"db: {d} table: {t}, patient id: {pid}")
+                        raise
+
+        # Record the batch as completed, once its data are committed.
+        commit_destdb()
+        ProgressLedgerEntry.record_patients(config.admindb.session,
+                                            config.process_cluster, pids)
+        commit_admindb()
+        if config.status_publisher is not None:
+            config.status_publisher.notify_patients_done(len(pids))
+            config.status_publisher.maybe_publish()
 
     commit_destdb()
 
 
+def wipe_destination_data_for_patients(pids: List[Any]) -> None:
+    """
+    Delete any destination data for the specified patients, e.g. before
+    reprocessing patients that an interrupted run may have partly processed.
+
+    Args:
+        pids: patient IDs (PIDs)
+    """
+    ridcol = column(config.research_id_fieldname)
+    rids = [config.encrypt_primary_pid(pid) for pid in pids]
+    session = config.destdb.session
+    for dest_table_name in config.dd.get_dest_tables_with_patient_info():
+        dest_table = config.dd.get_dest_sqla_table(
+            dest_table_name,
+            config.timefield,
+            config.add_mrid_wherever_rid_added)
+        for chunk in chunks(rids, MAX_PKS_PER_DELETE):
+            session.execute(dest_table.delete().where(ridcol.in_(chunk)))
+    commit_destdb()
+
+
 def wipe_destination_data_for_opt_out_patients(report_every: int = 1000,
                                                chunksize: int = 10000) -> None:
     """
@@ -1474,25 +2541,59 @@ def wipe_destination_data_for_opt_out_patients(report_every: int = 1000,
     # 5. For each patient destination table,
     #    DELETE FROM desttable WHERE rid IN (SELECT rid FROM temptable)
     log.debug(start + ": 5. deleting from destination table by opt-out RID")
-    for dest_table_name in config.dd.get_dest_tables_with_patient_info():
-        log.debug(start + f": ... {dest_table_name}")
+    commit_destdb()  # tables are processed using their own connections
+
+    def wipe_table(dest_table_name: str) -> None:
         dest_table = config.dd.get_dest_sqla_table(
             dest_table_name,
             config.timefield,
             config.add_mrid_wherever_rid_added)
-        query = dest_table.delete().where(
-            column(ridfield).in_(
-                select([temptable.columns[pkfield]])
+        optout_rids = select([temptable.columns[pkfield]])
+        with destengine.connect() as connection:
+            # Cheap check first: is there anything to delete?
+            if connection.execute(
+                    select([column(ridfield)]).
+                    select_from(dest_table).
+                    where(column(ridfield).in_(optout_rids)).
+                    limit(1)).first() is None:
+                log.debug(start + f": ... {dest_table_name}: nothing to do")
+                return
+            query = dest_table.delete().where(
+                column(ridfield).in_(optout_rids)
             )
-        )
-        destengine.execute(query)
-        commit_destdb()
+            n_deleted = delete_in_batches(connection, query,
+                                          config.optout_delete_batch_size)
+        log.debug(start + f": ... {dest_table_name}: deleted {n_deleted} rows")
+
+    dest_table_names = config.dd.get_dest_tables_with_patient_info()
+    if config.optout_delete_threads > 1:
+        with ThreadPoolExecutor(
+                max_workers=config.optout_delete_threads) as executor:
+            # list() to re-raise any exceptions
+            list(executor.map(wipe_table, dest_table_names))
+    else:
+        for dest_table_name in dest_table_names:
+            wipe_table(dest_table_name)
 
     log.debug(start + ": 6. dropping temporary table")
     temptable.drop(destengine, checkfirst=True)  # use engine, not session
     commit_destdb()
 
-    log.debug(start + ": 7. deleting opt-out patients from mapping table")
+    log.debug(start + ": 7. deleting opt-out patients' documents from "
+                      "extracted text cache")
+    adminsession.query(ExtractedTextCacheEntry).filter(
+        or_(
+            ExtractedTextCacheEntry.pid.in_(adminsession.query(OptOutPid.pid)),
+            ExtractedTextCacheEntry.pid.in_(
+                adminsession.query(PatientInfo.pid).filter(
+                    PatientInfo.mpid.in_(adminsession.query(OptOutMpid.mpid))
+                )
+            )
+        )
+    ).delete(synchronize_session=False)
+    commit_admindb()
+
+    log.debug(start + ": 8. deleting opt-out patients from mapping table")
     adminsession.query(PatientInfo).filter(
         or_(
             PatientInfo.pid.in_(adminsession.query(OptOutPid.pid)),
@@ -1534,6 +2635,19 @@ def drop_remake(incremental: bool = False,
     PatientInfo.__table__.create(engine, checkfirst=True)
     # noinspection PyUnresolvedReferences
     TridRecord.__table__.create(engine, checkfirst=True)
+    # noinspection PyUnresolvedReferences
+    ExtractedTextCacheEntry.__table__.create(engine, checkfirst=True)
+    # noinspection PyUnresolvedReferences
+    WorkQueueItem.__table__.create(engine, checkfirst=True)
+    # noinspection PyUnresolvedReferences
+    ProgressLedgerEntry.__table__.create(engine, checkfirst=True)
+    # noinspection PyUnresolvedReferences
+    TimingRecord.__table__.create(engine, checkfirst=True)
+    # noinspection PyUnresolvedReferences
+    ProcessStatus.__table__.create(engine, checkfirst=True)
+    log.info("Clearing progress ledger (starting a new run)")
+    ProgressLedgerEntry.clear(config.admindb.session)
+    commit_admindb()
 
     wipe_and_recreate_destination_db(incremental=incremental)
     if skipdelete or not incremental:
@@ -1663,17 +2777,172 @@ def setup_opt_out(incremental: bool = False) -> None:
         wipe_destination_data_for_opt_out_patients()
 
 
+def get_nonpatient_unit_name(srcdbname: str,
+                             srctable: str,
+                             pk_range: Tuple[int, int] = None,
+                             tasknum: int = 0,
+                             ntasks: int = 1) -> str:
+    """
+    Returns a description of a unit of non-patient work, for the progress
+    ledger (see :class:`crate_anon.anonymise.models.ProgressLedgerEntry`).
+
+    Args:
+        srcdbname: name (as per the data dictionary) of the source database
+        srctable: name of the source table
+        pk_range: ``first, last`` tuple (inclusive), if the unit is a range of
+            PKs
+        tasknum: task number, if the unit is this task's share of the table
+        ntasks: total number of tasks sharing the table
+    """
+    unit = f"{srcdbname}.{srctable}"
+    if pk_range is not None:
+        unit += f" PK {pk_range[0]}-{pk_range[1]}"
+    elif ntasks > 1:
+        unit += f" task {tasknum}/{ntasks}"
+    return unit
+
+
+def wipe_destination_data_for_nonpatient_unit(
+        srcdbname: str,
+        srctable: str,
+        pkname: str = None,
+        pk_range: Tuple[int, int] = None,
+        tasknum: int = 0,
+        ntasks: int = 1) -> None:
+    """
+    Delete any destination data for a unit of non-patient work (see
+    :func:`process_nonpatient_unit`), e.g. before reprocessing a unit that an
+    interrupted run may have partly processed.
+
+    Args:
+        srcdbname: name (as per the data dictionary) of the source database
+        srctable: name of the source table
+        pkname: name of the integer PK column, if there is one
+        pk_range: optional ``first, last`` tuple (inclusive) restricting
+            ``pkname``
+        tasknum: task number of the process that the unit belongs to (for
+            dividing up work by ``pkname``)
+        ntasks: total number of processes (for dividing up work by
+            ``pkname``)
+    """
+    dest_table_name = config.dd.get_dest_table_for_src_db_table(srcdbname,
+                                                                srctable)
+    dest_table = config.dd.get_dest_sqla_table(
+        dest_table_name,
+        config.timefield,
+        config.add_mrid_wherever_rid_added)
+    query = dest_table.delete()
+    if pkname is not None and (pk_range is not None or ntasks > 1):
+        pkddr = config.dd.get_int_pk_ddr(srcdbname, srctable)
+        if pkddr.alter_methods:
+            raise ValueError(
+                f"Can't identify the destination rows for part of table "
+                f"{srcdbname}.{srctable}, as its PK {pkname!r} is altered; "
+                f"start a new run instead")
+        destpkcol = dest_table.columns[pkddr.dest_field]
+        if pk_range is not None:
+            query = query.where(destpkcol.between(*pk_range))
+        if ntasks > 1:
+            query = query.where(destpkcol % ntasks == tasknum)
+    config.destdb.session.execute(query)
+    commit_destdb()
+
+
+def process_nonpatient_unit(srcdbname: str,
+                            srctable: str,
+                            pkname: str = None,
+                            pk_range: Tuple[int, int] = None,
+                            tasknum: int = 0,
+                            ntasks: int = 1,
+                            incremental: bool = False,
+                            free_text_limit: int = None,
+                            exclude_scrubbed_fields: bool = False) -> None:
+    """
+    Processes a unit of non-patient work -- a whole table, a range of its
+    integer PKs, or this task's share of its integer PKs -- via
+    :func:`process_table`, then commits it and records it in the progress
+    ledger. If we are resuming (``config.resume``), units already in the
+    ledger are skipped, and (for full runs) any destination data for other
+    units is deleted before they are processed.
+
+    For ranges of PKs, also reports how long that took (so that
+    ``nonpatient_pk_range_size`` can be tuned).
+
+    Args:
+        srcdbname: name (as per the data dictionary) of the source database
+        srctable: name of the source table
+        pkname: name of the integer PK column, if there is one
+        pk_range: optional ``first, last`` tuple (inclusive) restricting
+            ``pkname``
+        tasknum: task number of this process (for dividing up work by
+            ``pkname``)
+        ntasks: total number of processes (for dividing up work by
+            ``pkname``)
+        incremental: perform an incremental update, rather than a full run?
+        free_text_limit: as per :func:`process_table`
+        exclude_scrubbed_fields: as per :func:`process_table`
+    """
+    unit = get_nonpatient_unit_name(srcdbname, srctable, pk_range=pk_range,
+                                    tasknum=tasknum, ntasks=ntasks)
+    adminsession = config.admindb.session
+    if config.resume:
+        if ProgressLedgerEntry.unit_completed(
+                adminsession, config.process_cluster, unit):
+            log.info(f"Resuming: skipping non-patient table {unit}, already "
+                     f"completed")
+            return
+        if not incremental:
+            # The interrupted run may have committed some of this unit's data
+            # without recording it in the ledger; start afresh.
+            wipe_destination_data_for_nonpatient_unit(
+                srcdbname, srctable, pkname=pkname, pk_range=pk_range,
+                tasknum=tasknum, ntasks=ntasks)
+    log.info(f"Processing non-patient table {unit}"
+             f"{f' (PK: {pkname})' if pkname else ''} "
+             f"({config.overall_progress()})...")
+    db_table_tuple = (srcdbname, srctable)
+    n_rows_before = config.rows_inserted_per_table[db_table_tuple]
+    start = get_now_utc_pendulum()
+    try:
+        # noinspection PyTypeChecker
+        process_table(srcdbname, srctable, patient=None,
+                      incremental=incremental,
+                      intpkname=pkname, tasknum=tasknum, ntasks=ntasks,
+                      free_text_limit=free_text_limit,
+                      exclude_scrubbed_fields=exclude_scrubbed_fields,
+                      pk_range=pk_range)
+    except Exception:
+        log.critical(f"Error whilst processing - db: {srcdbname} "
+                     f"table: {srctable} ({unit})")
+        raise
+    commit_destdb()
+    ProgressLedgerEntry.record_unit(adminsession, config.process_cluster,
+                                    unit)
+    commit_admindb()
+    if pk_range is not None:
+        time_taken = get_now_utc_pendulum() - start
+        n_rows = config.rows_inserted_per_table[db_table_tuple] - n_rows_before
+        log.info(f"... {unit}: {n_rows} rows in "
+                 f"{time_taken.total_seconds()} s")
+
+
 def process_nonpatient_tables(tasknum: int = 0,
                               ntasks: int = 1,
                               incremental: bool = False,
                               free_text_limit: int = None,
-                              exclude_scrubbed_fields: bool = False) -> None:
+                              exclude_scrubbed_fields: bool = False,
+                              use_work_queue: bool = False) -> None:
     """
     Copies all non-patient tables.
 
     - If they have an integer PK, the work may be parallelized.
     - If not, whole tables are assigned to different processes in parallel
       mode.
+    - If ``config.partition_nonpatient_tables_by_pk_range`` is set, tables
+      with an integer PK are divided into contiguous PK ranges, which are
+      allocated to processes in turn; otherwise, processes take rows by
+      ``pk % ntasks``.
+    - Alternatively, tables and PK ranges are claimed from the work queue.
 
     Args:
         tasknum:
@@ -1686,44 +2955,60 @@ def process_nonpatient_tables(tasknum: int = 0,
             as per :func:`process_table`
         exclude_scrubbed_fields:
             as per :func:`process_table`
-
-    """
+        use_work_queue:
+            claim tables and PK ranges from the work queue (see
+            :func:`fill_work_queue`), rather than dividing them up by task
+            number
+
+    """
+    if use_work_queue:
+        log.info(SEP + "Non-patient tables: from work queue")
+        for items in gen_work_queue_items(WorkQueueKind.TABLE, 1):
+            for item in items:
+                process_nonpatient_unit(
+                    item.src_db, item.src_table,
+                    pkname=item.pk_name,
+                    pk_range=(
+                        (item.pk_first, item.pk_last)
+                        if item.pk_name is not None else None
+                    ),
+                    incremental=incremental,
+                    free_text_limit=free_text_limit,
+                    exclude_scrubbed_fields=exclude_scrubbed_fields)
+        return
     log.info(SEP + "Non-patient tables: (a) with integer PK")
     for (d, t, pkname) in gen_nonpatient_tables_with_int_pk():
-        log.info(
-            f"Processing non-patient table {d}.{t} (PK: {pkname}) "
-            f"({config.overall_progress()})...")
-        try:
-            # noinspection PyTypeChecker
-            process_table(d, t, patient=None,
-                          incremental=incremental,
-                          intpkname=pkname, tasknum=tasknum, ntasks=ntasks,
-                          free_text_limit=free_text_limit,
-                          exclude_scrubbed_fields=exclude_scrubbed_fields)
-        except Exception:
-            log.critical(f"Error whilst processing - db: {d} table: {t}")
-            raise
-        commit_destdb()
+        if config.partition_nonpatient_tables_by_pk_range:
+            # Contiguous PK ranges, allocated round-robin across tasks, so
+            # each query can use the PK index (rather than scanning the whole
+            # table with "WHERE pk % ntasks = tasknum").
+            range_size = config.nonpatient_pk_range_size
+            for pk_range in get_int_pk_ranges(d, t, pkname, range_size):
+                if not is_my_job_by_int(pk_range[0] // range_size,
+                                        tasknum=tasknum, ntasks=ntasks):
+                    continue
+                process_nonpatient_unit(
+                    d, t, pkname=pkname, pk_range=pk_range,
+                    incremental=incremental,
+                    free_text_limit=free_text_limit,
+                    exclude_scrubbed_fields=exclude_scrubbed_fields)
+        else:
+            process_nonpatient_unit(
+                d, t, pkname=pkname, tasknum=tasknum, ntasks=ntasks,
+                incremental=incremental,
+                free_text_limit=free_text_limit,
+                exclude_scrubbed_fields=exclude_scrubbed_fields)
     log.info(SEP + "Non-patient tables: (b) without integer PK")
     for (d, t) in gen_nonpatient_tables_without_int_pk(tasknum=tasknum,
                                                        ntasks=ntasks):
-        log.info(
-            f"Processing non-patient table {d}.{t} "
-            f"({config.overall_progress()})...")
         # Force this into single-task mode, i.e. we have already parallelized
         # by assigning different tables to different processes; don't split
         # the work within a single table.
-        try:
-            # noinspection PyTypeChecker
-            process_table(d, t, patient=None,
-                          incremental=incremental,
-                          intpkname=None, tasknum=0, ntasks=1,
-                          free_text_limit=free_text_limit,
-                          exclude_scrubbed_fields=exclude_scrubbed_fields)
-        except Exception:
-            log.critical(f"Error whilst processing - db: {d} table: {t}")
-            raise
-        commit_destdb()
+        process_nonpatient_unit(
+            d, t,
+            incremental=incremental,
+            free_text_limit=free_text_limit,
+            exclude_scrubbed_fields=exclude_scrubbed_fields)
 
 
 def process_patient_tables(tasknum: int = 0,
@@ -1731,7 +3016,8 @@ def process_patient_tables(tasknum: int = 0,
                            incremental: bool = False,
                            specified_pids: List[int] = None,
                            free_text_limit: int = None,
-                           exclude_scrubbed_fields: bool = False) -> None:
+                           exclude_scrubbed_fields: bool = False,
+                           use_work_queue: bool = False) -> None:
     """
     Process all patient tables, optionally in a parallel-processing fashion.
 
@@ -1750,6 +3036,8 @@ def process_patient_tables(tasknum: int = 0,
             as per :func:`process_table`
         exclude_scrubbed_fields:
             as per :func:`process_table`
+        use_work_queue:
+            as per :func:`patient_processing_fn`
 
     """
     # We'll use multiple destination tables, so commit right at the end.
@@ -1763,7 +3051,8 @@ def process_patient_tables(tasknum: int = 0,
                           incremental=incremental,
                           specified_pids=specified_pids,
                           free_text_limit=free_text_limit,
-                          exclude_scrubbed_fields=exclude_scrubbed_fields)
+                          exclude_scrubbed_fields=exclude_scrubbed_fields,
+                          use_work_queue=use_work_queue)
 
     if ntasks > 1:
         log.info(f"Process {tasknum}: FINISHED ANONYMISATION")
@@ -1808,6 +3097,7 @@ def show_dest_counts() -> None:
 def anonymise(draftdd: bool = False,
               incrementaldd: bool = False,
               count: bool = False,
+              prunetextcache: bool = False,
               incremental: bool = False,
               skipdelete: bool = False,
               dropremake: bool = False,
@@ -1815,6 +3105,8 @@ def anonymise(draftdd: bool = False,
               patienttables: bool = False,
               nonpatienttables: bool = False,
               index: bool = False,
+              fillqueue: bool = False,
+              requeue: bool = False,
               restrict: str = "",
               restrict_file: str = "",
               restrict_limits: Tuple[Any, Any] = None,
@@ -1823,13 +3115,18 @@ def anonymise(draftdd: bool = False,
               exclude_scrubbed_fields: bool = False,
               nprocesses: int = 1,
               process: int = 0,
+              processcluster: str = "",
+              workqueue: bool = False,
+              resume: bool = False,
               skip_dd_check: bool = False,
               seed: str = "",
               chunksize: int = DEFAULT_CHUNKSIZE,
               reportevery: int = DEFAULT_REPORT_EVERY,
               echo: bool = False,
               debugscrubbers: bool = False,
-              savescrubbers: bool = False) -> None:
+              savescrubbers: bool = False,
+              timing: bool = False,
+              savetiming: bool = False) -> None:
     """
     Main entry point for anonymisation.
 
@@ -1840,6 +3137,9 @@ def anonymise(draftdd: bool = False,
             If true: print an incremental data dictionary, then stop.
         count:
             If true: show source/destination record counts, then stop.
+        prunetextcache:
+            If true: prune the extracted text cache to its size limit, then
+            stop.
 
         incremental:
             If true: incremental run, rather than full.
@@ -1857,6 +3157,12 @@ def anonymise(draftdd: bool = False,
             If true: process non-patient tables only (rather than all tables).
         index:
             If true: create indexes only.
+        fillqueue:
+            If true: empty and refill the work queue, for processes using
+            ``workqueue``.
+        requeue:
+            If true: release work-queue items that were claimed but not
+            finished (e.g. by an interrupted run).
 
         restrict:
             Restrict to certain patients? Specify a field name, or ``pid``
@@ -1879,6 +3185,19 @@ def anonymise(draftdd: bool = False,
         process:
             Number of this process (from 0 to nprocesses - 1), for work
             allocation.
+        processcluster:
+            Name of the process cluster of which this process is part (for
+            the progress ledger).
+        workqueue:
+            If true: claim patients and non-patient tables/PK ranges from the
+            work queue in the admin database, rather than allocating work by
+            process number. (If all actions are being performed, this process
+            fills the queue itself.)
+        resume:
+            If true: resume an interrupted run, skipping patients and
+            non-patient tables (or parts of them) that the progress ledger
+            records as completed by this process cluster. The "drop/remake"
+            and "opt-out" steps are not performed.
         skip_dd_check:
             If true: skip data dictionary validity check. (Useful in
             multiprocessing contexts when another process has already done
@@ -1899,6 +3218,13 @@ def anonymise(draftdd: bool = False,
         savescrubbers:
             Saves sensitive scrubbing information in admin database, for
             debugging
+        timing:
+            Time the parts of anonymisation, and report the timings at the
+            end.
+        savetiming:
+            Time the parts of anonymisation, and save the timings in the
+            admin database (see
+            :class:`crate_anon.anonymise.models.TimingRecord`).
 
     """
     # Validate args
@@ -1909,17 +3235,24 @@ def anonymise(draftdd: bool = False,
             "--process argument must be from 0 to (nprocesses - 1) inclusive")
     if nprocesses > 1 and dropremake:
         raise ValueError("Can't use nprocesses > 1 with --dropremake")
+    if resume and (dropremake or optout):
+        raise ValueError("Can't use --resume with --dropremake or --optout")
+    if nprocesses > 1 and (fillqueue or requeue):
+        raise ValueError(
+            "Can't use nprocesses > 1 with --fillqueue or --requeue")
     if incrementaldd and draftdd:
         raise ValueError("Can't use --incrementaldd and --draftdd")
 
     everything = not any([dropremake, optout, nonpatienttables,
-                          patienttables, index])
+                          patienttables, index, fillqueue, requeue])
 
     # Load/validate config
     config.report_every_n_rows = reportevery
     config.chunksize = chunksize
     config.debug_scrubbers = debugscrubbers
     config.save_scrubbers = savescrubbers
+    config.process_cluster = processcluster
+    config.resume = resume
     config.set_echo(echo)
     if not draftdd:
         config.load_dd(check_against_source_db=not skip_dd_check)
@@ -1945,6 +3278,10 @@ def anonymise(draftdd: bool = False,
         show_dest_counts()
         return
 
+    if prunetextcache:
+        prune_extracted_text_cache()
+        return
+
     # -------------------------------------------------------------------------
     # Setup
     # -------------------------------------------------------------------------
@@ -1973,41 +3310,96 @@ def anonymise(draftdd: bool = False,
 
     log.info(BIGSEP + "Starting")
     start = get_now_utc_pendulum()
+    run_started_at = datetime.utcnow()
+    timer.set_timing(timing or savetiming, reset=True)
+    if config.status_update_interval_s:
+        config.status_publisher = StatusPublisher(
+            engine=config.admindb.engine,
+            progress=config,
+            process_cluster=processcluster,
+            process=process,
+            nprocesses=nprocesses,
+            interval_s=config.status_update_interval_s)
+        config.status_publisher.start()
+
+    if resume:
+        log.info("Resuming an interrupted run")
 
     # 1. Drop/remake tables. Single-tasking only.
-    if dropremake or everything:
+    if dropremake or (everything and not resume):
+        set_status_phase(ProcessPhase.STRUCTURE)
         drop_remake(incremental=incremental, skipdelete=skipdelete)
 
     # 2. Deal with opt-outs
-    if optout or everything:
+    if optout or (everything and not resume):
+        set_status_phase(ProcessPhase.OPT_OUT)
         setup_opt_out(incremental=incremental)
 
-    # 3. Tables with patient info.
-    #    Process PER PATIENT, across all tables, because we have to synthesize
-    #    information to scrub across the entirety of that patient's record.
-    if patienttables or everything:
-        process_patient_tables(tasknum=process,
-                               ntasks=nprocesses,
-                               incremental=incremental,
-                               specified_pids=pids,
-                               free_text_limit=free_text_limit,
-                               exclude_scrubbed_fields=exclude_scrubbed_fields)
-
-    # 4. Tables without any patient ID (e.g. lookup tables). Process PER TABLE.
-    if nonpatienttables or everything:
-        process_nonpatient_tables(
-            tasknum=process,
-            ntasks=nprocesses,
-            incremental=incremental,
-            free_text_limit=free_text_limit,
-            exclude_scrubbed_fields=exclude_scrubbed_fields)
+    # 2a. Work queue, for dynamic allocation of work. Single-tasking only.
+    if fillqueue or (everything and workqueue and not resume):
+        set_status_phase(ProcessPhase.QUEUE)
+        fill_work_queue(specified_pids=pids)
+    if requeue or (everything and workqueue and resume):
+        set_status_phase(ProcessPhase.QUEUE)
+        requeue_unfinished_work(incremental=incremental)
+
+    try:
+        # 3. Tables with patient info.
+        #    Process PER PATIENT, across all tables, because we have to
+        #    synthesize information to scrub across the entirety of that
+        #    patient's record.
+        if patienttables or everything:
+            set_status_phase(ProcessPhase.PATIENTS)
+            process_patient_tables(
+                tasknum=process,
+                ntasks=nprocesses,
+                incremental=incremental,
+                specified_pids=pids,
+                free_text_limit=free_text_limit,
+                exclude_scrubbed_fields=exclude_scrubbed_fields,
+                use_work_queue=workqueue)
+
+        # 4. Tables without any patient ID (e.g. lookup tables). Process PER
+        #    TABLE.
+        if nonpatienttables or everything:
+            set_status_phase(ProcessPhase.NONPATIENT)
+            process_nonpatient_tables(
+                tasknum=process,
+                ntasks=nprocesses,
+                incremental=incremental,
+                free_text_limit=free_text_limit,
+                exclude_scrubbed_fields=exclude_scrubbed_fields,
+                use_work_queue=workqueue)
+    finally:
+        # Shut down any text extraction worker processes.
+        config.close_text_extraction_pool()
+
+    # Keep the extracted text cache to its maximum size. Only one process
+    # does this, so that processes don't contend over it.
+    if config.extracted_text_cache_max_mb and process == 0:
+        prune_extracted_text_cache()
 
     # 5. Indexes. ALWAYS FASTEST TO DO THIS LAST. Process PER TABLE.
     if index or everything:
+        set_status_phase(ProcessPhase.INDEXES)
         create_indexes(tasknum=process, ntasks=nprocesses)
 
+    if config.status_publisher is not None:
+        config.status_publisher.finish()
     log.info(BIGSEP + "Finished")
     end = get_now_utc_pendulum()
     time_taken = end - start
     log.info(f"Time taken: {time_taken.total_seconds()} seconds")
+
+    if timing:
+        timer.report()
+    if savetiming:
+        log.info("Saving timings to admin database")
+        TimingRecord.record(config.admindb.session,
+                            process_cluster=processcluster,
+                            process=process,
+                            nprocesses=nprocesses,
+                            run_started_at=run_started_at,
+                            totals=get_timing_totals(timer))
+        commit_admindb()
     # config.dd.debug_cache_hits()
@@ -113,6 +113,10 @@ def inner_main() -> None:
     simple_group_2.add_argument(
         "--count", action="store_true",
         help="Count records in source/destination databases, then stop")
+    simple_group_2.add_argument(
+        "--prunetextcache", action="store_true",
+        help="Prune the extracted text cache (in the administrative database) "
+             "to its configured size limit, then stop")
 
     mode_options = parser.add_argument_group(
         "Mode options"
@@ -150,6 +154,16 @@ def inner_main() -> None:
     action_options.add_argument(
         "--index", action="store_true",
         help="Create indexes only")
+    action_options.add_argument(
+        "--fillqueue", action="store_true",
+        help="Empty and refill the work queue in the administrative database "
+             "(for processes run with --workqueue)")
+    action_options.add_argument(
+        "--requeue", action="store_true",
+        help="Release work queue items that were claimed but not finished "
+             "(e.g. after an interrupted run), so they are processed again. "
+             "Unless --incremental is given, their destination data is "
+             "deleted first.")
 
     restrict_options = parser.add_argument_group(
         "Restriction options"
@@ -193,6 +207,19 @@ def inner_main() -> None:
     processing_options.add_argument(
         "--processcluster", default="",
         help="Process cluster name (used as part of log name)")
+    processing_options.add_argument(
+        "--workqueue", action="store_true",
+        help="For multiprocess mode: claim patients and non-patient tables "
+             "(or ranges of their integer PKs) dynamically from the work "
+             "queue (see --fillqueue), rather than dividing them up by "
+             "process number")
+    processing_options.add_argument(
+        "--resume", action="store_true",
+        help="Resume an interrupted run: skip patients and non-patient tables "
+             "(or parts of them) already completed by this process cluster, "
+             "according to the progress ledger in the administrative "
+             "database. Use the same --processcluster (and, unless using "
+             "--workqueue, the same --nprocesses) as the interrupted run.")
     processing_options.add_argument(
         "--skip_dd_check", action="store_true",
         help="Skip data dictionary validity check")
@@ -220,6 +247,15 @@ def inner_main() -> None:
         "--savescrubbers", action="store_true",
         help="Saves sensitive scrubbing information in admin database, "
              "for debugging")
+    debugging_options.add_argument(
+        "--timing", action="store_true",
+        help="Show a breakdown of the time spent on each part of "
+             "anonymisation, at the end")
+    debugging_options.add_argument(
+        "--savetiming", action="store_true",
+        help="Save the breakdown of time spent on each part of anonymisation "
+             "in the admin database (table anon_timing, which is created "
+             "by --dropremake), e.g. to add up timings across processes")
     debugging_options.add_argument(
         "--echo", action="store_true", help="Echo SQL")
 
@@ -269,6 +305,7 @@ def inner_main() -> None:
         draftdd=args.draftdd,
         incrementaldd=args.incrementaldd,
         count=args.count,
+        prunetextcache=args.prunetextcache,
 
         incremental=args.incremental,
         skipdelete=args.skipdelete,
@@ -278,6 +315,8 @@ def inner_main() -> None:
         patienttables=args.patienttables,
         nonpatienttables=args.nonpatienttables,
         index=args.index,
+        fillqueue=args.fillqueue,
+        requeue=args.requeue,
 
         restrict=args.restrict,
         restrict_file=args.file,
@@ -288,6 +327,9 @@ def inner_main() -> None:
 
         nprocesses=args.nprocesses,
         process=args.process,
+        processcluster=args.processcluster,
+        workqueue=args.workqueue,
+        resume=args.resume,
         skip_dd_check=args.skip_dd_check,
         seed=args.seed,
         chunksize=args.chunksize,
@@ -296,6 +338,8 @@ def inner_main() -> None:
         echo=args.echo,
         debugscrubbers=args.debugscrubbers,
         savescrubbers=args.savescrubbers,
+        timing=args.timing,
+        savetiming=args.savetiming,
     )
 
 
@@ -0,0 +1,818 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/anonymise/benchmark_anonymisation.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Measure the throughput of the anonymiser, using synthetic data.**
+
+- Creates a synthetic source database of a chosen size (by default in SQLite;
+  any SQLAlchemy URL can be used instead): patients, free-text notes with a
+  chosen distribution of lengths (sprinkled with the patients' identifiers,
+  so the scrubbers have some work to do), binary documents (plain text stored
+  as BLOBs, so no external text extraction tools are needed), and a
+  non-patient lookup table.
+- Writes a matching data dictionary and anonymiser config file.
+- Runs the anonymiser end to end (drop/remake, opt-outs, non-patient tables,
+  patient tables; not index creation) in a fresh process.
+- Reports rows/s, MB/s, scrubber build time (including the compilation of
+  scrubber regexes, which happens on first use and so is also included in the
+  per-table timings), per-table timings and peak resident set size (RSS), as
+  JSON, so that runs can be compared.
+
+"""
+
+import argparse
+import configparser
+import csv
+import datetime
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from cardinal_pythonlib.logs import main_only_quicksetup_rootlogger
+from sqlalchemy import (
+    create_engine,
+    BigInteger,
+    Column,
+    Date,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+)
+from sqlalchemy.dialects import mssql as mssql_types
+from sqlalchemy.dialects.mysql import LONGBLOB, LONGTEXT
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.functions import func
+from sqlalchemy.sql.expression import select
+
+from crate_anon.anonymise.constants import (
+    ANON_CONFIG_ENV_VAR,
+    CHARSET,
+    DEMO_CONFIG,
+    TABLE_KWARGS,
+)
+from crate_anon.anonymise.ddr import DataDictionaryRow
+from crate_anon.version import CRATE_VERSION
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+SOURCE_DB_NAME = "benchmark_source"  # as used in the config and DD
+INSERT_BATCH_SIZE = 1000
+MAX_TEXT_LENGTH = 10000000  # characters, for dialects without unlimited text
+SYLLABLES = [
+    "ba", "be", "bi", "bo", "da", "de", "di", "do", "ka", "ke", "ki", "ko",
+    "la", "le", "li", "lo", "ma", "me", "mi", "mo", "na", "ne", "ni", "no",
+    "ra", "re", "ri", "ro", "sa", "se", "si", "so", "ta", "te", "ti", "to",
+]
+
+
+# =============================================================================
+# Synthetic source database
+# =============================================================================
+
+# Unlimited-length text types, where CRATE knows their length. (For other
+# dialects, CRATE requires a specific length.)
+LONG_TEXT = String(MAX_TEXT_LENGTH).with_variant(
+    LONGTEXT(), "mysql").with_variant(
+    mssql_types.VARCHAR(), "mssql")  # VARCHAR(MAX)
+LONG_BINARY = LargeBinary().with_variant(LONGBLOB(), "mysql")
+
+metadata = MetaData()
+
+patient_table = Table(
+    "patient", metadata,
+    Column("patient_id", Integer, primary_key=True, autoincrement=False),
+    Column("nhsnum", BigInteger),
+    Column("forename", String(50)),
+    Column("surname", String(50)),
+    Column("dob", Date),
+    Column("phone", String(50)),
+    **TABLE_KWARGS
+)
+
+note_table = Table(
+    "note", metadata,
+    Column("note_id", Integer, primary_key=True, autoincrement=False),
+    Column("patient_id", Integer, index=True),
+    Column("note", LONG_TEXT),
+    **TABLE_KWARGS
+)
+
+blobdoc_table = Table(
+    "blobdoc", metadata,
+    Column("blobdoc_id", Integer, primary_key=True, autoincrement=False),
+    Column("patient_id", Integer, index=True),
+    Column("blob", LONG_BINARY),
+    Column("extension", String(10)),
+    **TABLE_KWARGS
+)
+
+lookup_table = Table(
+    "lookup", metadata,
+    Column("lookup_id", Integer, primary_key=True, autoincrement=False),
+    Column("code", String(10)),
+    Column("description", String(255)),
+    **TABLE_KWARGS
+)
+
+
+class SyntheticTextGenerator(object):
+    """
+    Makes pseudo-random text from a vocabulary of made-up words.
+    """
+    def __init__(self, rng: random.Random, n_words: int = 5000) -> None:
+        """
+        Args:
+            rng: random number generator
+            n_words: vocabulary size
+        """
+        self.rng = rng
+        self.vocabulary = [
+            "".join(rng.choice(SYLLABLES)
+                    for _ in range(rng.randint(1, 4)))
+            for _ in range(n_words)
+        ]
+
+    def word(self) -> str:
+        """
+        Returns a random word.
+        """
+        return self.rng.choice(self.vocabulary)
+
+    def name(self) -> str:
+        """
+        Returns a random name.
+        """
+        return self.word().capitalize()
+
+    def n_words(self, mean: float, sd: float) -> int:
+        """
+        Returns a number of words, drawn from a log-normal distribution with
+        the specified mean and standard deviation (or fixed, if the standard
+        deviation is zero).
+        """
+        if mean <= 0:
+            return 0
+        if sd <= 0:
+            return int(round(mean))
+        # Parameters of the underlying normal distribution:
+        sigma2 = math.log(1 + (sd / mean) ** 2)
+        mu = math.log(mean) - sigma2 / 2
+        return max(1, int(round(self.rng.lognormvariate(mu, sigma2 ** 0.5))))
+
+    def text(self, n_words: int, identifiers: List[str],
+             identifier_fraction: float) -> str:
+        """
+        Returns some text.
+
+        Args:
+            n_words: number of words
+            identifiers: identifiers to sprinkle through the text
+            identifier_fraction: probability that each word is replaced by
+                one of the identifiers
+        """
+        rng = self.rng
+        words = []  # type: List[str]
+        for i in range(n_words):
+            if identifiers and rng.random() < identifier_fraction:
+                words.append(rng.choice(identifiers))
+            else:
+                words.append(self.word())
+            if i % 12 == 11:
+                words[-1] += "."
+        return " ".join(words)
+
+
+def insert_in_batches(engine: Engine, table: Table,
+                      records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Inserts records into a table, several at a time. Returns the number of
+    records inserted.
+    """
+    n = 0
+    batch = []  # type: List[Dict[str, Any]]
+    with engine.begin() as connection:
+        for record in records:
+            batch.append(record)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                connection.execute(table.insert(), batch)
+                n += len(batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+            n += len(batch)
+    return n
+
+
+def make_source_database(engine: Engine,
+                         n_patients: int,
+                         notes_per_patient: int,
+                         mean_words_per_note: float,
+                         sd_words_per_note: float,
+                         blobs_per_patient: int,
+                         mean_words_per_blob: float,
+                         n_lookup_rows: int,
+                         identifier_fraction: float,
+                         seed: int) -> Dict[str, Any]:
+    """
+    Creates (dropping first, if required) and fills the synthetic source
+    database.
+
+    Returns:
+        a description of what was created: row counts per table, and the
+        total size of the text and binary contents
+    """
+    rng = random.Random(seed)
+    textgen = SyntheticTextGenerator(rng)
+    metadata.drop_all(engine, checkfirst=True)
+    metadata.create_all(engine, checkfirst=True)
+    content_bytes = 0
+
+    patients = []  # type: List[Dict[str, Any]]
+    for pid in range(1, n_patients + 1):
+        dob = datetime.date(1930, 1, 1) + datetime.timedelta(
+            days=rng.randint(0, 365 * 70))
+        patients.append(dict(
+            patient_id=pid,
+            nhsnum=9000000000 + pid,
+            forename=textgen.name(),
+            surname=textgen.name(),
+            dob=dob,
+            phone=f"01234 {rng.randint(100000, 999999)}",
+        ))
+
+    def identifiers(p: Dict[str, Any]) -> List[str]:
+        return [
+            p["forename"], p["surname"], str(p["nhsnum"]), p["phone"],
+            p["dob"].strftime("%d %b %Y"),
+        ]
+
+    def gen_notes() -> Iterable[Dict[str, Any]]:
+        nonlocal content_bytes
+        note_id = 0
+        for p in patients:
+            ids = identifiers(p)
+            for _ in range(notes_per_patient):
+                note_id += 1
+                text = textgen.text(
+                    textgen.n_words(mean_words_per_note, sd_words_per_note),
+                    ids, identifier_fraction)
+                content_bytes += len(text.encode(CHARSET))
+                yield dict(note_id=note_id, patient_id=p["patient_id"],
+                           note=text)
+
+    def gen_blobs() -> Iterable[Dict[str, Any]]:
+        nonlocal content_bytes
+        blobdoc_id = 0
+        for p in patients:
+            ids = identifiers(p)
+            for _ in range(blobs_per_patient):
+                blobdoc_id += 1
+                blob = textgen.text(
+                    textgen.n_words(mean_words_per_blob, 0),
+                    ids, identifier_fraction).encode(CHARSET)
+                content_bytes += len(blob)
+                yield dict(blobdoc_id=blobdoc_id, patient_id=p["patient_id"],
+                           blob=blob, extension=".txt")
+
+    def gen_lookups() -> Iterable[Dict[str, Any]]:
+        for lookup_id in range(1, n_lookup_rows + 1):
+            yield dict(lookup_id=lookup_id, code=f"C{lookup_id}",
+                       description=textgen.text(8, [], 0))
+
+    log.info("Creating synthetic source database")
+    rows = {
+        patient_table.name: insert_in_batches(engine, patient_table,
+                                              patients),
+        note_table.name: insert_in_batches(engine, note_table, gen_notes()),
+        blobdoc_table.name: insert_in_batches(engine, blobdoc_table,
+                                              gen_blobs()),
+        lookup_table.name: insert_in_batches(engine, lookup_table,
+                                             gen_lookups()),
+    }
+    return dict(rows=rows, content_bytes=content_bytes)
+
+
+# =============================================================================
+# Data dictionary and config file
+# =============================================================================
+
+def write_data_dictionary(source_engine: Engine,
+                          destination_engine: Engine,
+                          filename: str) -> None:
+    """
+    Writes the data dictionary for the synthetic source database.
+    """
+    def datatype(table: Table, colname: str) -> str:
+        return str(table.columns[colname].type.compile(
+            dialect=source_engine.dialect))
+
+    def row(table: Table, src_field: str,
+            src_flags: str = "",
+            scrub_src: str = "",
+            scrub_method: str = "",
+            decision: str = "include",
+            alter_method: str = "",
+            dest_field: str = None,
+            dest_datatype: str = "",
+            index: str = "") -> Dict[str, str]:
+        return dict(
+            src_db=SOURCE_DB_NAME,
+            src_table=table.name,
+            src_field=src_field,
+            src_datatype=datatype(table, src_field),
+            src_flags=src_flags,
+            scrub_src=scrub_src,
+            scrub_method=scrub_method,
+            decision=decision,
+            inclusion_values="",
+            exclusion_values="",
+            alter_method=alter_method,
+            dest_table=table.name,
+            dest_field=dest_field or src_field,
+            dest_datatype=dest_datatype,
+            index=index,
+            indexlen="",
+            comment="",
+        )
+
+    rid_type = "VARCHAR(32)"  # for the HMAC_MD5 hash method
+    rows = [
+        row(patient_table, "patient_id", src_flags="KHP*",
+            scrub_src="patient", scrub_method="number",
+            dest_field="brcid", dest_datatype=rid_type, index="U"),
+        row(patient_table, "nhsnum", src_flags="M",
+            scrub_src="patient", scrub_method="number",
+            dest_field="nhshash", dest_datatype=rid_type, index="I"),
+        row(patient_table, "forename", scrub_src="patient",
+            scrub_method="words", decision="OMIT"),
+        row(patient_table, "surname", scrub_src="patient",
+            scrub_method="words", decision="OMIT"),
+        row(patient_table, "dob", scrub_src="patient", scrub_method="date",
+            alter_method="truncate_date"),
+        row(patient_table, "phone", scrub_src="patient",
+            scrub_method="code", decision="OMIT"),
+
+        row(note_table, "note_id", src_flags="KH", index="U"),
+        row(note_table, "patient_id", src_flags="P",
+            dest_field="brcid", dest_datatype=rid_type, index="I"),
+        row(note_table, "note", alter_method="scrub"),
+
+        row(blobdoc_table, "blobdoc_id", src_flags="KH", index="U"),
+        row(blobdoc_table, "patient_id", src_flags="P",
+            dest_field="brcid", dest_datatype=rid_type, index="I"),
+        row(blobdoc_table, "blob",
+            alter_method="binary_to_text=extension,scrub",
+            dest_field="blob_text",
+            dest_datatype=str(LONG_TEXT.compile(
+                dialect=destination_engine.dialect))),
+        row(blobdoc_table, "extension"),
+
+        row(lookup_table, "lookup_id", src_flags="KH", index="U"),
+        row(lookup_table, "code"),
+        row(lookup_table, "description"),
+    ]
+    with open(filename, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=DataDictionaryRow.ROWNAMES,
+                                delimiter="\t", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_config(filename: str,
+                 dd_filename: str,
+                 source_url: str,
+                 destination_url: str,
+                 admin_url: str,
+                 extra_settings: List[str] = None) -> None:
+    """
+    Writes an anonymiser config file for the benchmark, based on the demo
+    config.
+
+    Args:
+        filename: config file to write
+        dd_filename: data dictionary filename
+        source_url: SQLAlchemy URL of the source database
+        destination_url: SQLAlchemy URL of the destination database
+        admin_url: SQLAlchemy URL of the administrative database
+        extra_settings: further ``key=value`` settings for the ``[main]``
+            section
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read_string(DEMO_CONFIG)
+    source_section = dict(parser["mysourcedb1"])
+    for section in parser.sections():
+        if section not in ("main", "extra_regexes",
+                           "my_destination_database", "my_admin_database"):
+            parser.remove_section(section)
+    parser[SOURCE_DB_NAME] = source_section
+    parser[SOURCE_DB_NAME]["url"] = source_url
+    parser["my_destination_database"]["url"] = destination_url
+    parser["my_admin_database"]["url"] = admin_url
+    main = parser["main"]
+    main["data_dictionary_filename"] = dd_filename
+    main["source_databases"] = SOURCE_DB_NAME
+    for setting in extra_settings or []:
+        key, sep, value = setting.partition("=")
+        if not sep:
+            raise ValueError(f"Bad setting (should be key=value): "
+                             f"{setting!r}")
+        main[key.strip()] = value.strip()
+    with open(filename, "w") as f:
+        parser.write(f)
+
+
+# =============================================================================
+# Running the anonymiser
+# =============================================================================
+
+def get_peak_rss_mb(who: int = None) -> Optional[float]:
+    """
+    Returns the peak resident set size of this process (or, with
+    ``who=resource.RUSAGE_CHILDREN``, of its largest terminated child), in
+    MiB, or ``None`` if we can't tell.
+    """
+    if resource is None:
+        return None
+    if who is None:
+        who = resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":  # bytes
+        return maxrss / (1024 * 1024)
+    return maxrss / 1024  # kibibytes
+
+
+class DurationAccumulator(object):
+    """
+    Adds up the time taken by calls to a function, by category. Calls made
+    while another call in the same category is in progress are not counted
+    separately (so that wrapping a function and one it calls doesn't count
+    the time twice).
+    """
+    def __init__(self) -> None:
+        self.seconds = {}  # type: Dict[str, float]
+        self.calls = {}  # type: Dict[str, int]
+        self._active = set()  # type: Set[str]
+
+    def wrap(self, fn: Callable[..., Any],
+             key_fn: Callable[..., str]) -> Callable[..., Any]:
+        """
+        Returns a version of ``fn`` whose calls are timed, and recorded under
+        ``key_fn(*args, **kwargs)``.
+        """
+        def wrapped(*args, **kwargs) -> Any:
+            key = key_fn(*args, **kwargs)
+            if key in self._active:
+                return fn(*args, **kwargs)
+            self._active.add(key)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._active.discard(key)
+                self.seconds[key] = (self.seconds.get(key, 0.0) +
+                                     time.perf_counter() - start)
+                self.calls[key] = self.calls.get(key, 0) + 1
+        return wrapped
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the totals, keyed by category.
+        """
+        return {
+            key: dict(calls=self.calls[key], seconds=self.seconds[key])
+            for key in sorted(self.seconds)
+        }
+
+
+def run_anonymiser(config_filename: str, result_filename: str,
+                   verbose: bool = False) -> None:
+    """
+    Runs the anonymiser, timing its parts, and writes the results as JSON.
+    Intended to be run in a fresh process, since the anonymiser's config is
+    a singleton.
+
+    Args:
+        config_filename: anonymiser config file
+        result_filename: file to write JSON results to
+        verbose: be verbose?
+    """
+    main_only_quicksetup_rootlogger(
+        level=logging.DEBUG if verbose else logging.WARNING)
+    os.environ[ANON_CONFIG_ENV_VAR] = config_filename
+    # Delayed imports; the config singleton reads the environment variable.
+    import crate_anon.anonymise.anonymise as anonymise_module
+    from crate_anon.anonymise.config_singleton import config
+    from crate_anon.anonymise.patient import Patient
+    from crate_anon.anonymise.scrub import PersonalizedScrubber
+
+    phases = DurationAccumulator()
+    tables = DurationAccumulator()
+    scrubbers = DurationAccumulator()
+    for phase in ("drop_remake", "setup_opt_out",
+                  "process_nonpatient_tables", "process_patient_tables"):
+        setattr(anonymise_module, phase, phases.wrap(
+            getattr(anonymise_module, phase),
+            lambda *args, phase_=phase, **kwargs: phase_))
+    anonymise_module.process_table = tables.wrap(
+        anonymise_module.process_table,
+        lambda sourcedbname, sourcetable, *args, **kwargs:
+            f"{sourcedbname}.{sourcetable}")
+    anonymise_module.Patient = scrubbers.wrap(
+        anonymise_module.Patient,
+        lambda *args, **kwargs: "patient_scrubber")
+    # Scrubber regexes are compiled (or fetched from the scrubber cache)
+    # lazily, on first use, within process_table(); count that time too.
+    PersonalizedScrubber.build_regexes = scrubbers.wrap(
+        PersonalizedScrubber.build_regexes,
+        lambda *args, **kwargs: "scrubber_regexes")
+    Patient._ensure_regexes = scrubbers.wrap(
+        Patient._ensure_regexes,
+        lambda *args, **kwargs: "scrubber_regexes")
+
+    start = time.perf_counter()
+    anonymise_module.anonymise(
+        incremental=False,
+        dropremake=True,
+        optout=True,
+        nonpatienttables=True,
+        patienttables=True,
+        seed="benchmark",
+    )
+    total_s = time.perf_counter() - start
+
+    dest_tables = config.dd.get_dest_tables()
+    with config.destdb.engine.connect() as connection:
+        dest_rows = {
+            tablename: connection.execute(
+                select([func.count()]).select_from(table)).scalar()
+            for tablename, table in config.destdb.metadata.tables.items()
+            if tablename in dest_tables
+        }
+    scrubber_timings = scrubbers.as_dict()
+    no_calls = dict(calls=0, seconds=0.0)
+    constructor = scrubber_timings.get("patient_scrubber", no_calls)
+    regexes = scrubber_timings.get("scrubber_regexes", no_calls)
+    results = dict(
+        anonymise_s=total_s,
+        phases=phases.as_dict(),
+        tables=tables.as_dict(),
+        scrubber_build=dict(
+            calls=constructor["calls"],
+            seconds=constructor["seconds"] + regexes["seconds"],
+            regex_seconds=regexes["seconds"],
+        ),
+        src_bytes_read=config.src_bytes_read,
+        dest_bytes_written=config.dest_bytes_written,
+        dest_rows=dest_rows,
+        peak_rss_mb=get_peak_rss_mb(),
+        peak_rss_children_mb=get_peak_rss_mb(
+            resource.RUSAGE_CHILDREN if resource else None),
+    )
+    with open(result_filename, "w") as f:
+        json.dump(results, f)
+
+
+def run_anonymiser_in_new_process(config_filename: str,
+                                  verbose: bool = False) -> Dict[str, Any]:
+    """
+    Runs :func:`run_anonymiser` in a fresh process and returns its results.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        result_filename = os.path.join(tmpdir, "results.json")
+        ctx = multiprocessing.get_context("spawn")
+        process = ctx.Process(target=run_anonymiser,
+                              args=(config_filename, result_filename, verbose))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Anonymiser process failed with exit code "
+                               f"{process.exitcode}")
+        with open(result_filename) as f:
+            return json.load(f)
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main() -> None:
+    """
+    Command-line entry point. See command-line help.
+    """
+    # noinspection PyTypeChecker
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the CRATE anonymiser, using a "
+                    "synthetic source database. Results are written as JSON.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--workdir",
+        help="Directory for the data dictionary, config file, and any SQLite "
+             "databases (default: a temporary directory, deleted "
+             "afterwards)")
+    parser.add_argument(
+        "--source_url",
+        help="SQLAlchemy URL for the synthetic source database, which will "
+             "be DROPPED AND RECREATED (default: SQLite, in the working "
+             "directory)")
+    parser.add_argument(
+        "--destination_url",
+        help="SQLAlchemy URL for the destination database, which will be "
+             "OVERWRITTEN (default: SQLite, in the working directory)")
+    parser.add_argument(
+        "--admin_url",
+        help="SQLAlchemy URL for the administrative database, which will be "
+             "OVERWRITTEN (default: SQLite, in the working directory)")
+    parser.add_argument(
+        "--skip_create", action="store_true",
+        help="Use the existing source database (from a previous run with the "
+             "same --source_url) rather than creating it")
+    parser.add_argument(
+        "--n_patients", type=int, default=100,
+        help="Number of patients")
+    parser.add_argument(
+        "--notes_per_patient", type=int, default=20,
+        help="Number of free-text notes per patient")
+    parser.add_argument(
+        "--mean_words_per_note", type=float, default=200,
+        help="Mean number of words per note")
+    parser.add_argument(
+        "--sd_words_per_note", type=float, default=150,
+        help="Standard deviation of the number of words per note (lengths "
+             "are log-normally distributed; use 0 for fixed lengths)")
+    parser.add_argument(
+        "--blobs_per_patient", type=int, default=2,
+        help="Number of binary documents per patient")
+    parser.add_argument(
+        "--mean_words_per_blob", type=float, default=1000,
+        help="Number of words per binary document")
+    parser.add_argument(
+        "--n_lookup_rows", type=int, default=1000,
+        help="Number of rows in the non-patient lookup table")
+    parser.add_argument(
+        "--identifier_fraction", type=float, default=0.02,
+        help="Proportion of words in notes/documents that are the patient's "
+             "identifiers")
+    parser.add_argument(
+        "--seed", type=int, default=1234,
+        help="Random number seed, for the synthetic data")
+    parser.add_argument(
+        "--setting", action="append", default=[],
+        help="Extra anonymiser config setting, as key=value, for the [main] "
+             "section (e.g. patient_batch_size=100). May be repeated.")
+    parser.add_argument(
+        "--output",
+        help="File to write JSON results to (default: stdout)")
+    parser.add_argument(
+        "--verbose", "-v", action="store_true",
+        help="Be verbose")
+    args = parser.parse_args()
+
+    main_only_quicksetup_rootlogger(
+        level=logging.DEBUG if args.verbose else logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(args.workdir or tmpdir)
+        os.makedirs(workdir, exist_ok=True)
+
+        def sqlite_url(name: str) -> str:
+            filename = os.path.join(workdir, name)
+            if name != "source.sqlite" and os.path.exists(filename):
+                os.remove(filename)
+            return f"sqlite:///{filename}"
+
+        source_url = args.source_url or sqlite_url("source.sqlite")
+        destination_url = (args.destination_url or
+                           sqlite_url("destination.sqlite"))
+        admin_url = args.admin_url or sqlite_url("admin.sqlite")
+        dd_filename = os.path.join(workdir, "benchmark_dd.tsv")
+        config_filename = os.path.join(workdir, "benchmark_config.ini")
+        source_info_filename = os.path.join(workdir, "benchmark_source.json")
+
+        # Source database
+        source_engine = create_engine(source_url, encoding=CHARSET)
+        if args.skip_create:
+            # Use the description saved when it was created, if we have it.
+            source = None  # type: Optional[Dict[str, Any]]
+            if os.path.isfile(source_info_filename):
+                with open(source_info_filename) as f:
+                    source = json.load(f)
+        else:
+            start = time.perf_counter()
+            source = make_source_database(
+                engine=source_engine,
+                n_patients=args.n_patients,
+                notes_per_patient=args.notes_per_patient,
+                mean_words_per_note=args.mean_words_per_note,
+                sd_words_per_note=args.sd_words_per_note,
+                blobs_per_patient=args.blobs_per_patient,
+                mean_words_per_blob=args.mean_words_per_blob,
+                n_lookup_rows=args.n_lookup_rows,
+                identifier_fraction=args.identifier_fraction,
+                seed=args.seed,
+            )
+            source["create_s"] = time.perf_counter() - start
+            with open(source_info_filename, "w") as f:
+                json.dump(source, f)
+        with source_engine.connect() as connection:
+            src_rows = {
+                table.name: connection.execute(
+                    select([func.count()]).select_from(table)).scalar()
+                for table in metadata.sorted_tables
+            }
+        write_data_dictionary(source_engine,
+                              create_engine(destination_url, encoding=CHARSET),
+                              dd_filename)
+        source_engine.dispose()
+        write_config(config_filename, dd_filename,
+                     source_url=source_url,
+                     destination_url=destination_url,
+                     admin_url=admin_url,
+                     extra_settings=args.setting)
+
+        # Anonymise
+        log.info("Running anonymiser")
+        run = run_anonymiser_in_new_process(config_filename,
+                                            verbose=args.verbose)
+
+    total_src_rows = sum(src_rows.values())
+    seconds = run["anonymise_s"]
+    content_mb = source["content_bytes"] / (1024 * 1024) if source else None
+    results = dict(
+        crate_version=CRATE_VERSION,
+        python_version=sys.version.split()[0],
+        when_utc=datetime.datetime.utcnow().isoformat(),
+        parameters={
+            k: v for k, v in vars(args).items()
+            if k not in ("output", "verbose")
+        },
+        source_dialect=create_engine(source_url).dialect.name,
+        destination_dialect=create_engine(destination_url).dialect.name,
+        source=source,
+        src_rows=src_rows,
+        dest_rows=run["dest_rows"],
+        anonymise_s=seconds,
+        rows_per_s=total_src_rows / seconds if seconds else None,
+        # Text/binary content of notes and documents:
+        content_mb_per_s=(content_mb / seconds
+                          if seconds and content_mb is not None else None),
+        # The anonymiser's own (approximate) counts:
+        src_bytes_read=run["src_bytes_read"],
+        dest_bytes_written=run["dest_bytes_written"],
+        scrubber_build=run["scrubber_build"],
+        phases=run["phases"],
+        tables=run["tables"],
+        peak_rss_mb=run["peak_rss_mb"],
+        peak_rss_children_mb=run["peak_rss_children_mb"],
+    )
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        log.info(f"Results written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/anonymise/benchmark_dd.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Benchmark loading and querying a data dictionary.**
+
+Uses the data dictionary from the anonymiser config file (optionally
+replicated many times over, with renamed tables, to simulate a much larger
+one). Reports the time to load and check it, the memory it occupies, and the
+time taken by the per-table queries that the anonymiser makes.
+
+"""
+
+import argparse
+import csv
+import gc
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List
+
+from cardinal_pythonlib.argparse_func import (
+    RawDescriptionArgumentDefaultsHelpFormatter,
+)
+from cardinal_pythonlib.logs import main_only_quicksetup_rootlogger
+
+from crate_anon.anonymise.constants import ANON_CONFIG_ENV_VAR
+from crate_anon.anonymise.dd import DataDictionary
+from crate_anon.anonymise.ddr import DataDictionaryRow
+
+log = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Helper functions
+# =============================================================================
+
+def write_replicated_dd(src_filename: str, dest_filename: str,
+                        copies: int) -> int:
+    """
+    Writes a data dictionary consisting of ``copies`` copies of another, with
+    source and destination tables renamed (e.g. ``mytable`` becomes
+    ``mytable_copy2``) so the copies don't clash.
+
+    Returns:
+        the number of rows written
+    """
+    n = 0
+    with open(src_filename, "r") as infile, \
+            open(dest_filename, "w") as outfile:
+        reader = csv.reader(infile, delimiter="\t")
+        writer = csv.writer(outfile, delimiter="\t", lineterminator="\n")
+        headers = next(reader)
+        writer.writerow(headers)
+        src_table_idx = headers.index("src_table")
+        dest_table_idx = headers.index("dest_table")
+        rows = list(reader)
+        for copy in range(copies):
+            for row in rows:
+                row = list(row)
+                if copy > 0:
+                    for idx in (src_table_idx, dest_table_idx):
+                        if row[idx]:
+                            row[idx] = f"{row[idx]}_copy{copy}"
+                writer.writerow(row)
+                n += 1
+    return n
+
+
+def time_s(func: Callable[[], None]) -> float:
+    """
+    Returns the time taken to call a function, in seconds.
+    """
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def run_table_queries(dd: DataDictionary) -> None:
+    """
+    Runs the per-table queries that the anonymiser makes, for every table.
+    """
+    for src_db, src_table in dd.get_src_db_tablepairs():
+        dd.get_rows_for_src_table(src_db, src_table)
+        dd.get_fieldnames_for_src_table(src_db, src_table)
+        dd.get_scrub_from_rows(src_db, src_table)
+        dd.get_pk_ddr(src_db, src_table)
+        dd.get_int_pk_name(src_db, src_table)
+        dd.get_pid_name(src_db, src_table)
+        dd.get_mpid_name(src_db, src_table)
+        dd.has_active_destination(src_db, src_table)
+        dd.get_dest_tables_for_src_db_table(src_db, src_table)
+    for src_db in dd.get_source_databases():
+        dd.get_src_tables(src_db)
+        dd.get_src_tables_with_patient_info(src_db)
+        dd.get_patient_src_tables_with_active_dest(src_db)
+    for dest_table in dd.get_dest_tables():
+        dd.get_src_dbs_tables_for_dest_table(dest_table)
+        dd.get_rows_for_dest_table(dest_table)
+    dd.get_src_dbs_tables_with_no_pt_info_no_pk()
+    dd.get_src_dbs_tables_with_no_pt_info_int_pk()
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main() -> None:
+    """
+    Command-line entry point. See command-line help.
+    """
+    # noinspection PyTypeChecker
+    parser = argparse.ArgumentParser(
+        description=f"""
+Benchmark loading and querying the data dictionary specified by the CRATE
+anonymiser config file (from the {ANON_CONFIG_ENV_VAR} environment variable,
+or --config). The data dictionary is not checked against the source
+databases.
+        """,
+        formatter_class=RawDescriptionArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--config',
+        help=f"Config file (overriding environment variable "
+             f"{ANON_CONFIG_ENV_VAR})")
+    parser.add_argument(
+        '--copies', type=int, default=1,
+        help="Replicate the data dictionary this many times (with renamed "
+             "tables), to simulate a larger one")
+    parser.add_argument(
+        '--repeats', type=int, default=3,
+        help="Repeat each timing this many times, reporting the fastest")
+    parser.add_argument(
+        '--verbose', '-v', action="store_true",
+        help="Be verbose")
+    args = parser.parse_args()
+
+    main_only_quicksetup_rootlogger(level=logging.DEBUG if args.verbose
+                                    else logging.WARNING)
+    if args.config:
+        os.environ[ANON_CONFIG_ENV_VAR] = args.config
+    # Delayed import; the config singleton reads the environment variable.
+    from crate_anon.anonymise.config_singleton import config
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dd_filename = os.path.join(tmpdir, "dd.tsv")
+        n_rows = write_replicated_dd(config.data_dictionary_filename,
+                                     dd_filename, args.copies)
+
+        def load() -> DataDictionary:
+            dd_ = DataDictionary(config)
+            dd_.read_from_file(dd_filename)
+            return dd_
+
+        load_times = []  # type: List[float]
+        check_times = []  # type: List[float]
+        query_times = []  # type: List[float]
+        dd = None
+        for _ in range(args.repeats):
+            dd = None
+            gc.collect()
+            start = time.perf_counter()
+            dd = load()
+            load_times.append(time.perf_counter() - start)
+            check_times.append(time_s(lambda: dd.check_valid(
+                check_against_source_db=False)))
+            dd.clear_caches()
+            query_times.append(time_s(lambda: run_table_queries(dd)))
+        n_tables = len(dd.get_src_db_tablepairs())
+        dd.clear_caches()
+
+        dd = None
+        gc.collect()
+        tracemalloc.start()
+        dd = load()
+        memory_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    print(f"Data dictionary rows: {n_rows} ({n_tables} source tables)")
+    print(f"DataDictionaryRow uses __slots__: "
+          f"{not hasattr(DataDictionaryRow(config), '__dict__')}")
+    print(f"Load time: {min(load_times):.3f} s")
+    print(f"Check time (not against source databases): "
+          f"{min(check_times):.3f} s")
+    print(f"Per-table query time (all tables, cold caches): "
+          f"{min(query_times):.3f} s")
+    print(f"Memory after loading: {memory_bytes / (1024 * 1024):.1f} MiB "
+          f"({memory_bytes / max(n_rows, 1):.0f} bytes per row)")
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -107,13 +107,24 @@ from sqlalchemy.sql.sqltypes import TypeEngine
 from crate_anon.anonymise.constants import (
     ANON_CONFIG_ENV_VAR,
     DEFAULT_CHUNKSIZE,
+    DEFAULT_EXTRACT_TEXT_POOL_SIZE,
+    DEFAULT_EXTRACT_TEXT_TIMEOUT_S,
+    DEFAULT_FETCH_CHUNKSIZE,
+    DEFAULT_INCREMENTAL_PK_WINDOW,
     DEFAULT_REPORT_EVERY,
     DEFAULT_MAX_ROWS_BEFORE_COMMIT,
     DEFAULT_MAX_BYTES_BEFORE_COMMIT,
+    DEFAULT_MAX_BYTES_PER_INSERT,
+    DEFAULT_MAX_ROWS_PER_INSERT,
+    DEFAULT_NONPATIENT_PK_RANGE_SIZE,
+    DEFAULT_PATIENT_BATCH_SIZE,
+    DEFAULT_SOURCE_REFLECTION_THREADS,
+    DEFAULT_STATUS_UPDATE_INTERVAL_S,
     DEMO_CONFIG,
     SEP,
 )
 from crate_anon.anonymise.dd import DataDictionary
+from crate_anon.anonymise.extracttext import TextExtractionPool
 from crate_anon.anonymise.scrub import (
     NonspecificScrubber,
     WordList,
@@ -127,6 +138,7 @@ from crate_anon.common.sql import TransactionSizeLimiter
 
 if TYPE_CHECKING:
     from crate_anon.anonymise.dbholder import DatabaseHolder
+    from crate_anon.anonymise.status import StatusPublisher
 
 log = logging.getLogger(__name__)
 
@@ -258,6 +270,13 @@ class DatabaseSafeConfig(object):
         self.ddgen_convert_odd_chars_to_underscore = cfg.opt_bool(
             'ddgen_convert_odd_chars_to_underscore', True)
 
+        self.stream_results = cfg.opt_bool('stream_results', False)
+        self.fetch_chunksize = cfg.opt_int(
+            'fetch_chunksize', DEFAULT_FETCH_CHUNKSIZE)
+        if self.fetch_chunksize < 1:
+            raise ValueError(
+                f"fetch_chunksize must be at least 1 (in section {section})")
+
         self.debug_row_limit = cfg.opt_int('debug_row_limit', 0)
         self.debug_limited_tables = cfg.opt_multiline('debug_limited_tables')
 
@@ -484,13 +503,18 @@ class Config(object):
                          srccfg_: DatabaseSafeConfig = None,
                          with_session: bool = False,
                          with_conn: bool = True,
-                         reflect: bool = True) -> "DatabaseHolder":
-            return parser.get_database(section_,
-                                       dbname=name,
-                                       srccfg=srccfg_,
-                                       with_session=with_session,
-                                       with_conn=with_conn,
-                                       reflect=reflect)
+                         reflect: bool = True,
+                         reflection_cache_dir: str = None,
+                         reflection_threads: int = 1) -> "DatabaseHolder":
+            return parser.get_database(
+                section_,
+                dbname=name,
+                srccfg=srccfg_,
+                with_session=with_session,
+                with_conn=with_conn,
+                reflect=reflect,
+                reflection_cache_dir=reflection_cache_dir,
+                reflection_threads=reflection_threads)
 
         # ---------------------------------------------------------------------
         # Data dictionary
@@ -562,6 +586,21 @@ class Config(object):
             'extract_text_extensions_prohibited')
         self.extract_text_plain = cfg.opt_bool('extract_text_plain', True)
         self.extract_text_width = cfg.opt_int('extract_text_width', 80)
+        self.extract_text_pool_size = cfg.opt_int(
+            'extract_text_pool_size', DEFAULT_EXTRACT_TEXT_POOL_SIZE)
+        if self.extract_text_pool_size < 0:
+            raise ValueError("extract_text_pool_size must not be negative")
+        self.extract_text_timeout_s = cfg.opt_int(
+            'extract_text_timeout_s', DEFAULT_EXTRACT_TEXT_TIMEOUT_S)
+        if self.extract_text_timeout_s < 0:
+            raise ValueError("extract_text_timeout_s must not be negative")
+        self.extracted_text_cache_max_mb = cfg.opt_int_positive(
+            'extracted_text_cache_max_mb', 0)
+        self.extracted_text_cache_encryption_phrase = cfg.opt_str(
+            'extracted_text_cache_encryption_phrase')
+        if (self.extracted_text_cache_max_mb and
+                not self.extracted_text_cache_encryption_phrase):
+            raise ValueError("Missing extracted_text_cache_encryption_phrase")
 
         # ---------------------------------------------------------------------
         # Anonymisation
@@ -593,6 +632,8 @@ class Config(object):
             'anonymise_numbers_at_numeric_boundaries_only', True)
         self.anonymise_strings_at_word_boundaries_only = cfg.opt_bool(
             'anonymise_strings_at_word_boundaries_only', True)
+        self.scrub_literals_with_flashtext = cfg.opt_bool(
+            'scrub_literals_with_flashtext', False)
 
         self.scrub_string_suffixes = cfg.opt_multiline('scrub_string_suffixes')
         cfg.require_absent(
@@ -675,6 +716,12 @@ class Config(object):
             'max_rows_before_commit', DEFAULT_MAX_ROWS_BEFORE_COMMIT)
         self.max_bytes_before_commit = cfg.opt_int(
             'max_bytes_before_commit', DEFAULT_MAX_BYTES_BEFORE_COMMIT)
+        self.max_rows_per_insert = cfg.opt_int_positive(
+            'max_rows_per_insert', DEFAULT_MAX_ROWS_PER_INSERT)
+        self.max_bytes_per_insert = cfg.opt_int_positive(
+            'max_bytes_per_insert', DEFAULT_MAX_BYTES_PER_INSERT)
+        self.incremental_pk_window = cfg.opt_int_positive(
+            'incremental_pk_window', DEFAULT_INCREMENTAL_PK_WINDOW)
         self.temporary_tablename = cfg.opt_str(
             'temporary_tablename')
 
@@ -697,6 +744,12 @@ class Config(object):
         if admin_database_cfg_section in source_database_cfg_sections:
             raise ValueError("Admin database mustn't be listed as a "
                              "source database")
+        self.source_reflection_cache_dir = cfg.opt_str(
+            'source_reflection_cache_dir')
+        self.source_reflection_threads = cfg.opt_int(
+            'source_reflection_threads', DEFAULT_SOURCE_REFLECTION_THREADS)
+        if self.source_reflection_threads < 1:
+            raise ValueError("source_reflection_threads must be >=1")
 
         if RUNNING_WITHOUT_CONFIG:
             self.destdb = None  # type: Optional[DatabaseHolder]
@@ -742,7 +795,11 @@ class Config(object):
                                  name=sourcedb_name,
                                  with_session=open_databases,
                                  with_conn=False,
-                                 reflect=open_databases)
+                                 reflect=open_databases,
+                                 reflection_cache_dir=(
+                                     self.source_reflection_cache_dir),
+                                 reflection_threads=(
+                                     self.source_reflection_threads))
             if not srcdb:
                 raise ValueError(
                     f"Source database {sourcedb_name} misconfigured")
@@ -756,6 +813,20 @@ class Config(object):
         # Processing options
         # ---------------------------------------------------------------------
 
+        self.patient_batch_size = cfg.opt_int(
+            'patient_batch_size', DEFAULT_PATIENT_BATCH_SIZE)
+        if self.patient_batch_size < 1:
+            raise ValueError("patient_batch_size must be at least 1")
+        self.nonpatient_pk_range_size = cfg.opt_int(
+            'nonpatient_pk_range_size', DEFAULT_NONPATIENT_PK_RANGE_SIZE)
+        if self.nonpatient_pk_range_size < 1:
+            raise ValueError("nonpatient_pk_range_size must be at least 1")
+        self.partition_nonpatient_tables_by_pk_range = cfg.opt_bool(
+            'partition_nonpatient_tables_by_pk_range', False)
+        self.incremental_delete_by_merge = cfg.opt_bool(
+            'incremental_delete_by_merge', False)
+        self.status_update_interval_s = cfg.opt_int_positive(
+            'status_update_interval_s', DEFAULT_STATUS_UPDATE_INTERVAL_S)
         self.debug_max_n_patients = cfg.opt_int('debug_max_n_patients', 0)
         self.debug_pid_list = cfg.opt_multiline('debug_pid_list')
 
@@ -766,6 +837,12 @@ class Config(object):
         self.optout_pid_filenames = cfg.opt_multiline('optout_pid_filenames')
         self.optout_mpid_filenames = cfg.opt_multiline('optout_mpid_filenames')
         self.optout_col_values = cfg.opt_pyvalue_list('optout_col_values')
+        self.optout_delete_batch_size = cfg.opt_int_positive(
+            'optout_delete_batch_size', 0)
+        self.optout_delete_threads = cfg.opt_int(
+            'optout_delete_threads', 1)
+        if self.optout_delete_threads < 1:
+            raise ValueError("optout_delete_threads must be at least 1")
 
         # ---------------------------------------------------------------------
         # Rest of initialization
@@ -782,8 +859,15 @@ class Config(object):
         self.chunksize = DEFAULT_CHUNKSIZE
         self.debug_scrubbers = False
         self.save_scrubbers = False
+        self.process_cluster = ""
+        self.resume = False
 
+        self.status_publisher = None  # type: Optional[StatusPublisher]
+
+        self._text_extraction_pool = None  # type: Optional[TextExtractionPool]
+        self._src_rows_read = 0
         self._src_bytes_read = 0
+        self._dest_rows_written = 0
         self._dest_bytes_written = 0
         self._echo = False
 
@@ -825,6 +909,36 @@ class Config(object):
             f"{sizeof_fmt(self._dest_bytes_written)} written"
         )
 
+    @property
+    def src_rows_read(self) -> int:
+        """
+        Returns the number of rows read from the source database(s) so far.
+        """
+        return self._src_rows_read
+
+    @property
+    def dest_rows_written(self) -> int:
+        """
+        Returns the number of rows written to the destination database so
+        far.
+        """
+        return self._dest_rows_written
+
+    @property
+    def src_bytes_read(self) -> int:
+        """
+        Returns the number of bytes read from the source database(s) so far.
+        """
+        return self._src_bytes_read
+
+    @property
+    def dest_bytes_written(self) -> int:
+        """
+        Returns the number of bytes written to the destination database so
+        far.
+        """
+        return self._dest_bytes_written
+
     def load_dd(self, check_against_source_db: bool = True) -> None:
         """
         Loads the data dictionary (DD) into the config.
@@ -1034,15 +1148,17 @@ class Config(object):
         """
         self._destdb_transaction_limiter.commit()
 
-    def notify_src_bytes_read(self, n_bytes: int) -> None:
+    def notify_src_bytes_read(self, n_bytes: int, n_rows: int = 0) -> None:
         """
         Use this function to tell the config how many bytes have been read
         from the source database. See, for example, :func:`overall_progress`.
 
         Args:
             n_bytes: the number of bytes read
+            n_rows: the number of rows read
         """
         self._src_bytes_read += n_bytes
+        self._src_rows_read += n_rows
 
     def notify_dest_db_transaction(self, n_rows: int, n_bytes: int) -> None:
         """
@@ -1059,6 +1175,7 @@ class Config(object):
         """
         self._destdb_transaction_limiter.notify(n_rows=n_rows, n_bytes=n_bytes)
         # ... may trigger a commit
+        self._dest_rows_written += n_rows
         self._dest_bytes_written += n_bytes
 
     def extract_text_extension_permissible(self, extension: str) -> bool:
@@ -1081,3 +1198,30 @@ class Config(object):
         if self.extract_text_extensions_permitted:
             return extension in self.extract_text_extensions_permitted
         return extension not in self.extract_text_extensions_prohibited
+
+    def get_text_extraction_pool(self) -> Optional[TextExtractionPool]:
+        """
+        Returns the pool of worker processes used for text extraction (created
+        on first use), or ``None`` if text is to be extracted in-process.
+
+        See the config options ``extract_text_pool_size`` and
+        ``extract_text_timeout_s``.
+        """
+        if self.extract_text_pool_size == 0:
+            return None
+        if self._text_extraction_pool is None:
+            self._text_extraction_pool = TextExtractionPool(
+                processes=self.extract_text_pool_size,
+                timeout_s=self.extract_text_timeout_s,
+                plain=self.extract_text_plain,
+                width=self.extract_text_width,
+            )
+        return self._text_extraction_pool
+
+    def close_text_extraction_pool(self) -> None:
+        """
+        Shuts down the text extraction pool, if there is one.
+        """
+        if self._text_extraction_pool is not None:
+            self._text_extraction_pool.close()
+            self._text_extraction_pool = None
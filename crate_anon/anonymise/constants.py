@@ -80,8 +80,20 @@ ANON_CONFIG_ENV_VAR = 'CRATE_ANON_CONFIG'
 
 DATEFORMAT_ISO8601 = "%Y-%m-%dT%H:%M:%S%z"  # e.g. 2013-07-24T20:04:07+0100
 DEFAULT_INDEX_LEN = 20  # for data types where it's mandatory
+DEFAULT_FETCH_CHUNKSIZE = 1000
+DEFAULT_INCREMENTAL_PK_WINDOW = 100000  # 100k
+DEFAULT_PATIENT_BATCH_SIZE = 100
+DEFAULT_NONPATIENT_PK_RANGE_SIZE = 100000  # 100k
+DEFAULT_EXTRACT_TEXT_POOL_SIZE = 0  # extract text in-process
+DEFAULT_EXTRACT_TEXT_TIMEOUT_S = 300  # 5 min
+DEFAULT_SOURCE_REFLECTION_THREADS = 1
+DEFAULT_STATUS_UPDATE_INTERVAL_S = 10
 DEFAULT_MAX_ROWS_BEFORE_COMMIT = 1000
 DEFAULT_MAX_BYTES_BEFORE_COMMIT = 80 * 1024 * 1024
+DEFAULT_MAX_ROWS_PER_INSERT = 100
+DEFAULT_MAX_BYTES_PER_INSERT = 8 * 1024 * 1024
+MAX_PKS_PER_DELETE = 1000  # e.g. SQL Server allows ~2,100 parameters
+MAX_WORK_QUEUE_RANGES_PER_TABLE = 10000
 
 LONGTEXT = "LONGTEXT"
 
@@ -236,6 +248,12 @@ extract_text_plain = False
 
 extract_text_width = 80
 
+extract_text_pool_size = {DEFAULT_EXTRACT_TEXT_POOL_SIZE}
+extract_text_timeout_s = {DEFAULT_EXTRACT_TEXT_TIMEOUT_S}
+
+extracted_text_cache_max_mb = 0
+extracted_text_cache_encryption_phrase = SOME_PASSPHRASE_FOR_TEXT_CACHE
+
 # -----------------------------------------------------------------------------
 # Anonymisation
 # -----------------------------------------------------------------------------
@@ -273,6 +291,8 @@ anonymise_numbers_at_word_boundaries_only = False
 anonymise_numbers_at_numeric_boundaries_only = True
 anonymise_strings_at_word_boundaries_only = True
 
+scrub_literals_with_flashtext = False
+
 # -----------------------------------------------------------------------------
 # Output fields and formatting
 # -----------------------------------------------------------------------------
@@ -295,6 +315,11 @@ ddgen_append_source_info_to_comment = True
 max_rows_before_commit = {DEFAULT_MAX_ROWS_BEFORE_COMMIT}
 max_bytes_before_commit = {DEFAULT_MAX_BYTES_BEFORE_COMMIT}
 
+max_rows_per_insert = {DEFAULT_MAX_ROWS_PER_INSERT}
+max_bytes_per_insert = {DEFAULT_MAX_BYTES_PER_INSERT}
+
+incremental_pk_window = {DEFAULT_INCREMENTAL_PK_WINDOW}
+
 temporary_tablename = _temp_table
 
 # -----------------------------------------------------------------------------
@@ -309,6 +334,19 @@ destination_database = my_destination_database
 
 admin_database = my_admin_database
 
+source_reflection_cache_dir =
+source_reflection_threads = {DEFAULT_SOURCE_REFLECTION_THREADS}
+
+# -----------------------------------------------------------------------------
+# Processing options
+# -----------------------------------------------------------------------------
+
+patient_batch_size = {DEFAULT_PATIENT_BATCH_SIZE}
+nonpatient_pk_range_size = {DEFAULT_NONPATIENT_PK_RANGE_SIZE}
+partition_nonpatient_tables_by_pk_range = False
+incremental_delete_by_merge = False
+status_update_interval_s = {DEFAULT_STATUS_UPDATE_INTERVAL_S}
+
 # -----------------------------------------------------------------------------
 # PROCESSING OPTIONS, TO LIMIT DATA QUANTITY FOR TESTING
 # -----------------------------------------------------------------------------
@@ -325,6 +363,9 @@ optout_mpid_filenames =
 
 optout_col_values =
 
+optout_delete_batch_size = 0
+optout_delete_threads = 1
+
 
 # =============================================================================
 # Extra regular expression patterns you wish to be scrubbed from the text
@@ -448,6 +489,13 @@ ddgen_allow_fulltext_indexing = True
 ddgen_force_lower_case = True
 ddgen_convert_odd_chars_to_underscore = True
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # FETCHING DATA
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+stream_results = False
+fetch_chunksize = {DEFAULT_FETCH_CHUNKSIZE}
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # PROCESSING OPTIONS, TO LIMIT DATA QUANTITY FOR TESTING
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -628,8 +676,18 @@ ddgen_binary_to_text_field_pairs =
     ALTERMETHOD=ALTERMETHOD,
     SRCFLAG=SRCFLAG,
     LONGTEXT=LONGTEXT,
+    DEFAULT_FETCH_CHUNKSIZE=DEFAULT_FETCH_CHUNKSIZE,
+    DEFAULT_INCREMENTAL_PK_WINDOW=DEFAULT_INCREMENTAL_PK_WINDOW,
     DEFAULT_MAX_ROWS_BEFORE_COMMIT=DEFAULT_MAX_ROWS_BEFORE_COMMIT,
     DEFAULT_MAX_BYTES_BEFORE_COMMIT=DEFAULT_MAX_BYTES_BEFORE_COMMIT,
+    DEFAULT_MAX_ROWS_PER_INSERT=DEFAULT_MAX_ROWS_PER_INSERT,
+    DEFAULT_MAX_BYTES_PER_INSERT=DEFAULT_MAX_BYTES_PER_INSERT,
+    DEFAULT_PATIENT_BATCH_SIZE=DEFAULT_PATIENT_BATCH_SIZE,
+    DEFAULT_NONPATIENT_PK_RANGE_SIZE=DEFAULT_NONPATIENT_PK_RANGE_SIZE,
+    DEFAULT_EXTRACT_TEXT_POOL_SIZE=DEFAULT_EXTRACT_TEXT_POOL_SIZE,
+    DEFAULT_EXTRACT_TEXT_TIMEOUT_S=DEFAULT_EXTRACT_TEXT_TIMEOUT_S,
+    DEFAULT_SOURCE_REFLECTION_THREADS=DEFAULT_SOURCE_REFLECTION_THREADS,
+    DEFAULT_STATUS_UPDATE_INTERVAL_S=DEFAULT_STATUS_UPDATE_INTERVAL_S,
     DECISION=DECISION,
     VERSION=CRATE_VERSION,
     VERSION_DATE=CRATE_VERSION_DATE,
@@ -26,15 +26,32 @@ crate_anon/anonymise/dbholder.py
 
 **Database "holder".**
 
+Reflecting a large database (thousands of tables) is slow. The holder can
+reflect tables using several threads, and can cache the reflected metadata on
+disk, keyed by the database URL and a "schema fingerprint" that changes
+whenever tables or views are created, altered, or dropped (see
+:func:`get_schema_fingerprint`). Where no fingerprint is available for a
+database dialect, the cache is not used.
+
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import logging
+import os
+import pickle
+import tempfile
 from typing import List, Optional, TYPE_CHECKING
 
+from cardinal_pythonlib.sqlalchemy.dialect import SqlaDialectName
+import sqlalchemy
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.engine.base import Connection
+from sqlalchemy.engine.reflection import Inspector
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.schema import MetaData
 
 if TYPE_CHECKING:
@@ -43,6 +60,104 @@ if TYPE_CHECKING:
 log = logging.getLogger(__name__)
 
 
+# =============================================================================
+# Constants
+# =============================================================================
+
+REFLECTION_CHUNK_SIZE = 50  # tables per task, when reflecting in parallel
+
+
+# =============================================================================
+# Reflection helpers
+# =============================================================================
+
+def get_schema_fingerprint(engine: Engine) -> Optional[str]:
+    """
+    Returns a string that changes whenever the structure of the database
+    changes (tables or views created, altered, or dropped), using the
+    database's own catalogue, or ``None`` if we don't know how to do that for
+    this dialect.
+
+    - MySQL: table count and latest creation time from
+      ``INFORMATION_SCHEMA.TABLES``, plus a checksum of
+      ``INFORMATION_SCHEMA.COLUMNS``.
+    - SQL Server: object count and latest modification time from
+      ``sys.objects`` (SQL Server's ``INFORMATION_SCHEMA`` views don't record
+      modification times).
+    - SQLite: ``PRAGMA schema_version``.
+    """
+    dialect_name = engine.dialect.name
+    if dialect_name == SqlaDialectName.MYSQL:
+        queries = [
+            """
+                SELECT COUNT(*), MAX(create_time)
+                FROM information_schema.tables
+                WHERE table_schema = DATABASE()
+            """,
+            """
+                SELECT COUNT(*), SUM(CRC32(CONCAT_WS(
+                    '|', table_name, column_name, column_type, is_nullable,
+                    column_key)))
+                FROM information_schema.columns
+                WHERE table_schema = DATABASE()
+            """,
+        ]
+    elif dialect_name == SqlaDialectName.MSSQL:
+        queries = [
+            """
+                SELECT COUNT(*), MAX(modify_date)
+                FROM sys.objects
+                WHERE type IN ('U', 'V')
+            """,
+        ]
+    elif dialect_name == SqlaDialectName.SQLITE:
+        queries = ["PRAGMA schema_version"]
+    else:
+        return None
+    with engine.connect() as connection:
+        results = [
+            tuple(connection.execute(text(q)).fetchone())
+            for q in queries
+        ]
+    return repr(results)
+
+
+def reflect_in_parallel(engine: Engine,
+                        metadata: MetaData,
+                        nthreads: int,
+                        views: bool = True) -> None:
+    """
+    Reflects all tables (and, optionally, views) from a database into
+    ``metadata``, using several threads (each with its own connection). Each
+    thread reflects a chunk of tables into its own :class:`MetaData`, and the
+    results are then copied into ``metadata``.
+
+    Args:
+        engine: SQLAlchemy :class:`Engine`
+        metadata: SQLAlchemy :class:`MetaData` to reflect into
+        nthreads: number of threads
+        views: include views?
+    """
+    inspector = Inspector.from_engine(engine)
+    names = list(inspector.get_table_names())
+    if views:
+        names += inspector.get_view_names()
+    chunks = [names[i:i + REFLECTION_CHUNK_SIZE]
+              for i in range(0, len(names), REFLECTION_CHUNK_SIZE)]
+
+    def reflect_chunk(chunk: List[str]) -> MetaData:
+        md = MetaData()
+        md.reflect(bind=engine, views=views, only=chunk,
+                   resolve_fks=False)  # other chunks have the other tables
+        return md
+
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        for md in executor.map(reflect_chunk, chunks):
+            for table in md.tables.values():
+                if table.key not in metadata.tables:
+                    table.tometadata(metadata)
+
+
 # =============================================================================
 # Convenience object
 # =============================================================================
@@ -59,7 +174,9 @@ class DatabaseHolder(object):
                  with_conn: bool = True,
                  reflect: bool = True,
                  encoding: str = 'utf-8',
-                 echo: bool = False) -> None:
+                 echo: bool = False,
+                 reflection_cache_dir: str = None,
+                 reflection_threads: int = 1) -> None:
         """
         Args:
             name: internal database name
@@ -70,6 +187,9 @@ class DatabaseHolder(object):
             reflect: read the database structure (when required)?
             encoding: passed to SQLAlchemy's :func:`create_engine`
             echo: passed to SQLAlchemy's :func:`create_engine`
+            reflection_cache_dir: directory in which to cache reflected
+                metadata (or ``None`` not to cache)
+            reflection_threads: number of threads to use for reflection
         """
         self.name = name
         self.srccfg = srccfg
@@ -80,6 +200,8 @@ class DatabaseHolder(object):
         self._reflected = False
         self._table_names = []  # type: List[str]
         self._metadata = MetaData(bind=self.engine)
+        self._reflection_cache_dir = reflection_cache_dir
+        self._reflection_threads = reflection_threads
         log.debug(self.engine)  # obscures password
 
         if with_conn:  # for raw connections
@@ -95,12 +217,83 @@ class DatabaseHolder(object):
         """
         if not self._reflect_on_request:
             return
-        log.info(f"Reflecting database: {self.name}")
-        # self.table_names = get_table_names(self.engine)
-        self._metadata.reflect(views=True)  # include views
+        cache_filename = self._get_reflection_cache_filename()
+        if not (cache_filename and self._load_reflection_cache(
+                cache_filename)):
+            log.info(f"Reflecting database: {self.name}")
+            # self.table_names = get_table_names(self.engine)
+            if self._reflection_threads > 1:
+                reflect_in_parallel(self.engine, self._metadata,
+                                    self._reflection_threads)
+            else:
+                self._metadata.reflect(views=True)  # include views
+            if cache_filename:
+                self._save_reflection_cache(cache_filename)
         self._table_names = [t.name for t in self._metadata.sorted_tables]
         self._reflected = True
 
+    def _get_reflection_cache_filename(self) -> Optional[str]:
+        """
+        Returns the filename for the reflection cache for this database in its
+        current state, or ``None`` if we are not caching.
+        """
+        if not self._reflection_cache_dir:
+            return None
+        fingerprint = get_schema_fingerprint(self.engine)
+        if fingerprint is None:
+            log.debug(f"No schema fingerprint available for database "
+                      f"{self.name}; not caching reflection")
+            return None
+        key = "|".join([
+            repr(self.engine.url),  # obscures password
+            fingerprint,
+            sqlalchemy.__version__,  # pickle format may change
+        ])
+        digest = hashlib.sha256(key.encode("utf8")).hexdigest()
+        return os.path.join(self._reflection_cache_dir,
+                            f"{self.name}_{digest}.pickle")
+
+    def _load_reflection_cache(self, filename: str) -> bool:
+        """
+        Loads reflected metadata from a cache file, if it exists. Returns
+        success.
+        """
+        if not os.path.isfile(filename):
+            return False
+        log.info(f"Loading cached structure of database {self.name} from "
+                 f"{filename}")
+        try:
+            with open(filename, "rb") as f:
+                metadata = pickle.load(f)
+        except Exception as e:
+            log.warning(f"Unable to read reflection cache {filename}: {e}")
+            return False
+        metadata.bind = self.engine
+        self._metadata = metadata
+        return True
+
+    def _save_reflection_cache(self, filename: str) -> None:
+        """
+        Saves reflected metadata to a cache file. Writes to a temporary file
+        first, since other processes may be reading the same cache.
+        """
+        directory = os.path.dirname(filename)
+        tmpname = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self._metadata, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, filename)
+        except (OSError, pickle.PicklingError, RecursionError) as e:
+            # RecursionError: e.g. very long chains of foreign keys
+            log.warning(f"Unable to write reflection cache {filename}: {e}")
+            if tmpname and os.path.exists(tmpname):
+                os.remove(tmpname)
+            return
+        log.info(f"Cached structure of database {self.name} in {filename}")
+
     def update_metadata(self) -> None:
         """
         Updates the metadata, for example if a table has been dropped.
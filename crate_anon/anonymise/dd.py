@@ -40,8 +40,8 @@ import csv
 from functools import lru_cache
 import logging
 import operator
-from typing import (AbstractSet, Any, List, Optional, Tuple, TYPE_CHECKING,
-                    Union)
+from typing import (AbstractSet, Any, Dict, List, Optional, Tuple,
+                    TYPE_CHECKING, Union)
 
 from cardinal_pythonlib.sql.validation import is_sqltype_integer
 from cardinal_pythonlib.sqlalchemy.schema import (
@@ -89,6 +89,12 @@ class DataDictionary(object):
         # noinspection PyArgumentList
         self.cached_srcdb_table_pairs = SortedSet()
         self.n_definers = 0
+        # Indexes of self.rows; see _build_indexes()
+        self._indexed = False
+        self._rows_by_src_db = {}  # type: Dict[str, List[DataDictionaryRow]]
+        self._rows_by_src_table = {}  # type: Dict[Tuple[str, str], List[DataDictionaryRow]]  # noqa
+        self._row_by_src_field = {}  # type: Dict[Tuple[str, str, str], DataDictionaryRow]  # noqa
+        self._rows_by_dest_table = {}  # type: Dict[str, List[DataDictionaryRow]]  # noqa
 
     def read_from_file(self, filename: str) -> None:
         """
@@ -224,7 +230,7 @@ class DataDictionary(object):
             # Don't scrub_in non-patient tables
             if (ddr.src_table
                     not in self.get_src_tables_with_patient_info(ddr.src_db)):
-                ddr._scrub = False
+                ddr.remove_scrub_from_alter_methods()
         log.info("... done")
         self.sort()
 
@@ -238,6 +244,7 @@ class DataDictionary(object):
             key=operator.attrgetter("src_db_lowercase",
                                     "src_table_lowercase",
                                     "src_field_lowercase"))
+        self.clear_caches()
         log.info("... done")
 
     def check_against_source_db(self) -> None:
@@ -324,10 +331,8 @@ class DataDictionary(object):
                     # Duff alter method?
                     for am in r.alter_methods:
                         if am.extract_from_blob:
-                            extrow = next(
-                                (r2 for r2 in rows
-                                    if r2.src_field == am.extract_ext_field),
-                                None)
+                            extrow = self.get_row(d, t,
+                                                  am.extract_ext_field)
                             if extrow is None:
                                 raise ValueError(
                                     f"alter_method = {r.alter_method}, but "
@@ -483,6 +488,69 @@ class DataDictionary(object):
             [r.get_tsv() for r in self.rows]
         )
 
+    # =========================================================================
+    # Indexes
+    # =========================================================================
+
+    def _build_indexes(self) -> None:
+        """
+        Indexes our rows by source database, source table, source field, and
+        destination table, so that queries about one table don't have to
+        scan the whole data dictionary. Built on demand; discarded by
+        :meth:`clear_caches`.
+        """
+        rows_by_src_db = {}  # type: Dict[str, List[DataDictionaryRow]]
+        rows_by_src_table = {}  # type: Dict[Tuple[str, str], List[DataDictionaryRow]]  # noqa
+        row_by_src_field = {}  # type: Dict[Tuple[str, str, str], DataDictionaryRow]  # noqa
+        rows_by_dest_table = {}  # type: Dict[str, List[DataDictionaryRow]]
+        for ddr in self.rows:
+            db_table = (ddr.src_db, ddr.src_table)
+            rows_by_src_db.setdefault(ddr.src_db, []).append(ddr)
+            rows_by_src_table.setdefault(db_table, []).append(ddr)
+            row_by_src_field.setdefault(db_table + (ddr.src_field, ), ddr)
+            rows_by_dest_table.setdefault(ddr.dest_table, []).append(ddr)
+        self._rows_by_src_db = rows_by_src_db
+        self._rows_by_src_table = rows_by_src_table
+        self._row_by_src_field = row_by_src_field
+        self._rows_by_dest_table = rows_by_dest_table
+        self._indexed = True
+
+    def _get_rows_for_src_db(self, src_db: str) -> List[DataDictionaryRow]:
+        """
+        Returns all rows for a source database (in DD order).
+        """
+        if not self._indexed:
+            self._build_indexes()
+        return self._rows_by_src_db.get(src_db, [])
+
+    def _get_rows_for_src_db_table(self, src_db: str, src_table: str) \
+            -> List[DataDictionaryRow]:
+        """
+        Returns all rows for a source table (in DD order).
+        """
+        if not self._indexed:
+            self._build_indexes()
+        return self._rows_by_src_table.get((src_db, src_table), [])
+
+    def _get_rows_for_dest_table(self, dest_table: str) \
+            -> List[DataDictionaryRow]:
+        """
+        Returns all rows for a destination table (in DD order), including
+        omitted rows.
+        """
+        if not self._indexed:
+            self._build_indexes()
+        return self._rows_by_dest_table.get(dest_table, [])
+
+    def get_row(self, src_db: str, src_table: str, src_field: str) \
+            -> Optional[DataDictionaryRow]:
+        """
+        Returns the row for a source field, or ``None`` if there isn't one.
+        """
+        if not self._indexed:
+            self._build_indexes()
+        return self._row_by_src_field.get((src_db, src_table, src_field))
+
     # =========================================================================
     # Global DD queries
     # =========================================================================
@@ -541,9 +609,9 @@ class DataDictionary(object):
         for tables that have an integer PK.
         """
         return SortedSet([
-            (ddr.src_db, ddr.src_table)
-            for ddr in self.rows
-            if self.get_int_pk_ddr(ddr.src_db, ddr.src_table) is not None
+            (src_db, src_table)
+            for src_db, src_table in self.get_src_db_tablepairs()
+            if self.get_int_pk_ddr(src_db, src_table) is not None
         ])
 
     @lru_cache(maxsize=None)
@@ -634,8 +702,8 @@ class DataDictionary(object):
         """
         return SortedSet([
             ddr.src_table
-            for ddr in self.rows
-            if ddr.src_db == src_db and ddr.required
+            for ddr in self._get_rows_for_src_db(src_db)
+            if ddr.required
         ])
 
     @lru_cache(maxsize=None)
@@ -646,8 +714,8 @@ class DataDictionary(object):
         """
         return SortedSet([
             ddr.src_table
-            for ddr in self.rows
-            if ddr.src_db == src_db and not ddr.omit
+            for ddr in self._get_rows_for_src_db(src_db)
+            if not ddr.omit
         ])
 
     @lru_cache(maxsize=None)
@@ -658,8 +726,8 @@ class DataDictionary(object):
         """
         return SortedSet([
             ddr.src_table
-            for ddr in self.rows
-            if ddr.src_db == src_db and ddr.contains_patient_info
+            for ddr in self._get_rows_for_src_db(src_db)
+            if ddr.contains_patient_info
         ])
 
     @lru_cache(maxsize=None)
@@ -687,10 +755,8 @@ class DataDictionary(object):
         """
         return SortedSet([
             ddr.dest_table
-            for ddr in self.rows
-            if (ddr.src_db == src_db and
-                ddr.src_table == src_table and
-                not ddr.omit)
+            for ddr in self._get_rows_for_src_db_table(src_db, src_table)
+            if not ddr.omit
         ])
 
     @lru_cache(maxsize=None)
@@ -709,11 +775,7 @@ class DataDictionary(object):
         """
         For a given source database name/table, return a SortedSet of DD rows.
         """
-        return SortedSet([
-            ddr
-            for ddr in self.rows
-            if ddr.src_db == src_db and ddr.src_table == src_table
-        ])
+        return SortedSet(self._get_rows_for_src_db_table(src_db, src_table))
 
     @lru_cache(maxsize=None)
     def get_fieldnames_for_src_table(self, src_db: str, src_table: str) \
@@ -724,8 +786,7 @@ class DataDictionary(object):
         """
         return SortedSet([
             ddr.src_field
-            for ddr in self.rows
-            if ddr.src_db == src_db and ddr.src_table == src_table
+            for ddr in self._get_rows_for_src_db_table(src_db, src_table)
         ])
 
     @lru_cache(maxsize=None)
@@ -737,10 +798,8 @@ class DataDictionary(object):
         """
         return SortedSet([
             ddr
-            for ddr in self.rows
-            if (ddr.scrub_src and
-                ddr.src_db == src_db and
-                ddr.src_table == src_table)
+            for ddr in self._get_rows_for_src_db_table(src_db, src_table)
+            if ddr.scrub_src
         ])
         # even if omit flag set
 
@@ -753,10 +812,8 @@ class DataDictionary(object):
 
         Will return ``None`` if no such data dictionary row exists.
         """
-        for ddr in self.rows:
-            if (ddr.src_db == src_db and
-                    ddr.src_table == src_table and
-                    ddr.pk):
+        for ddr in self._get_rows_for_src_db_table(src_db, src_table):
+            if ddr.pk:
                 return ddr
         return None
 
@@ -769,10 +826,8 @@ class DataDictionary(object):
 
         Will return ``None`` if no such data dictionary row exists.
         """
-        for ddr in self.rows:
-            if (ddr.src_db == src_db and
-                    ddr.src_table == src_table and
-                    ddr.pk and
+        for ddr in self._get_rows_for_src_db_table(src_db, src_table):
+            if (ddr.pk and
                     is_sqltype_integer(ddr.src_datatype)):
                 return ddr
         return None
@@ -794,10 +849,8 @@ class DataDictionary(object):
         For a given source database name and table, does it have an active
         destination?
         """
-        for ddr in self.rows:
-            if (ddr.src_db == src_db and
-                    ddr.src_table == src_table and
-                    not ddr.omit):
+        for ddr in self._get_rows_for_src_db_table(src_db, src_table):
+            if not ddr.omit:
                 return True
         return False
 
@@ -808,10 +861,8 @@ class DataDictionary(object):
         the field providing primary PID information (or ``None`` if there isn't
         one).
         """
-        for ddr in self.rows:
-            if (ddr.src_db == src_db and
-                    ddr.src_table == src_table and
-                    ddr.primary_pid):
+        for ddr in self._get_rows_for_src_db_table(src_db, src_table):
+            if ddr.primary_pid:
                 return ddr.src_field
         return None
 
@@ -822,10 +873,8 @@ class DataDictionary(object):
         the field providing master PID (MPID) information (or ``None`` if there
         isn't one).
         """
-        for ddr in self.rows:
-            if (ddr.src_db == src_db and
-                    ddr.src_table == src_table and
-                    ddr.master_pid):
+        for ddr in self._get_rows_for_src_db_table(src_db, src_table):
+            if ddr.master_pid:
                 return ddr.src_field
         return None
 
@@ -842,8 +891,7 @@ class DataDictionary(object):
         """
         return SortedSet([
             (ddr.src_db, ddr.src_table)
-            for ddr in self.rows
-            if ddr.dest_table == dest_table
+            for ddr in self._get_rows_for_dest_table(dest_table)
         ])
 
     @lru_cache(maxsize=None)
@@ -854,8 +902,8 @@ class DataDictionary(object):
         """
         return SortedSet([
             ddr
-            for ddr in self.rows
-            if ddr.dest_table == dest_table and not ddr.omit
+            for ddr in self._get_rows_for_dest_table(dest_table)
+            if not ddr.omit
         ])
 
     # =========================================================================
@@ -972,10 +1020,11 @@ class DataDictionary(object):
 
     def clear_caches(self) -> None:
         """
-        Clear all our cached information.
+        Clear all our cached information (including our indexes).
         """
         for func in self.cached_funcs():
             func.cache_clear()
+        self._indexed = False
 
     def debug_cache_hits(self) -> None:
         """
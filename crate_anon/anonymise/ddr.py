@@ -34,6 +34,7 @@ crate_anon/anonymise/ddr.py
 
 import ast
 import logging
+import sys
 from typing import Any, List, Dict, Iterable, Optional, TYPE_CHECKING, Union
 
 from cardinal_pythonlib.convert import convert_to_int
@@ -89,7 +90,45 @@ DATABASE_SAFE_CONFIG_FWD_REF = "DatabaseSafeConfig"
 class DataDictionaryRow(object):
     """
     Class representing a single row of a data dictionary (a DDR).
+
+    Data dictionaries can have hundreds of thousands of rows, and every
+    anonymiser process loads the whole thing, so instances use
+    ``__slots__`` (no per-instance ``__dict__``), and the names that are
+    repeated across many rows (databases, tables, data types) are interned.
     """
+    __slots__ = (
+        "config",
+        "src_db",
+        "src_table",
+        "src_field",
+        "src_datatype",
+        "src_is_textual",
+        "src_textlength",
+        "_src_sqla_coltype",
+        "scrub_src",
+        "scrub_method",
+        "omit",
+        "dest_table",
+        "dest_field",
+        "dest_datatype",
+        "index",
+        "indexlen",
+        "comment",
+        "_from_file",
+        "_pk",
+        "_add_src_hash",
+        "_primary_pid",
+        "_defines_primary_pids",
+        "_master_pid",
+        "_constant",
+        "_addition_only",
+        "_opt_out_info",
+        "_required_scrubber",
+        "_inclusion_values",
+        "_exclusion_values",
+        "_alter_methods",
+    )
+
     ROWNAMES = [
         "src_db",
         "src_table",
@@ -544,10 +583,10 @@ class DataDictionaryRow(object):
         Set internal fields from a dict of elements representing a row from the
         TSV data dictionary file.
         """
-        self.src_db = valuedict['src_db']
-        self.src_table = valuedict['src_table']
+        self.src_db = sys.intern(valuedict['src_db'])
+        self.src_table = sys.intern(valuedict['src_table'])
         self.src_field = valuedict['src_field']
-        self.src_datatype = valuedict['src_datatype'].upper()
+        self.src_datatype = sys.intern(valuedict['src_datatype'].upper())
         self.src_is_textual = crate_anon.common.sql.is_sql_column_type_textual(
             self.src_datatype)
         if self.src_is_textual:
@@ -570,9 +609,9 @@ class DataDictionaryRow(object):
         self.exclusion_values = valuedict['exclusion_values']  # a property
         # noinspection PyAttributeOutsideInit
         self.alter_method = valuedict['alter_method']  # a property
-        self.dest_table = valuedict['dest_table']
+        self.dest_table = sys.intern(valuedict['dest_table'])
         self.dest_field = valuedict['dest_field']
-        self.dest_datatype = valuedict['dest_datatype'].upper()
+        self.dest_datatype = sys.intern(valuedict['dest_datatype'].upper())
         self.index = INDEX.lookup(valuedict['index'], allow_none=True)
         self.indexlen = convert_to_int(valuedict['indexlen'])
         self.comment = valuedict['comment']
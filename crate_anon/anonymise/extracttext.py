@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/anonymise/extracttext.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Text extraction from documents, optionally using a pool of worker
+processes.**
+
+Extracting text from binary documents (PDF, DOCX, ...) is often the slowest
+part of anonymising a table that holds them, and it is CPU-bound (or waits on
+external tools such as ``pdftotext``). The :class:`TextExtractionPool` runs
+the conversions for upcoming rows concurrently, while the caller carries on
+consuming results in the original row order.
+
+"""
+
+from collections import deque
+import logging
+import multiprocessing
+from multiprocessing.pool import AsyncResult, Pool
+import traceback
+from typing import (
+    Any, Callable, Deque, Dict, Generator, Iterable, NamedTuple, Optional,
+    Tuple, TYPE_CHECKING,
+)
+
+from cardinal_pythonlib.extract_text import (
+    document_to_text,
+    TextProcessingConfig,
+)
+from cardinal_pythonlib.timing import MultiTimerContext, timer
+
+if TYPE_CHECKING:
+    from crate_anon.anonymise.textcache import ExtractedTextCache
+
+log = logging.getLogger(__name__)
+
+TIMING_EXTRACT_TEXT = "extract_text"
+TIMING_EXTRACT_TEXT_WAIT = "extract_text_wait"
+
+
+# =============================================================================
+# Extracting text from a single document
+# =============================================================================
+
+class TextExtractionSource(NamedTuple):
+    """
+    Everything needed to extract text from one document: either a filename or
+    a BLOB, plus the file extension. Picklable, so it can be sent to a worker
+    process.
+    """
+    filename: Optional[str]
+    blob: Optional[bytes]
+    extension: Optional[str]
+
+
+ExtractionResult = Tuple[Optional[str], bool]  # text, extracted
+
+
+def extract_text_from_source(source: TextExtractionSource,
+                             plain: bool,
+                             width: int) -> ExtractionResult:
+    """
+    Extracts text from a document.
+
+    Args:
+        source: a :class:`TextExtractionSource`
+        plain: use plainest possible layout for text?
+        width: width to word-wrap extracted text to
+
+    Returns:
+        tuple: ``text, extracted``
+
+    """
+    try:
+        textconfig = TextProcessingConfig(plain=plain, width=width)
+        text = document_to_text(filename=source.filename,
+                                blob=source.blob,
+                                extension=source.extension,
+                                config=textconfig)
+    except Exception as e:
+        # Runtime error
+        traceback.print_exc()  # full details, please
+        log.error(f"Caught exception from document_to_text: {e}")
+        return None, False
+    return text, True
+
+
+def gen_extracted_in_process(
+        items: Iterable[Any],
+        get_sources: Callable[[Any], Dict[Any, TextExtractionSource]],
+        plain: bool,
+        width: int,
+        cache: "ExtractedTextCache" = None) \
+        -> Generator[Tuple[Any, Dict[Any, ExtractionResult]], None, None]:
+    """
+    As for :meth:`TextExtractionPool.gen_extracted`, but extracting text in
+    this process, one document at a time.
+    """
+    for item in items:
+        results = {}  # type: Dict[Any, ExtractionResult]
+        for key, source in get_sources(item).items():
+            text = cache.fetch(source) if cache is not None else None
+            if text is not None:
+                results[key] = text, True
+                continue
+            with MultiTimerContext(timer, TIMING_EXTRACT_TEXT):
+                results[key] = extract_text_from_source(source, plain, width)
+            text, extracted = results[key]
+            if extracted and cache is not None:
+                cache.store(source, text)
+        yield item, results
+
+
+# =============================================================================
+# Pool of worker processes
+# =============================================================================
+
+class _PendingJob(object):
+    """
+    A document submitted to the pool, awaiting its result.
+    """
+    def __init__(self, source: TextExtractionSource) -> None:
+        self.source = source
+        self.result = None  # type: Optional[AsyncResult]
+        self.cached_text = None  # type: Optional[str]
+
+
+class TextExtractionPool(object):
+    """
+    Extracts text from documents in a pool of worker processes.
+    """
+    def __init__(self,
+                 processes: int,
+                 timeout_s: int,
+                 plain: bool,
+                 width: int) -> None:
+        """
+        Args:
+            processes:
+                number of worker processes
+            timeout_s:
+                time (in seconds) to wait for any one document before giving
+                up on it (and restarting the pool); 0 for no limit
+            plain:
+                use plainest possible layout for text?
+            width:
+                width to word-wrap extracted text to
+        """
+        assert processes > 0
+        self.processes = processes
+        self.timeout_s = timeout_s or None
+        self.plain = plain
+        self.width = width
+        self.prefetch = 2 * processes
+        self._pool = None  # type: Optional[Pool]
+
+    def _get_pool(self) -> Pool:
+        """
+        Returns the underlying :class:`multiprocessing.pool.Pool`, creating it
+        if necessary.
+        """
+        if self._pool is None:
+            log.info(f"Starting text extraction pool with {self.processes} "
+                     f"processes")
+            self._pool = multiprocessing.Pool(processes=self.processes)
+        return self._pool
+
+    def _submit(self, job: _PendingJob) -> None:
+        """
+        Sends a document to the pool.
+        """
+        job.result = self._get_pool().apply_async(
+            extract_text_from_source,
+            (job.source, self.plain, self.width)
+        )
+
+    def _restart(self, pending: Iterable[_PendingJob]) -> None:
+        """
+        Kills the pool (e.g. because a worker is stuck on a document) and
+        resubmits any documents whose results we have not yet got.
+        """
+        log.warning("Restarting text extraction pool")
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+        for job in pending:
+            if job.result is not None and not job.result.ready():
+                self._submit(job)
+
+    def _get_result(self, job: _PendingJob,
+                    waiting: Iterable[_PendingJob]) -> ExtractionResult:
+        """
+        Waits for the result of one document.
+
+        Args:
+            job: the document we want
+            waiting: other documents submitted but not yet collected
+
+        Returns:
+            tuple: ``text, extracted``
+        """
+        if job.result is None:
+            return job.cached_text, True
+        try:
+            with MultiTimerContext(timer, TIMING_EXTRACT_TEXT_WAIT):
+                return job.result.get(timeout=self.timeout_s)
+        except multiprocessing.TimeoutError:
+            log.error(
+                f"Text extraction timed out after {self.timeout_s} s "
+                f"(filename={job.source.filename!r}, "
+                f"extension={job.source.extension!r}); skipping")
+            self._restart(waiting)
+            return None, False
+
+    def gen_extracted(
+            self,
+            items: Iterable[Any],
+            get_sources: Callable[[Any], Dict[Any, TextExtractionSource]],
+            cache: "ExtractedTextCache" = None) \
+            -> Generator[Tuple[Any, Dict[Any, ExtractionResult]], None, None]:
+        """
+        Reads ahead through ``items`` (e.g. source rows), extracting text
+        from the documents of upcoming items concurrently, and yields results
+        in the original order.
+
+        Args:
+            items:
+                iterable of items
+            get_sources:
+                function taking an item and returning a dictionary mapping
+                keys (e.g. column indexes) to :class:`TextExtractionSource`
+                objects for that item; it may be empty
+            cache:
+                optional
+                :class:`crate_anon.anonymise.textcache.ExtractedTextCache`;
+                documents found there are not sent to the pool, and newly
+                extracted text is stored there
+
+        Yields:
+            tuples: ``item, results``, where ``results`` is a dictionary
+            mapping the same keys to ``text, extracted`` tuples
+
+        """
+        window = deque()  # type: Deque[Tuple[Any, Dict[Any, _PendingJob]]]
+        n_submitted = 0  # documents in the window that were sent to the pool
+
+        def head_ready() -> bool:
+            # Is the first item in the window one we needn't wait for?
+            return all(j.result is None for j in window[0][1].values())
+
+        def collect_first() -> Tuple[Any, Dict[Any, ExtractionResult]]:
+            nonlocal n_submitted
+            item_, jobs_ = window.popleft()
+            results = {}  # type: Dict[Any, ExtractionResult]
+            for key_, job_ in jobs_.items():
+                waiting = [j for _, js in window for j in js.values()]
+                waiting += [j for k, j in jobs_.items() if k != key_]
+                results[key_] = self._get_result(job_, waiting)
+                if job_.result is not None:
+                    n_submitted -= 1
+                    text, extracted = results[key_]
+                    if extracted and cache is not None:
+                        cache.store(job_.source, text)
+            return item_, results
+
+        for item in items:
+            jobs = {}  # type: Dict[Any, _PendingJob]
+            for key, source in get_sources(item).items():
+                job = _PendingJob(source)
+                if cache is not None:
+                    job.cached_text = cache.fetch(source)
+                if job.cached_text is None:
+                    self._submit(job)
+                    n_submitted += 1
+                jobs[key] = job
+            window.append((item, jobs))
+            while window and (n_submitted > self.prefetch or head_ready()):
+                yield collect_first()
+        while window:
+            yield collect_first()
+
+    def close(self) -> None:
+        """
+        Shuts down the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
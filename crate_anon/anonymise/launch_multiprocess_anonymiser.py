@@ -84,6 +84,16 @@ def main() -> None:
         "--nproc", "-n", nargs="?", type=int, default=CPUCOUNT,
         help=f"Number of processes "
              f"(default is the number of CPUs on this machine)")
+    parser.add_argument(
+        "--workqueue", action="store_true",
+        help="Distribute patients and non-patient tables (or ranges of their "
+             "integer PKs) dynamically, via a work queue in the admin "
+             "database, rather than dividing them up in advance")
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Resume an interrupted run: skip the table creation and opt-out "
+             "steps, and skip work already completed (use the same "
+             "--nproc and --workqueue settings as the interrupted run)")
     parser.add_argument(
         '--verbose', '-v', action='store_true',
         help="Be verbose")
@@ -94,6 +104,10 @@ def main() -> None:
     configure_logger_for_colour(rootlogger, level=loglevel)
 
     common_options = ["-v"] * (1 if args.verbose else 0) + unknownargs
+    worker_options = (
+        ['--workqueue'] * (1 if args.workqueue else 0) +
+        ['--resume'] * (1 if args.resume else 0)
+    )
 
     log.debug(f"common_options: {common_options}")
 
@@ -117,21 +131,36 @@ def main() -> None:
     # system module), it might import "regex.py" from the same directory (which
     # it wouldn't normally do, because Python 3 uses absolute not relative
     # imports).
-    procargs = [
-        sys.executable, '-m', ANONYMISER,
-        '--dropremake', '--processcluster=STRUCTURE'
-    ] + common_options
-    check_call_process(procargs)
+    if not args.resume:
+        procargs = [
+            sys.executable, '-m', ANONYMISER,
+            '--dropremake', '--processcluster=STRUCTURE'
+        ] + common_options
+        check_call_process(procargs)
 
     # -------------------------------------------------------------------------
     # Build opt-out lists. Only run one copy of this!
     # -------------------------------------------------------------------------
-    procargs = [
-        sys.executable, '-m', ANONYMISER,
-        '--optout', '--processcluster=OPTOUT',
-        '--skip_dd_check'
-    ] + common_options
-    check_call_process(procargs)
+    if not args.resume:
+        procargs = [
+            sys.executable, '-m', ANONYMISER,
+            '--optout', '--processcluster=OPTOUT',
+            '--skip_dd_check'
+        ] + common_options
+        check_call_process(procargs)
+
+    # -------------------------------------------------------------------------
+    # Fill (or, when resuming, release unfinished items in) the work queue.
+    # Only run one copy of this!
+    # -------------------------------------------------------------------------
+    if args.workqueue:
+        procargs = [
+            sys.executable, '-m', ANONYMISER,
+            '--requeue' if args.resume else '--fillqueue',
+            '--processcluster=QUEUE',
+            '--skip_dd_check'
+        ] + common_options
+        check_call_process(procargs)
 
     # -------------------------------------------------------------------------
     # Now run lots of things simultaneously:
@@ -152,7 +181,7 @@ def main() -> None:
             f'--nprocesses={nprocesses_patient}',
             f'--process={procnum}',
             '--skip_dd_check'
-        ] + common_options
+        ] + worker_options + common_options
         args_list.append(procargs)
     for procnum in range(nprocesses_nonpatient):
         procargs = [
@@ -162,7 +191,7 @@ def main() -> None:
             f'--nprocesses={nprocesses_nonpatient}',
             f'--process={procnum}',
             '--skip_dd_check'
-        ] + common_options
+        ] + worker_options + common_options
         args_list.append(procargs)
     run_multiple_processes(args_list)  # Wait for them all to finish
 
@@ -38,20 +38,35 @@ To create a SQLAlchemy ORM programmatically:
 - http://stackoverflow.com/questions/2574105/sqlalchemy-dynamic-mapping/2575016#2575016
 """  # noqa
 
+from datetime import datetime, timedelta
 import logging
 import random
-from typing import Optional, TYPE_CHECKING, Union
+from typing import (
+    Any, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING, Union,
+)
+import uuid
 
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.sqlalchemy.orm_query import exists_orm
 from sqlalchemy import (
+    BigInteger,
+    Boolean,
     Column,
+    DateTime,
+    Float,
+    Integer,
+    LargeBinary,
     MetaData,
+    String,
     Text,
 )
+from sqlalchemy.dialects.mysql import LONGBLOB
+from sqlalchemy.engine.base import Connection
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql import func, select
 
 from crate_anon.anonymise.config_singleton import config
 from crate_anon.anonymise.constants import (
@@ -65,6 +80,8 @@ if TYPE_CHECKING:
 
 log = logging.getLogger(__name__)
 admin_meta = MetaData()
+
+EXTRACTED_TEXT_CACHE_LAST_USED_RESOLUTION = timedelta(hours=1)
 AdminBase = declarative_base(metadata=admin_meta)
 
 
@@ -261,6 +278,155 @@ class TridRecord(AdminBase):
                 session.rollback()
 
 
+class ExtractedTextCacheEntry(AdminBase):
+    """
+    Caches text extracted from documents (BLOBs or files), so that unchanged
+    documents needn't be converted again. See
+    :class:`crate_anon.anonymise.textcache.ExtractedTextCache`.
+
+    The text has not yet been scrubbed, so it is stored encrypted (and lives
+    in the secret admin database).
+    """
+    __tablename__ = 'secret_extracted_text_cache'
+    __table_args__ = TABLE_KWARGS
+
+    cache_key = Column(
+        'cache_key', String(64),
+        primary_key=True, autoincrement=False,
+        comment="Cache key (keyed hash of document identity and text "
+                "extraction settings) (PK)")
+    pid = Column(
+        'pid', config.pidtype,
+        index=True,
+        comment="Patient ID (PID) of the patient whose record the document "
+                "was first extracted from, if any, so entries can be deleted "
+                "on opt-out")
+    ciphertext = Column(
+        'ciphertext', LargeBinary().with_variant(LONGBLOB(), 'mysql'),
+        comment="Extracted text, encrypted")
+    n_bytes = Column(
+        'n_bytes', BigInteger,
+        comment="Size of the encrypted text (bytes)")
+    last_used = Column(
+        'last_used', DateTime,
+        index=True,
+        comment="When this entry was last used (UTC), for LRU eviction")
+
+    @classmethod
+    def fetch(cls,
+              connection: Connection,
+              cache_key: str) -> Optional[bytes]:
+        """
+        Fetches cached (encrypted) text, marking it as used (unless that was
+        done recently, so that most fetches don't write).
+
+        The connection's transaction should be committed straight away (and
+        not be that of the long-lived admin session), so that other processes
+        fetching the same entry are not kept waiting on its row lock.
+
+        Args:
+            connection: SQLAlchemy connection to the secret admin database
+            cache_key: the document's cache key
+
+        Returns:
+            the encrypted text, or ``None`` if absent
+        """
+        table = cls.__table__
+        row = connection.execute(
+            select([table.c.ciphertext, table.c.last_used]).
+            where(table.c.cache_key == cache_key)
+        ).first()
+        if row is None:
+            return None
+        ciphertext, last_used = row
+        now = datetime.utcnow()
+        if (last_used is None or
+                now - last_used >= EXTRACTED_TEXT_CACHE_LAST_USED_RESOLUTION):
+            connection.execute(
+                table.update().
+                where(table.c.cache_key == cache_key).
+                values(last_used=now)
+            )
+        return ciphertext
+
+    @classmethod
+    def store(cls,
+              connection: Connection,
+              cache_key: str,
+              pid: Optional[Union[int, str]],
+              ciphertext: bytes) -> None:
+        """
+        Stores (encrypted) text. As for :meth:`fetch`, the connection's
+        transaction should be committed straight away.
+
+        Args:
+            connection: SQLAlchemy connection to the secret admin database
+            cache_key: the document's cache key
+            pid: PID of the patient whose record contains the document, or
+                ``None``
+            ciphertext: the encrypted text
+
+        Raises:
+            :exc:`sqlalchemy.exc.IntegrityError` if another process has just
+            stored the same document
+        """
+        connection.execute(
+            cls.__table__.insert().values(
+                cache_key=cache_key,
+                pid=pid,
+                ciphertext=ciphertext,
+                n_bytes=len(ciphertext),
+                last_used=datetime.utcnow()
+            )
+        )
+
+    @classmethod
+    def total_bytes(cls, session: Session) -> int:
+        """
+        Returns the total size of the cached (encrypted) text.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+        """
+        return session.query(func.sum(cls.n_bytes)).scalar() or 0
+
+    @classmethod
+    def prune(cls, session: Session, max_bytes: int) -> int:
+        """
+        Deletes the least recently used entries, so that the total size of
+        what remains is at most ``max_bytes`` (approximately, if several
+        processes are adding entries simultaneously).
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            max_bytes: maximum total size (of encrypted text) to keep
+
+        Returns:
+            the number of entries deleted
+        """
+        if cls.total_bytes(session) <= max_bytes:
+            return 0
+        cutoff = None
+        kept = 0
+        for last_used, n_bytes in (
+                session.query(cls.last_used, cls.n_bytes).
+                order_by(cls.last_used.desc())):
+            kept += n_bytes or 0
+            if kept > max_bytes:
+                cutoff = last_used
+                break
+        if cutoff is None:
+            return 0
+        n_deleted = (
+            session.query(cls).
+            filter(cls.last_used <= cutoff).
+            delete(synchronize_session=False)
+        )
+        log.debug(f"Deleted {n_deleted} least recently used extracted text "
+                  f"cache entries")
+        return n_deleted
+
+
 class OptOutPid(AdminBase):
     """
     Records the PID values of patients opting out of the anonymised database.
@@ -344,3 +510,587 @@ class OptOutMpid(AdminBase):
         # noinspection PyArgumentList
         newthing = cls(mpid=mpid)
         session.merge(newthing)
+
+
+class WorkQueueKind(object):
+    """
+    Kinds of item in the work queue; see :class:`WorkQueueItem`.
+    """
+    PATIENT = "patient"  # one patient, across all patient tables
+    TABLE = "table"  # a non-patient table, or a range of its integer PKs
+
+
+class WorkQueueItem(AdminBase):
+    """
+    An item of work for the anonymiser, when it distributes work dynamically
+    rather than by process number: a patient, a non-patient table, or a range
+    of integer PKs in a non-patient table.
+
+    One process fills the queue (see
+    :func:`crate_anon.anonymise.anonymise.fill_work_queue`). Worker processes
+    then claim items in small batches (see :meth:`claim`), and mark them done
+    once their results have been committed (see :meth:`mark_done`). Processes
+    that finish early simply claim more work, and if a run is interrupted,
+    items that were claimed but not finished can be released and claimed
+    again (see :meth:`release_unfinished`).
+
+    These contain PIDs, which is why they live in the secret admin database.
+    """
+    __tablename__ = 'secret_work_queue'
+    __table_args__ = TABLE_KWARGS
+
+    id = Column(
+        'id', Integer,
+        primary_key=True, autoincrement=True,
+        comment="Arbitrary PK")
+    kind = Column(
+        'kind', String(length=10),
+        nullable=False,
+        comment="Kind of work (patient, table)")
+    pid = Column(
+        'pid', config.pidtype,
+        comment="Patient ID (PID), for patient work")
+    src_db = Column(
+        'src_db', String(length=255),
+        comment="Source database (as named in the data dictionary), for "
+                "table work")
+    src_table = Column(
+        'src_table', String(length=255),
+        comment="Source table, for table work")
+    pk_name = Column(
+        'pk_name', String(length=255),
+        comment="Integer PK column of the source table, if the table is "
+                "divided into PK ranges")
+    pk_first = Column(
+        'pk_first', BigInteger,
+        comment="First PK of the range (inclusive)")
+    pk_last = Column(
+        'pk_last', BigInteger,
+        comment="Last PK of the range (inclusive)")
+    claim = Column(
+        'claim', String(length=32),
+        index=True,
+        comment="Token of the claim by a worker process; NULL if unclaimed")
+    claimed_at = Column(
+        'claimed_at', DateTime,
+        comment="When the item was claimed (UTC)")
+    done = Column(
+        'done', Boolean,
+        nullable=False, default=False,
+        comment="Has the work been completed and committed?")
+
+    @classmethod
+    def clear(cls, session: Session) -> None:
+        """
+        Empties the work queue.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+        """
+        session.query(cls).delete(synchronize_session=False)
+
+    @classmethod
+    def add_patients(cls,
+                     session: Session,
+                     pids: Iterable[Union[int, str]],
+                     chunksize: int = 1000) -> int:
+        """
+        Adds patients to the work queue.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            pids: the patients' PIDs
+            chunksize: number of rows per multi-row ``INSERT``
+
+        Returns:
+            the number of patients added
+        """
+        n = 0
+        rows = []  # type: List[Dict[str, Any]]
+        for pid in pids:
+            rows.append(dict(kind=WorkQueueKind.PATIENT, pid=pid, done=False))
+            if len(rows) >= chunksize:
+                session.execute(cls.__table__.insert(), rows)
+                n += len(rows)
+                rows = []  # type: List[Dict[str, Any]]
+        if rows:
+            session.execute(cls.__table__.insert(), rows)
+            n += len(rows)
+        return n
+
+    @classmethod
+    def add_table(cls,
+                  session: Session,
+                  src_db: str,
+                  src_table: str,
+                  pk_name: str = None,
+                  pk_first: int = None,
+                  pk_last: int = None) -> None:
+        """
+        Adds a non-patient table, or a range of its integer PKs, to the work
+        queue.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            src_db: source database name (as per the data dictionary)
+            src_table: source table name
+            pk_name: integer PK column, if a range is being added
+            pk_first: first PK of the range (inclusive)
+            pk_last: last PK of the range (inclusive)
+        """
+        # noinspection PyArgumentList
+        session.add(cls(kind=WorkQueueKind.TABLE,
+                        src_db=src_db, src_table=src_table,
+                        pk_name=pk_name, pk_first=pk_first, pk_last=pk_last,
+                        done=False))
+
+    @classmethod
+    def add_table_ranges(cls,
+                         session: Session,
+                         src_db: str,
+                         src_table: str,
+                         pk_name: str,
+                         ranges: Iterable[Tuple[int, int]],
+                         chunksize: int = 1000) -> None:
+        """
+        Adds ranges of a non-patient table's integer PKs to the work queue.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            src_db: source database name (as per the data dictionary)
+            src_table: source table name
+            pk_name: integer PK column
+            ranges: ``first, last`` tuples (inclusive)
+            chunksize: number of rows per multi-row ``INSERT``
+        """
+        rows = [
+            dict(kind=WorkQueueKind.TABLE, src_db=src_db, src_table=src_table,
+                 pk_name=pk_name, pk_first=first, pk_last=last, done=False)
+            for first, last in ranges
+        ]
+        for chunk in chunks(rows, chunksize):
+            session.execute(cls.__table__.insert(), chunk)
+
+    @classmethod
+    def claim_items(cls,
+                    session: Session,
+                    kind: str,
+                    max_items: int) -> List["WorkQueueItem"]:
+        """
+        Claims up to ``max_items`` unclaimed items of the specified kind, and
+        commits the claim (so other processes can see it).
+
+        The claim is made with a conditional ``UPDATE`` and a unique token, so
+        two processes can never claim the same item.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            kind: a :class:`WorkQueueKind` value
+            max_items: maximum number of items to claim
+
+        Returns:
+            the claimed items; an empty list means that the queue has no more
+            work of this kind
+        """
+        while True:
+            candidate_ids = [
+                row[0] for row in (
+                    session.query(cls.id).
+                    filter(cls.kind == kind).
+                    filter(cls.claim.is_(None)).
+                    order_by(cls.id).
+                    limit(max_items)
+                )
+            ]
+            if not candidate_ids:
+                return []
+            token = uuid.uuid4().hex
+            (
+                session.query(cls).
+                filter(cls.id.in_(candidate_ids)).
+                filter(cls.claim.is_(None)).  # not claimed by someone else
+                update({cls.claim: token, cls.claimed_at: datetime.utcnow()},
+                       synchronize_session=False)
+            )
+            session.commit()
+            items = (
+                session.query(cls).
+                filter(cls.claim == token).
+                order_by(cls.id).
+                all()
+            )
+            if items:
+                return items
+            # Otherwise, other processes got there first; try again.
+
+    @classmethod
+    def mark_done(cls,
+                  session: Session,
+                  items: Iterable["WorkQueueItem"]) -> None:
+        """
+        Marks items as done (and commits). Call this only once the results of
+        the work have been committed.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            items: the items
+        """
+        ids = [item.id for item in items]
+        if ids:
+            (
+                session.query(cls).
+                filter(cls.id.in_(ids)).
+                update({cls.done: True}, synchronize_session=False)
+            )
+        session.commit()
+
+    @classmethod
+    def get_unfinished(cls, session: Session) -> List["WorkQueueItem"]:
+        """
+        Returns items that were claimed but not finished.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+        """
+        return (
+            session.query(cls).
+            filter(cls.claim.isnot(None)).
+            filter(cls.done == False).  # noqa
+            order_by(cls.id).
+            all()
+        )
+
+    @classmethod
+    def release_unfinished(cls, session: Session) -> int:
+        """
+        Releases items that were claimed but not finished (e.g. by a process
+        that crashed), so that they can be claimed again. Only do this when
+        no worker processes are running.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+
+        Returns:
+            the number of items released
+        """
+        return (
+            session.query(cls).
+            filter(cls.claim.isnot(None)).
+            filter(cls.done == False).  # noqa
+            update({cls.claim: None, cls.claimed_at: None},
+                   synchronize_session=False)
+        )
+
+
+class ProgressLedgerEntry(AdminBase):
+    """
+    Records a unit of anonymisation work that has been completed and
+    committed: a patient, or a non-patient table (or part of one, e.g. a range
+    of its PKs). Entries are made as a run proceeds, and are used to skip work
+    when an interrupted run is resumed (see the ``--resume`` option).
+
+    Entries are per process cluster (see ``--processcluster``), and are
+    cleared when the database structure is created (e.g. ``--dropremake``) at
+    the start of a new run.
+
+    These contain PIDs, which is why they live in the secret admin database.
+    """
+    __tablename__ = 'secret_progress_ledger'
+    __table_args__ = TABLE_KWARGS
+
+    id = Column(
+        'id', Integer,
+        primary_key=True, autoincrement=True,
+        comment="Arbitrary PK")
+    process_cluster = Column(
+        'process_cluster', String(length=255),
+        nullable=False, index=True,
+        comment="Process cluster name")
+    pid = Column(
+        'pid', config.pidtype,
+        comment="Patient ID (PID), for a patient")
+    unit = Column(
+        'unit', String(length=255),
+        index=True,
+        comment="Description of a unit of non-patient work (e.g. table and "
+                "PK range)")
+    completed_at = Column(
+        'completed_at', DateTime,
+        comment="When the work was completed (UTC)")
+
+    @classmethod
+    def clear(cls, session: Session) -> None:
+        """
+        Empties the ledger.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+        """
+        session.query(cls).delete(synchronize_session=False)
+
+    @classmethod
+    def record_patients(cls,
+                        session: Session,
+                        process_cluster: str,
+                        pids: Iterable[Union[int, str]]) -> None:
+        """
+        Records that patients have been completed.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            process_cluster: process cluster name
+            pids: the patients' PIDs
+        """
+        now = datetime.utcnow()
+        rows = [dict(process_cluster=process_cluster, pid=pid,
+                     completed_at=now)
+                for pid in pids]
+        if rows:
+            session.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def record_unit(cls,
+                    session: Session,
+                    process_cluster: str,
+                    unit: str) -> None:
+        """
+        Records that a unit of non-patient work has been completed.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            process_cluster: process cluster name
+            unit: description of the unit of work
+        """
+        # noinspection PyArgumentList
+        session.add(cls(process_cluster=process_cluster, unit=unit,
+                        completed_at=datetime.utcnow()))
+
+    @classmethod
+    def completed_pids(cls,
+                       session: Session,
+                       process_cluster: str) -> Set[Union[int, str]]:
+        """
+        Returns the PIDs of all patients completed by a process cluster.
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            process_cluster: process cluster name
+        """
+        return set(
+            row[0] for row in (
+                session.query(cls.pid).
+                filter(cls.process_cluster == process_cluster).
+                filter(cls.pid.isnot(None))
+            )
+        )
+
+    @classmethod
+    def unit_completed(cls,
+                       session: Session,
+                       process_cluster: str,
+                       unit: str) -> bool:
+        """
+        Has a unit of non-patient work been completed by a process cluster?
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            process_cluster: process cluster name
+            unit: description of the unit of work
+        """
+        return exists_orm(session, cls,
+                          cls.process_cluster == process_cluster,
+                          cls.unit == unit)
+
+
+class TimingRecord(AdminBase):
+    """
+    Records how long one anonymiser process spent on each of its named tasks
+    (see the ``--timing`` and ``--savetiming`` options), so that the timings
+    of several processes (e.g. those of a multiprocess run) can be added up,
+    e.g. with
+
+    .. code-block:: sql
+
+        SELECT name, SUM(n_calls), SUM(total_s)
+        FROM anon_timing
+        WHERE run_started_at >= '2020-01-01'
+        GROUP BY name
+        ORDER BY SUM(total_s) DESC;
+
+    """
+    __tablename__ = 'anon_timing'
+    __table_args__ = TABLE_KWARGS
+
+    id = Column(
+        'id', Integer,
+        primary_key=True, autoincrement=True,
+        comment="Arbitrary PK")
+    process_cluster = Column(
+        'process_cluster', String(length=255),
+        comment="Process cluster name")
+    process = Column(
+        'process', Integer,
+        comment="Process number within the cluster")
+    nprocesses = Column(
+        'nprocesses', Integer,
+        comment="Number of processes in the cluster")
+    run_started_at = Column(
+        'run_started_at', DateTime,
+        comment="When the process started its work (UTC)")
+    name = Column(
+        'name', String(length=255),
+        comment="Name of the timed task")
+    n_calls = Column(
+        'n_calls', Integer,
+        comment="Number of times the task was performed")
+    total_s = Column(
+        'total_s', Float,
+        comment="Total time spent on the task (excluding time spent on "
+                "other timed tasks within it) (s)")
+
+    @classmethod
+    def record(cls,
+               session: Session,
+               process_cluster: str,
+               process: int,
+               nprocesses: int,
+               run_started_at: datetime,
+               totals: Dict[str, Tuple[int, float]]) -> None:
+        """
+        Records the timings of one process. (The table is created, with the
+        other admin tables, by
+        :func:`crate_anon.anonymise.anonymise.drop_remake`.)
+
+        Args:
+            session: SQLAlchemy database session for the secret admin database
+            process_cluster: process cluster name
+            process: process number
+            nprocesses: number of processes in the cluster
+            run_started_at: when the process started its work (UTC)
+            totals: dictionary mapping task name to ``n_calls, total_s``
+        """
+        rows = [dict(process_cluster=process_cluster, process=process,
+                     nprocesses=nprocesses, run_started_at=run_started_at,
+                     name=name, n_calls=n_calls, total_s=total_s)
+                for name, (n_calls, total_s) in totals.items()]
+        if rows:
+            session.execute(cls.__table__.insert(), rows)
+
+
+class ProcessStatus(AdminBase):
+    """
+    Records the live progress of one anonymiser process, so that the progress
+    of all processes (e.g. those started by
+    :ref:`crate_anonymise_multiprocess <crate_anonymise_multiprocess>`) can be
+    seen together, with the ``crate_anonymise_status`` command (see
+    :mod:`crate_anon.anonymise.status`).
+
+    There is one row per process (by process cluster and process number),
+    which the process updates periodically. The counters are for the process
+    as a whole, not just its current phase.
+    """
+    __tablename__ = 'anon_process_status'
+    __table_args__ = TABLE_KWARGS
+
+    id = Column(
+        'id', Integer,
+        primary_key=True, autoincrement=True,
+        comment="Arbitrary PK")
+    process_cluster = Column(
+        'process_cluster', String(length=255),
+        comment="Process cluster name")
+    process = Column(
+        'process', Integer,
+        comment="Process number within the cluster")
+    nprocesses = Column(
+        'nprocesses', Integer,
+        comment="Number of processes in the cluster")
+    hostname = Column(
+        'hostname', String(length=255),
+        comment="Name of the computer running the process")
+    os_pid = Column(
+        'os_pid', Integer,
+        comment="Operating system process ID")
+    started_at = Column(
+        'started_at', DateTime,
+        comment="When the process started its work (UTC)")
+    updated_at = Column(
+        'updated_at', DateTime,
+        comment="When this record was last updated (UTC)")
+    finished = Column(
+        'finished', Boolean,
+        comment="Has the process finished?")
+    phase = Column(
+        'phase', String(length=255),
+        comment="What the process is doing, e.g. 'patients'")
+    current_table = Column(
+        'current_table', String(length=255),
+        comment="Source table being processed (as db.table)")
+    patients_done = Column(
+        'patients_done', Integer,
+        comment="Number of patients processed")
+    patients_estimated = Column(
+        'patients_estimated', Integer,
+        comment="Estimated number of patients in the source database(s), "
+                "across all processes")
+    rows_read = Column(
+        'rows_read', BigInteger,
+        comment="Number of source rows read")
+    rows_written = Column(
+        'rows_written', BigInteger,
+        comment="Number of destination rows written")
+    bytes_read = Column(
+        'bytes_read', BigInteger,
+        comment="Approximate number of bytes read from the source "
+                "database(s)")
+    bytes_written = Column(
+        'bytes_written', BigInteger,
+        comment="Approximate number of bytes written to the destination "
+                "database")
+
+    @classmethod
+    def publish(cls,
+                connection: Connection,
+                process_cluster: str,
+                process: int,
+                **values: Any) -> None:
+        """
+        Creates or updates the record for one process.
+
+        Args:
+            connection: SQLAlchemy connection to the secret admin database
+            process_cluster: process cluster name
+            process: process number
+            values: column values to set
+        """
+        table = cls.__table__
+        result = connection.execute(
+            table.update()
+            .where(table.c.process_cluster == process_cluster)
+            .where(table.c.process == process)
+            .values(**values)
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(
+                process_cluster=process_cluster, process=process, **values))
+
+    @classmethod
+    def remove_surplus(cls,
+                       connection: Connection,
+                       process_cluster: str,
+                       nprocesses: int) -> None:
+        """
+        Deletes records for process numbers that are not part of the current
+        run (e.g. left over from a previous run with more processes).
+
+        Args:
+            connection: SQLAlchemy connection to the secret admin database
+            process_cluster: process cluster name
+            nprocesses: number of processes in the cluster
+        """
+        table = cls.__table__
+        connection.execute(
+            table.delete()
+            .where(table.c.process_cluster == process_cluster)
+            .where(table.c.process >= nprocesses)
+        )
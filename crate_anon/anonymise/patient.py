@@ -29,9 +29,13 @@ like ID values and scrubbers.**
 
 """
 
+from collections import defaultdict
 import logging
-from typing import AbstractSet, Any, Generator, List, Union
+from typing import (
+    AbstractSet, Any, Dict, Generator, Iterable, List, Tuple, Union,
+)
 
+from cardinal_pythonlib.timing import MultiTimerContext, timer
 from sqlalchemy.sql import column, select, table
 
 from crate_anon.anonymise.config_singleton import config
@@ -41,6 +45,8 @@ from crate_anon.anonymise.scrub import PersonalizedScrubber
 
 log = logging.getLogger(__name__)
 
+TIMING_BUILD_SCRUBBER = "build_scrubber"
+
 
 # =============================================================================
 # Generate identifiable values for a patient
@@ -84,6 +90,107 @@ def gen_all_values_for_patient(
         yield row
 
 
+def get_all_values_for_patients(
+        dbname: str,
+        tablename: str,
+        fields: List[str],
+        pids: List[Union[int, str]]) -> Dict[str, List[List[Any]]]:
+    """
+    Fetch all sensitive (``scrub_src``) values for a set of patients, from a
+    given source table, in a single query. Used to build scrubbers for
+    several patients at once; see :class:`PatientBatchValues`.
+
+    Args:
+
+        dbname: source database name
+        tablename: source table
+        fields: list of source fields containing ``scrub_src`` information
+        pids: patient IDs
+
+    Returns:
+        dict mapping each PID key (see :func:`pid_key`), for which there were
+        data, to a list of rows, where each row is a list of values that
+        matches ``fields``.
+    """
+    cfg = config.sources[dbname].srccfg
+    if not cfg.ddgen_per_table_pid_field or not pids:
+        return {}
+    log.debug(
+        f"get_all_values_for_patients: {len(pids)} PIDs, "
+        f"table {dbname}.{tablename}, fields: {','.join(fields)}")
+    session = config.sources[dbname].session
+    pidcol = column(cfg.ddgen_per_table_pid_field)
+    query = (
+        select([pidcol] + [column(f) for f in fields]).
+        where(pidcol.in_(pids)).
+        select_from(table(tablename))
+    )
+    wanted_keys = set(pid_key(pid) for pid in pids)
+    values_by_pid = defaultdict(list)  # type: Dict[str, List[List[Any]]]
+    n_inexact = 0
+    for row in session.execute(query):
+        key = pid_key(row[0])
+        if key in wanted_keys:
+            values_by_pid[key].append(list(row[1:]))
+        else:
+            n_inexact += 1
+    if n_inexact:
+        log.warning(
+            f"{n_inexact} rows of {dbname}.{tablename} matched the requested "
+            f"PIDs only inexactly (e.g. by case or trailing spaces), so were "
+            f"not assigned to a patient; set patient_batch_size = 1 to use "
+            f"them")
+    return values_by_pid
+
+
+def pid_key(pid: Union[int, str]) -> str:
+    """
+    Returns a key for grouping rows by PID. The PID column of a given table may
+    not be of the same type as the PIDs we asked for (e.g. a string column
+    compared to an integer PID), so integers and strings are compared as
+    strings. Otherwise, PIDs must match exactly: PIDs differing only in case
+    or whitespace are different patients.
+    """
+    return str(pid)
+
+
+class PatientBatchValues(object):
+    """
+    Holds the sensitive (``scrub_src``) values for a batch of patients, so that
+    each source table need be queried once per batch, rather than once per
+    patient. Tables are queried lazily, when first needed.
+
+    Values for patients outside the batch (e.g. third parties found via
+    cross-referenced PIDs) are fetched individually, as before.
+    """
+
+    def __init__(self, pids: Iterable[Union[int, str]]) -> None:
+        """
+        Args:
+            pids: patient IDs in this batch
+        """
+        self._pids = list(pids)
+        self._pid_set = set(self._pids)
+        self._values = {}  # type: Dict[Tuple[str, str], Dict[str, List[List[Any]]]]  # noqa
+
+    def get_values(self,
+                   dbname: str,
+                   tablename: str,
+                   fields: List[str],
+                   pid: Union[int, str]) -> Iterable[List[Any]]:
+        """
+        Returns all sensitive values for a patient from a source table, as for
+        :func:`gen_all_values_for_patient`.
+        """
+        if pid not in self._pid_set:
+            return gen_all_values_for_patient(dbname, tablename, fields, pid)
+        key = (dbname, tablename)
+        if key not in self._values:
+            self._values[key] = get_all_values_for_patients(
+                dbname, tablename, fields, self._pids)
+        return self._values[key].get(pid_key(pid), [])
+
+
 # =============================================================================
 # Patient class, which hosts the patient-specific scrubber
 # =============================================================================
@@ -94,7 +201,10 @@ class Patient(object):
     scrubbers.
     """
 
-    def __init__(self, pid: Union[int, str], debug: bool = False) -> None:
+    def __init__(self,
+                 pid: Union[int, str],
+                 debug: bool = False,
+                 batch_values: PatientBatchValues = None) -> None:
         """
         Build the scrubber based on data dictionary information, found via
         our singleton :class:`crate_anon.anonymise.config.Config`.
@@ -102,8 +212,12 @@ class Patient(object):
         Args:
             pid: integer or string (usually integer) patient identifier
             debug: turn on scrubber debugging?
+            batch_values: optional :class:`PatientBatchValues` object
+                holding prefetched sensitive values for a batch of patients
+                including this one
         """
         self._pid = pid
+        self._batch_values = batch_values
         self._session = config.admindb.session
 
         # Fetch or create PatientInfo object
@@ -140,20 +254,23 @@ class Patient(object):
             string_max_regex_errors=config.string_max_regex_errors,
             allowlist=config.allowlist,
             alternatives=config.phrase_alternative_words,
+            literals_with_flashtext=config.scrub_literals_with_flashtext,
         )
         # Database
         # Construction. We go through all "scrub-from" fields in the data
         # dictionary. We collect all values of those fields from the source
         # database.
         log.debug("Building scrubber")
-        self._db_table_pair_list = config.dd.get_scrub_from_db_table_pairs()
-        self._mandatory_scrubbers_unfulfilled = \
-            config.dd.get_mandatory_scrubber_sigs().copy()
-        self._build_scrubber(pid,
-                             depth=0,
-                             max_depth=config.thirdparty_xref_max_depth)
-        self._unchanged = self.scrubber_hash == self._info.scrubber_hash
-        self._info.set_scrubber_info(self.scrubber)
+        with MultiTimerContext(timer, TIMING_BUILD_SCRUBBER):
+            self._db_table_pair_list = \
+                config.dd.get_scrub_from_db_table_pairs()
+            self._mandatory_scrubbers_unfulfilled = \
+                config.dd.get_mandatory_scrubber_sigs().copy()
+            self._build_scrubber(pid,
+                                 depth=0,
+                                 max_depth=config.thirdparty_xref_max_depth)
+            self._unchanged = self.scrubber_hash == self._info.scrubber_hash
+            self._info.set_scrubber_info(self.scrubber)
         self._session.commit()
         # Commit immediately, because other processes may need this table
         # promptly. Otherwise, might get:
@@ -205,8 +322,13 @@ class Patient(object):
             # -----------------------------------------------------------------
             # Collect the actual patient-specific values for this table.
             # -----------------------------------------------------------------
-            for values in gen_all_values_for_patient(src_db, src_table,
-                                                     fields, pid):
+            if self._batch_values is not None:
+                all_values = self._batch_values.get_values(
+                    src_db, src_table, fields, pid)
+            else:
+                all_values = gen_all_values_for_patient(
+                    src_db, src_table, fields, pid)
+            for values in all_values:
                 for i, val in enumerate(values):
                     # ---------------------------------------------------------
                     # Add a value to the scrubber
@@ -306,7 +428,20 @@ class Patient(object):
             the de-identified text
         """
         return self.scrubber.scrub(text)
-    
+
+    def scrub_many(self, texts: List[str]) -> List[str]:
+        """
+        Use our scrubber to scrub several texts in one pass; see
+        :meth:`crate_anon.anonymise.scrub.ScrubberBase.scrub_many`.
+
+        Args:
+            texts: the raw texts
+
+        Returns:
+            the de-identified texts, in the same order
+        """
+        return self.scrubber.scrub_many(texts)
+
     def is_unchanged(self) -> bool:
         """
         Has the scrubber changed, compared to the previous hashed version in
@@ -30,18 +30,22 @@ crate_anon/anonymise/scrub.py
 
 from collections import OrderedDict
 import datetime
+from functools import lru_cache
 import logging
 import string
 from typing import (Any, Dict, Iterable, Generator, List, Optional, Pattern,
                     Set, Tuple, Union)
+import unittest
 
 from cardinal_pythonlib.datetimefunc import coerce_to_datetime
-from cardinal_pythonlib.hash import GenericHasher
+from cardinal_pythonlib.hash import GenericHasher, make_hasher
 from cardinal_pythonlib.sql.validation import (
     is_sqltype_date,
     is_sqltype_text_over_one_char,
 )
 from cardinal_pythonlib.text import get_unicode_characters
+from cardinal_pythonlib.timing import MultiTimerContext, timer
+import regex
 # from flashtext import KeywordProcessor
 from crate_anon.common.bugfix_flashtext import KeywordProcessorFixed
 # ... temp bugfix
@@ -65,6 +69,15 @@ from crate_anon.common.stringfunc import (
 
 log = logging.getLogger(__name__)
 
+TIMING_BUILD_SCRUBBER_REGEXES = "build_scrubber_regexes"
+TIMING_SCRUB = "scrub"
+
+SCRUB_MANY_SEPARATOR = "\n\x00CRATESCRUBSEPARATOR\x00\n"
+# ... joins texts for ScrubberBase.scrub_many(). The word characters in the
+# middle stop regexes that permit non-word characters between their parts
+# (e.g. for dates and codes) from matching across two texts; the newlines
+# either side act, for word-boundary purposes, like the start/end of a text.
+
 
 # =============================================================================
 # Generic scrubber base class
@@ -96,6 +109,35 @@ class ScrubberBase(object):
         """
         raise NotImplementedError()
 
+    def scrub_many(self, texts: List[str]) -> List[str]:
+        """
+        Scrubs several texts (e.g. all the scrubbable fields of a row) in a
+        single pass, by joining them with ``SCRUB_MANY_SEPARATOR``, scrubbing
+        the result, and splitting it again. This saves the per-call overhead
+        of :meth:`scrub`.
+
+        If the separators do not survive intact (for example, a fuzzy match
+        consumed part of one), or one of the texts already contains the
+        separator, we fall back to scrubbing each text individually, so the
+        results are always the same as from :meth:`scrub`.
+
+        Args:
+            texts: the raw texts (none of them ``None``)
+
+        Returns:
+            the de-identified texts, in the same order
+        """
+        if len(texts) < 2:
+            return [self.scrub(text) for text in texts]
+        if not any(SCRUB_MANY_SEPARATOR in text for text in texts):
+            results = self.scrub(SCRUB_MANY_SEPARATOR.join(texts)).split(
+                SCRUB_MANY_SEPARATOR)
+            if len(results) == len(texts):
+                return results
+            log.debug("Separator altered by scrubbing; scrubbing texts "
+                      "individually")
+        return [self.scrub(text) for text in texts]
+
     def get_hash(self) -> str:
         """
         Returns a hash of our scrubber -- so we can store it, and later see if
@@ -129,6 +171,23 @@ FLASHTEXT_WORD_CHARACTERS = set(
 # Check: FLASHTEXT_WORDCHAR_STR = "".join(sorted(FLASHTEXT_WORD_CHARACTERS))
 
 
+class RegexWordCharacters(object):
+    """
+    Set-like collection of all characters that our regexes treat as word
+    characters (``\\w``), in any script. Used as the FlashText word
+    characters when FlashText must find the same word boundaries as our
+    regexes (e.g. so that "John" is not found in "Johnα").
+    """
+    _WORD_CHAR_REGEX = regex.compile(r"\w", regex.UNICODE)
+
+    @lru_cache(maxsize=None)
+    def __contains__(self, c: str) -> bool:
+        return self._WORD_CHAR_REGEX.match(c) is not None
+
+
+REGEX_WORD_CHARACTERS = RegexWordCharacters()
+
+
 class WordList(ScrubberBase):
     """
     A scrubber that removes all words in a wordlist, in case-insensitive
@@ -426,6 +485,7 @@ class PersonalizedScrubber(ScrubberBase):
                  allowlist: WordList = None,
                  alternatives: List[List[str]] = None,
                  nonspecific_scrubber: NonspecificScrubber = None,
+                 literals_with_flashtext: bool = False,
                  debug: bool = False) -> None:
         """
         Args:
@@ -475,6 +535,11 @@ class PersonalizedScrubber(ScrubberBase):
             nonspecific_scrubber:
                 :class:`NonspecificScrubber` to apply (after the more specific
                 scrubbers) to remove information that is generic
+            literals_with_flashtext:
+                Scrub words that need no regex features (no typographical
+                errors permitted; word boundaries required) with a FlashText
+                keyword processor, rather than including them in our regexes.
+                See :meth:`is_flashtext_literal`.
             debug:
                 show the final scrubber regex text as we compile our regexes
         """
@@ -500,6 +565,7 @@ class PersonalizedScrubber(ScrubberBase):
         self.allowlist = allowlist
         self.alternatives = alternatives
         self.nonspecific_scrubber = nonspecific_scrubber
+        self.literals_with_flashtext = literals_with_flashtext
         self.debug = debug
 
         # Regex information
@@ -514,6 +580,15 @@ class PersonalizedScrubber(ScrubberBase):
         # ... list of tuples: (patient?, type, value)
         # ... used for get_raw_info(); since we've made the order important,
         #     we should detect changes in order here as well
+        self._pending_values = []  # type: List[Tuple[Any, SCRUBMETHOD, bool]]  # noqa
+        # ... values not yet converted to regex elements; see
+        #     _add_pending_elements()
+
+        # FlashText information, if literals_with_flashtext is set
+        self.literal_patient_words = []  # type: List[str]
+        self.literal_tp_words = []  # type: List[str]
+        self.kp_patient = None  # type: Optional[KeywordProcessorFixed]
+        self.kp_tp = None  # type: Optional[KeywordProcessorFixed]
         self.clear_cache()
 
     def clear_cache(self) -> None:
@@ -567,29 +642,47 @@ class PersonalizedScrubber(ScrubberBase):
         """
         if value is None:
             return
+        if scrub_method not in (SCRUBMETHOD.DATE, SCRUBMETHOD.WORDS,
+                                SCRUBMETHOD.PHRASE, SCRUBMETHOD.NUMERIC,
+                                SCRUBMETHOD.CODE):
+            raise ValueError(f"Bug: unknown scrub_method to add_value: "
+                             f"{scrub_method}")
         new_tuple = (patient, scrub_method, repr(value))
         if new_tuple not in self.elements_tuplelist:
             self.elements_tuplelist.append(new_tuple)
-        # Note: object reference
-        r = self.re_patient_elements if patient else self.re_tp_elements
-
-        if scrub_method is SCRUBMETHOD.DATE:
-            elements = self.get_elements_date(value)
-        elif scrub_method is SCRUBMETHOD.WORDS:
-            elements = self.get_elements_words(value)
-        elif scrub_method is SCRUBMETHOD.PHRASE:
-            elements = self.get_elements_phrase(value)
-        elif scrub_method is SCRUBMETHOD.NUMERIC:
-            elements = self.get_elements_numeric(value)
-        elif scrub_method is SCRUBMETHOD.CODE:
-            elements = self.get_elements_code(value)
-        else:
-            raise ValueError(f"Bug: unknown scrub_method to add_value: "
-                             f"{scrub_method}")
-        r.extend(elements)
+        # The regex elements are worked out when needed (which may be never,
+        # e.g. for an unchanged patient in an incremental update).
+        self._pending_values.append((value, scrub_method, patient))
         if clear_cache:
             self.clear_cache()
 
+    def _add_pending_elements(self) -> None:
+        """
+        Converts values added via :meth:`add_value` into regex elements (and,
+        if we are using FlashText, literal words).
+        """
+        for value, scrub_method, patient in self._pending_values:
+            # Note: object references
+            r = self.re_patient_elements if patient else self.re_tp_elements
+            if self.literals_with_flashtext:
+                literals = (self.literal_patient_words if patient
+                            else self.literal_tp_words)
+            else:
+                literals = None
+            if scrub_method is SCRUBMETHOD.DATE:
+                elements = self.get_elements_date(value)
+            elif scrub_method is SCRUBMETHOD.WORDS:
+                elements = self.get_elements_words(value, literals=literals)
+            elif scrub_method is SCRUBMETHOD.PHRASE:
+                elements = self.get_elements_phrase(value)
+            elif scrub_method is SCRUBMETHOD.NUMERIC:
+                elements = self.get_elements_numeric(value)
+            else:  # SCRUBMETHOD.CODE
+                elements = self.get_elements_code(value)
+            if elements:  # may be None for invalid dates
+                r.extend(elements)
+        self._pending_values = []  # type: List[Tuple[Any, SCRUBMETHOD, bool]]  # noqa
+
     def get_elements_date(self,
                           value: Union[datetime.datetime,
                                        datetime.date]) -> Optional[List[str]]:
@@ -609,10 +702,36 @@ class PersonalizedScrubber(ScrubberBase):
                 self.anonymise_dates_at_word_boundaries_only)
         )
 
-    def get_elements_words(self, value: str) -> List[str]:
+    def is_flashtext_literal(self, s: str) -> bool:
+        """
+        Can the word fragment ``s`` be scrubbed by FlashText, giving the same
+        result as its regex elements?
+
+        That requires exact matching at word boundaries, and that the fragment
+        and its suffixes consist only of letters (so that, for example, they
+        can't be part of a number, or partly overlap a code). It also requires
+        that no other strings are scrubbed with typographical errors, since
+        those regexes can match adjacent whitespace.
+        """
+        if (self.string_max_regex_errors > 0 or
+                not self.anonymise_strings_at_word_boundaries_only):
+            return False
+        return (s + "".join(self.scrub_string_suffixes)).isalpha()
+
+    def get_elements_words(self, value: str,
+                           literals: List[str] = None) -> List[str]:
         """
         Returns a list of regex elements for a given string that contains
         textual words.
+
+        Args:
+            value:
+                the string
+            literals:
+                if this list is supplied, words for which
+                :meth:`is_flashtext_literal` is true are appended to it (with
+                each of their suffixed forms), rather than being returned as
+                regex elements
         """
         elements = []  # type: List[str]
         for s in get_anon_fragments_from_string(str(value)):
@@ -632,6 +751,11 @@ class PersonalizedScrubber(ScrubberBase):
                 max_errors = self.string_max_regex_errors
             else:
                 max_errors = 0
+            if literals is not None and self.is_flashtext_literal(s):
+                literals.append(s)
+                literals.extend(s + suffix
+                                for suffix in self.scrub_string_suffixes)
+                continue
             elements.extend(get_string_regex_elements(
                 s,
                 self.scrub_string_suffixes,
@@ -708,27 +832,67 @@ class PersonalizedScrubber(ScrubberBase):
     def get_patient_regex_string(self) -> str:
         """
         Return the string version of the patient regex, sorted.
+
+        (Words scrubbed via FlashText are not part of this regex; see
+        ``literals_with_flashtext``.)
         """
+        self._add_pending_elements()
         return get_regex_string_from_elements(self.re_patient_elements)
 
     def get_tp_regex_string(self) -> str:
         """
         Return the string version of the third-party regex, sorted.
         """
+        self._add_pending_elements()
         return get_regex_string_from_elements(self.re_tp_elements)
 
     def build_regexes(self) -> None:
         """
-        Compile our regexes.
+        Compile our regexes (and FlashText processors, if used).
         """
-        self.re_patient = get_regex_from_elements(self.re_patient_elements)
-        self.re_tp = get_regex_from_elements(self.re_tp_elements)
-        self.regexes_built = True
+        with MultiTimerContext(timer, TIMING_BUILD_SCRUBBER_REGEXES):
+            self._add_pending_elements()
+            self.re_patient = get_regex_from_elements(
+                self.re_patient_elements)
+            self.re_tp = get_regex_from_elements(self.re_tp_elements)
+            self._build_keyword_processors()
+            self.regexes_built = True
         # Note that the regexes themselves may be None even if they have
         # been built.
         if self.debug:
             log.debug(f"Patient scrubber: {self.get_patient_regex_string()}")
             log.debug(f"Third party scrubber: {self.get_tp_regex_string()}")
+            if self.literals_with_flashtext:
+                log.debug(f"Patient FlashText words: "
+                          f"{self.literal_patient_words}")
+                log.debug(f"Third party FlashText words: "
+                          f"{self.literal_tp_words}")
+
+    def _build_keyword_processors(self) -> None:
+        """
+        Builds our FlashText processors from our literal words (or sets them
+        to ``None`` if there are no such words).
+        """
+        self.kp_patient = self._make_keyword_processor(
+            self.literal_patient_words, self.replacement_text_patient)
+        self.kp_tp = self._make_keyword_processor(
+            self.literal_tp_words, self.replacement_text_third_party)
+
+    @staticmethod
+    def _make_keyword_processor(
+            words: List[str],
+            replacement: str) -> Optional[KeywordProcessorFixed]:
+        """
+        Returns a case-insensitive FlashText processor that replaces each of
+        ``words`` with ``replacement``, or ``None`` if there are no words.
+        """
+        if not words:
+            return None
+        processor = KeywordProcessorFixed(case_sensitive=False)
+        processor.set_non_word_boundaries(REGEX_WORD_CHARACTERS)
+        for w in words:
+            processor.add_keyword(w, replacement)
+        return processor
 
     def scrub(self, text: str) -> Optional[str]:
         # docstring in parent class
@@ -737,12 +901,22 @@ class PersonalizedScrubber(ScrubberBase):
         if not self.regexes_built:
             self.build_regexes()
 
-        if self.nonspecific_scrubber:
-            text = self.nonspecific_scrubber.scrub(text)
-        if self.re_patient:
-            text = self.re_patient.sub(self.replacement_text_patient, text)
-        if self.re_tp:
-            text = self.re_tp.sub(self.replacement_text_third_party, text)
+        with MultiTimerContext(timer, TIMING_SCRUB):
+            if self.nonspecific_scrubber:
+                text = self.nonspecific_scrubber.scrub(text)
+            # Literal words go after the regexes, so that longer matches that
+            # contain them (e.g. dates containing month names, or phrases)
+            # are scrubbed in full.
+            if self.re_patient:
+                text = self.re_patient.sub(self.replacement_text_patient,
+                                           text)
+            if self.kp_patient:
+                text = self.kp_patient.replace_keywords(text)
+            if self.re_tp:
+                text = self.re_tp.sub(self.replacement_text_third_party,
+                                      text)
+            if self.kp_tp:
+                text = self.kp_tp.replace_keywords(text)
         return text
 
     def get_hash(self) -> str:
@@ -795,3 +969,142 @@ keywords = [
 
 
 """
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+class TestPersonalizedScrubberEngines(unittest.TestCase):
+    """
+    Checks that scrubbing literal words with FlashText gives the same output
+    as scrubbing everything with regexes.
+    """
+
+    TEXTS = [
+        "John Smith was seen today; Mr Smith's wife, Jane Smith, attended.",
+        "SMITH, JOHN. Lives at 42 West Street, Cambridge CB2 3EB.",
+        "The Smiths (and Mrs Smithson) live on West St, by Queen's Road.",
+        "Jon Smyth? Not the patient. Johnny? Nor him. john_smith? Nope.",
+        "Born 07 Jan 1960 (7/1/1960); phone (01223) 123456.",
+        "Seen by Dr Naïve and Dr Ölander, who know Zoë well.",
+        "John-Smith, Smith.John and smith/john are all scrubbed.",
+        "Smith2 and 2Smith are not words, but 'Smith' is.",
+        "Nor are Johnα, Smithж or Zoëω (but Zoë is).",
+        "Nothing sensitive here at all.",
+        "",
+    ]
+
+    @staticmethod
+    def _scrubber(literals_with_flashtext: bool,
+                  **kwargs: Any) -> PersonalizedScrubber:
+        scrubber = PersonalizedScrubber(
+            replacement_text_patient="[PPP]",
+            replacement_text_third_party="[TTT]",
+            hasher=make_hasher("HMAC_MD5", "dummysalt"),
+            literals_with_flashtext=literals_with_flashtext,
+            **kwargs
+        )
+        scrubber.add_value("John Smith", SCRUBMETHOD.WORDS)
+        scrubber.add_value("42 West Street, Cambridge", SCRUBMETHOD.WORDS)
+        scrubber.add_value("Zoë Naïve", SCRUBMETHOD.WORDS)
+        scrubber.add_value("CB2 3EB", SCRUBMETHOD.CODE)
+        scrubber.add_value("01223 123456", SCRUBMETHOD.NUMERIC)
+        scrubber.add_value(datetime.date(1960, 1, 7), SCRUBMETHOD.DATE)
+        scrubber.add_value("Queen's Road", SCRUBMETHOD.PHRASE)
+        scrubber.add_value("Jane Smith", SCRUBMETHOD.WORDS, patient=False)
+        scrubber.add_value("Ölander", SCRUBMETHOD.WORDS, patient=False)
+        return scrubber
+
+    def _check_equivalent(self, **kwargs: Any) -> None:
+        regex_scrubber = self._scrubber(False, **kwargs)
+        flashtext_scrubber = self._scrubber(True, **kwargs)
+        for text in self.TEXTS:
+            self.assertEqual(regex_scrubber.scrub(text),
+                             flashtext_scrubber.scrub(text),
+                             f"Engines differ for {text!r} with {kwargs!r}")
+
+    def test_equivalence_default(self) -> None:
+        self._check_equivalent()
+
+    def test_equivalence_suffixes(self) -> None:
+        self._check_equivalent(scrub_string_suffixes=["s", "son"])
+
+    def test_equivalence_with_errors(self) -> None:
+        self._check_equivalent(string_max_regex_errors=1,
+                               min_string_length_for_errors=5)
+
+    def test_equivalence_not_at_word_boundaries(self) -> None:
+        self._check_equivalent(anonymise_strings_at_word_boundaries_only=False)
+
+    def test_literals_leave_regex(self) -> None:
+        scrubber = self._scrubber(True)
+        scrubber.build_regexes()
+        self.assertIn("John", scrubber.literal_patient_words)
+        self.assertIn("Zoë", scrubber.literal_patient_words)
+        self.assertNotIn("42", scrubber.literal_patient_words)
+        self.assertNotIn("John", scrubber.get_patient_regex_string())
+        self.assertIn("Jane", scrubber.literal_tp_words)
+        # Fuzzy regexes can match adjacent whitespace, so if any are used,
+        # everything goes via regexes.
+        fuzzy = self._scrubber(True, string_max_regex_errors=1,
+                               min_string_length_for_errors=5)
+        fuzzy.build_regexes()
+        self.assertEqual(fuzzy.literal_patient_words, [])
+        self.assertEqual(fuzzy.literal_tp_words, [])
+
+    def _check_both_engines(self,
+                            values: List[Tuple[Any, SCRUBMETHOD]],
+                            text: str,
+                            expected: str) -> None:
+        for literals_with_flashtext in (False, True):
+            scrubber = PersonalizedScrubber(
+                replacement_text_patient="[P]",
+                replacement_text_third_party="[T]",
+                hasher=make_hasher("HMAC_MD5", "dummysalt"),
+                literals_with_flashtext=literals_with_flashtext)
+            for value, scrub_method in values:
+                scrubber.add_value(value, scrub_method)
+            self.assertEqual(
+                scrubber.scrub(text), expected,
+                f"literals_with_flashtext={literals_with_flashtext}")
+
+    def test_literals_within_dates(self) -> None:
+        # Forenames that are also month names must not break up dates.
+        self._check_both_engines(
+            [("Jan", SCRUBMETHOD.WORDS),
+             (datetime.date(1960, 1, 7), SCRUBMETHOD.DATE)],
+            "DOB 7 Jan 1960; Jan and January.",
+            "DOB [P]; [P] and January.")
+        self._check_both_engines(
+            [("May", SCRUBMETHOD.WORDS),
+             (datetime.date(1971, 5, 3), SCRUBMETHOD.DATE)],
+            "Born 3 May 1971, or 03/05/1971. May is well.",
+            "Born [P], or [P]. [P] is well.")
+
+    def test_literals_within_phrases(self) -> None:
+        self._check_both_engines(
+            [("John Smith", SCRUBMETHOD.PHRASE),
+             ("John", SCRUBMETHOD.WORDS)],
+            "John Smith saw John, not Mr Smith.",
+            "[P] saw [P], not Mr Smith.")
+
+    def test_literals_within_codes(self) -> None:
+        self._check_both_engines(
+            [("JOHN 12", SCRUBMETHOD.CODE),
+             ("John", SCRUBMETHOD.WORDS)],
+            "Ref JOHN12, or john 12; John.",
+            "Ref [P], or [P]; [P].")
+
+    def test_scrub_many(self) -> None:
+        texts = self.TEXTS + [
+            "Date split across texts: 7 Jan",  # must not join with next
+            "1960 was the year.",
+            f"Contains the separator: {SCRUB_MANY_SEPARATOR}John",
+        ]
+        for literals_with_flashtext in (False, True):
+            scrubber = self._scrubber(literals_with_flashtext,
+                                      string_max_regex_errors=1)
+            expected = [scrubber.scrub(text) for text in texts]
+            self.assertEqual(scrubber.scrub_many(texts), expected)
+            self.assertEqual(scrubber.scrub_many(texts[:-1]), expected[:-1])
@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/anonymise/status.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Live progress of anonymiser processes.**
+
+Each anonymiser process publishes its progress counters (patients done, rows
+and bytes read and written, what it is working on) to a table in the admin
+database (see :class:`crate_anon.anonymise.models.ProcessStatus`). The
+``crate_anonymise_status`` command (see
+:mod:`crate_anon.anonymise.status_cli`) reads them back and summarizes them
+for all processes together, with rates and an estimated time to completion.
+
+"""
+
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+
+from cardinal_pythonlib.sizeformatter import sizeof_fmt
+from cardinal_pythonlib.sqlalchemy.schema import table_exists
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.session import Session
+
+from crate_anon.anonymise.models import ProcessStatus
+
+if TYPE_CHECKING:
+    from crate_anon.anonymise.config import Config
+
+log = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Publishing progress
+# =============================================================================
+
+class ProcessPhase(object):
+    """
+    Names for what an anonymiser process is doing.
+    """
+    STRUCTURE = "structure"
+    OPT_OUT = "opt_out"
+    QUEUE = "queue"
+    PATIENTS = "patients"
+    NONPATIENT = "nonpatient"
+    INDEXES = "indexes"
+    FINISHED = "finished"
+
+
+class StatusPublisher(object):
+    """
+    Publishes the progress of this anonymiser process to the admin database,
+    at most once every ``interval_s`` seconds (or when it changes phase).
+
+    It uses its own database connection, so it doesn't commit anything that
+    the anonymiser has written to the admin database. However, it should be
+    called only when the anonymiser has no uncommitted changes in the admin
+    database (e.g. between batches of patients), so that databases that lock
+    whole tables or files (e.g. SQLite) don't make it wait.
+
+    Failure to publish is logged but otherwise ignored; it doesn't stop
+    anonymisation.
+    """
+
+    def __init__(self,
+                 engine: Engine,
+                 progress: "Config",
+                 process_cluster: str,
+                 process: int,
+                 nprocesses: int,
+                 interval_s: float) -> None:
+        """
+        Args:
+            engine:
+                SQLAlchemy engine for the secret admin database
+            progress:
+                the :class:`crate_anon.anonymise.config.Config`, which counts
+                rows and bytes read and written
+            process_cluster:
+                process cluster name
+            process:
+                process number within the cluster
+            nprocesses:
+                number of processes in the cluster
+            interval_s:
+                minimum time between periodic updates
+        """
+        self.engine = engine
+        self.progress = progress
+        self.process_cluster = process_cluster
+        self.process = process
+        self.nprocesses = nprocesses
+        self.interval_s = interval_s
+
+        self.phase = ""
+        self.current_table = None  # type: Optional[str]
+        self.patients_done = 0
+        self.patients_estimated = None  # type: Optional[int]
+        self._last_published = None  # type: Optional[float]
+        self._started_at = None  # type: Optional[datetime]
+        self._details_published = False
+        self._publish_failed = False
+
+    def start(self) -> None:
+        """
+        Creates the status table if necessary (e.g. in an admin database made
+        by an older version of CRATE), publishes our (empty) record, with the
+        details of this process, and removes records of processes not in the
+        current run.
+
+        If publishing fails, the details of this process are published with
+        the next successful update instead.
+        """
+        self._started_at = datetime.utcnow()
+        try:
+            # noinspection PyUnresolvedReferences
+            ProcessStatus.__table__.create(self.engine, checkfirst=True)
+        except SQLAlchemyError as e:
+            # e.g. another process created it at the same moment
+            log.debug(f"Failed to create progress table: {e}")
+        self.publish()
+
+    def set_phase(self, phase: str) -> None:
+        """
+        Records (and publishes) a change in what the process is doing (see
+        :class:`ProcessPhase`).
+        """
+        self.phase = phase
+        self.current_table = None
+        self.publish()
+
+    def set_table(self, srcdb: str, srctable: str) -> None:
+        """
+        Records which source table we are working on (published with the next
+        update).
+        """
+        self.current_table = f"{srcdb}.{srctable}"
+
+    def set_patients_estimated(self, n_patients: int) -> None:
+        """
+        Records the estimated number of patients still to be done in this run,
+        across all processes (published with the next update). When resuming,
+        that excludes patients completed by the previous run.
+        """
+        self.patients_estimated = n_patients
+
+    def notify_patients_done(self, n_patients: int) -> None:
+        """
+        Records that patients have been completed (published with the next
+        update).
+        """
+        self.patients_done += n_patients
+
+    def finish(self) -> None:
+        """
+        Records (and publishes) that the process has finished.
+        """
+        self.set_phase(ProcessPhase.FINISHED)
+
+    def maybe_publish(self) -> None:
+        """
+        Publishes our progress, unless we did so recently.
+        """
+        if (self._last_published is None or
+                time.monotonic() - self._last_published >= self.interval_s):
+            self.publish()
+
+    def publish(self) -> None:
+        """
+        Publishes our progress (and, until that has succeeded once, the
+        details of this process; see :meth:`start`).
+        """
+        self._last_published = time.monotonic()
+        values = self._get_values()
+        try:
+            with self.engine.begin() as connection:
+                if not self._details_published:
+                    ProcessStatus.remove_surplus(
+                        connection, self.process_cluster, self.nprocesses)
+                    values.update(
+                        nprocesses=self.nprocesses,
+                        hostname=socket.gethostname(),
+                        os_pid=os.getpid(),
+                        started_at=self._started_at or datetime.utcnow(),
+                    )
+                ProcessStatus.publish(connection, self.process_cluster,
+                                      self.process, **values)
+            self._details_published = True
+            self._publish_failed = False
+        except SQLAlchemyError as e:
+            # Warn once per run of failures, not at every update.
+            if self._publish_failed:
+                log.debug(f"Failed to publish progress: {e}")
+            else:
+                log.warning(f"Failed to publish progress: {e}")
+            self._publish_failed = True
+
+    def _get_values(self) -> Dict[str, Any]:
+        """
+        Returns the column values to publish.
+        """
+        return dict(
+            updated_at=datetime.utcnow(),
+            finished=self.phase == ProcessPhase.FINISHED,
+            phase=self.phase,
+            current_table=self.current_table,
+            patients_done=self.patients_done,
+            patients_estimated=self.patients_estimated,
+            rows_read=self.progress.src_rows_read,
+            rows_written=self.progress.dest_rows_written,
+            bytes_read=self.progress.src_bytes_read,
+            bytes_written=self.progress.dest_bytes_written,
+        )
+
+
+# =============================================================================
+# Summarizing progress
+# =============================================================================
+
+def format_timedelta(td: Optional[timedelta]) -> str:
+    """
+    Formats a :class:`datetime.timedelta` to the nearest second, e.g. as
+    ``1:02:03``, or ``?`` for ``None``.
+    """
+    if td is None:
+        return "?"
+    return str(timedelta(seconds=round(td.total_seconds())))
+
+
+def per_second(n: Optional[int], td: Optional[timedelta]) -> Optional[float]:
+    """
+    Returns ``n`` per second over ``td``, or ``None`` if that's not known.
+    """
+    if n is None or td is None or td.total_seconds() <= 0:
+        return None
+    return n / td.total_seconds()
+
+
+def format_rate(rate: Optional[float]) -> str:
+    """
+    Formats a rate (per second), or ``?`` for ``None``.
+    """
+    return "?" if rate is None else f"{rate:.1f}"
+
+
+class ClusterStatus(object):
+    """
+    Summarizes the progress of all processes in a process cluster.
+    """
+
+    def __init__(self,
+                 process_cluster: str,
+                 records: List[ProcessStatus],
+                 now: datetime,
+                 stale_after_s: float) -> None:
+        """
+        Args:
+            process_cluster: process cluster name
+            records: status records for the cluster's processes
+            now: current time (UTC)
+            stale_after_s: unfinished processes that have not published
+                their progress for this long are reported as stale
+        """
+        self.process_cluster = process_cluster
+        self.records = sorted(records, key=lambda r: r.process)
+        self.now = now
+        self.stale_after_s = stale_after_s
+
+        self.nprocesses = max((r.nprocesses or 0 for r in records), default=0)
+        self.n_finished = sum(1 for r in records if r.finished)
+        self.finished = self.n_finished >= max(self.nprocesses, 1)
+        started = [r.started_at for r in records if r.started_at]
+        updated = [r.updated_at for r in records if r.updated_at]
+        self.started_at = min(started) if started else None
+        self.updated_at = max(updated) if updated else None
+        self.elapsed = self._elapsed(self.started_at, self.updated_at)
+
+        self.patients_done = sum(r.patients_done or 0 for r in records)
+        estimates = [r.patients_estimated for r in records
+                     if r.patients_estimated is not None]
+        self.patients_estimated = max(estimates) if estimates else None
+        self.rows_read = sum(r.rows_read or 0 for r in records)
+        self.rows_written = sum(r.rows_written or 0 for r in records)
+        self.bytes_read = sum(r.bytes_read or 0 for r in records)
+        self.bytes_written = sum(r.bytes_written or 0 for r in records)
+
+    @staticmethod
+    def _elapsed(started_at: Optional[datetime],
+                 updated_at: Optional[datetime]) -> Optional[timedelta]:
+        if started_at is None or updated_at is None:
+            return None
+        return updated_at - started_at
+
+    def is_stale(self, record: ProcessStatus) -> bool:
+        """
+        Has an unfinished process not published its progress recently? (It
+        may be stuck, or have crashed.)
+        """
+        if record.finished or record.updated_at is None:
+            return False
+        silent_s = (self.now - record.updated_at).total_seconds()
+        return silent_s > self.stale_after_s
+
+    @property
+    def patients_per_s(self) -> Optional[float]:
+        """
+        Overall rate of patient processing.
+        """
+        return per_second(self.patients_done, self.elapsed)
+
+    @property
+    def eta(self) -> Optional[timedelta]:
+        """
+        Estimated time until all patients are done, at the overall rate so
+        far, or ``None`` if unknown.
+        """
+        rate = self.patients_per_s
+        if self.finished or not rate or not self.patients_estimated:
+            return None
+        remaining = max(self.patients_estimated - self.patients_done, 0)
+        return timedelta(seconds=remaining / rate)
+
+    def report(self) -> str:
+        """
+        Returns a human-readable report.
+        """
+        lines = [
+            f"Process cluster {self.process_cluster!r}: "
+            f"{self.n_finished}/{self.nprocesses} processes finished; "
+            f"started {self.started_at} UTC; "
+            f"elapsed {format_timedelta(self.elapsed)}"
+        ]
+        for r in self.records:
+            elapsed = self._elapsed(r.started_at, r.updated_at)
+            age = self._elapsed(r.updated_at, self.now)
+            doing = r.phase or "starting"
+            if r.current_table and not r.finished:
+                doing += f" {r.current_table}"
+            flag = " [STALE]" if self.is_stale(r) else ""
+            lines.append(
+                f"  Process {r.process} ({r.hostname}:{r.os_pid}): {doing}; "
+                f"{r.patients_done or 0} patients "
+                f"({format_rate(per_second(r.patients_done, elapsed))}/s); "
+                f"{r.rows_read or 0} rows read "
+                f"({format_rate(per_second(r.rows_read, elapsed))}/s), "
+                f"{r.rows_written or 0} written "
+                f"({format_rate(per_second(r.rows_written, elapsed))}/s); "
+                f"updated {format_timedelta(age)} ago{flag}"
+            )
+        if self.patients_estimated:
+            percent = 100 * self.patients_done / self.patients_estimated
+            patients = (f"{self.patients_done}/~{self.patients_estimated} "
+                        f"({percent:.1f}%)")
+        else:
+            patients = str(self.patients_done)
+        lines.append(
+            f"  Total: {patients} patients "
+            f"({format_rate(self.patients_per_s)}/s); "
+            f"{self.rows_read} rows read "
+            f"({format_rate(per_second(self.rows_read, self.elapsed))}/s), "
+            f"{self.rows_written} written "
+            f"({format_rate(per_second(self.rows_written, self.elapsed))}/s);"
+            f" {sizeof_fmt(self.bytes_read)} read, "
+            f"{sizeof_fmt(self.bytes_written)} written"
+        )
+        eta = self.eta
+        if eta is not None:
+            lines.append(f"  Estimated time to completion of patients: "
+                         f"{format_timedelta(eta)} "
+                         f"(at about {self.now + eta:%Y-%m-%d %H:%M} UTC)")
+        n_stale = sum(1 for r in self.records if self.is_stale(r))
+        if n_stale:
+            lines.append(f"  WARNING: {n_stale} process(es) have not reported "
+                         f"progress for over {self.stale_after_s} s")
+        return "\n".join(lines)
+
+
+def get_cluster_statuses(session: Session,
+                         stale_after_s: float,
+                         process_cluster: str = None) -> List[ClusterStatus]:
+    """
+    Reads the progress of all anonymiser processes from the admin database.
+
+    Args:
+        session: SQLAlchemy database session for the secret admin database
+        stale_after_s: see :class:`ClusterStatus`
+        process_cluster: restrict to this process cluster
+
+    Returns:
+        a list of :class:`ClusterStatus` objects, most recently started first
+    """
+    if not table_exists(session.get_bind(), ProcessStatus.__tablename__):
+        return []
+    q = session.query(ProcessStatus)
+    if process_cluster is not None:
+        q = q.filter(ProcessStatus.process_cluster == process_cluster)
+    by_cluster = {}  # type: Dict[str, List[ProcessStatus]]
+    for record in q:
+        by_cluster.setdefault(record.process_cluster, []).append(record)
+    now = datetime.utcnow()
+    statuses = [ClusterStatus(cluster, records, now, stale_after_s)
+                for cluster, records in by_cluster.items()]
+    statuses.sort(key=lambda s: s.started_at or datetime.min, reverse=True)
+    return statuses
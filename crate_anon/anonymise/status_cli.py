@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/anonymise/status_cli.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Command-line entry point to show the progress of anonymiser processes.**
+
+Split from :mod:`crate_anon.anonymise.status` so we can respond quickly to
+command-line input; uses a delayed import when reading the config.
+
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from cardinal_pythonlib.argparse_func import (
+    RawDescriptionArgumentDefaultsHelpFormatter,
+)
+from cardinal_pythonlib.logs import main_only_quicksetup_rootlogger
+
+from crate_anon.anonymise.constants import ANON_CONFIG_ENV_VAR
+
+log = logging.getLogger(__name__)
+
+MIN_STALE_AFTER_S = 60
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main() -> None:
+    """
+    Command-line entry point. See command-line help.
+    """
+    # noinspection PyTypeChecker
+    parser = argparse.ArgumentParser(
+        description=f"""
+Show the progress of CRATE anonymiser processes (e.g. those started by
+crate_anonymise_multiprocess), as published to the admin database of the
+anonymiser config file (from the {ANON_CONFIG_ENV_VAR} environment variable,
+or --config). For each process cluster, shows each process's progress and
+the totals, with rates, and an estimated time to complete the patients.
+Processes that have not reported progress recently are marked as stale.
+        """,
+        formatter_class=RawDescriptionArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--config',
+        help=f"Config file (overriding environment variable "
+             f"{ANON_CONFIG_ENV_VAR})")
+    parser.add_argument(
+        '--processcluster',
+        help="Show only this process cluster (e.g. PATIENT)")
+    parser.add_argument(
+        '--watch', type=float, default=0,
+        help="If non-zero, repeat every this many seconds, until "
+             "interrupted")
+    parser.add_argument(
+        '--stale_after', type=float, default=None,
+        help=f"Mark unfinished processes as stale if they have not reported "
+             f"progress for this many seconds (if not specified: three "
+             f"times the config file's status_update_interval_s, and at "
+             f"least {MIN_STALE_AFTER_S})")
+    parser.add_argument(
+        '--verbose', '-v', action="store_true",
+        help="Be verbose")
+    args = parser.parse_args()
+
+    main_only_quicksetup_rootlogger(level=logging.DEBUG if args.verbose
+                                    else logging.WARNING)
+    if args.config:
+        os.environ[ANON_CONFIG_ENV_VAR] = args.config
+    # Delayed imports; the config singleton reads the environment variable.
+    from crate_anon.anonymise.config_singleton import config
+    from crate_anon.anonymise.status import get_cluster_statuses
+
+    if args.stale_after is None:
+        stale_after_s = max(3 * config.status_update_interval_s,
+                            MIN_STALE_AFTER_S)
+    else:
+        stale_after_s = args.stale_after
+    session = config.admindb.session
+    while True:
+        statuses = get_cluster_statuses(session,
+                                        stale_after_s=stale_after_s,
+                                        process_cluster=args.processcluster)
+        session.rollback()  # see fresh data next time
+        if statuses:
+            print("\n\n".join(status.report() for status in statuses))
+        else:
+            print("No progress has been published by anonymiser processes "
+                  "(see the status_update_interval_s config option).")
+        if not args.watch:
+            break
+        print()
+        try:
+            time.sleep(args.watch)
+        except KeyboardInterrupt:
+            break
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/anonymise/tableplan.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Per-table processing plans, worked out once from the data dictionary.**
+
+:func:`crate_anon.anonymise.anonymise.process_table` is called for every
+patient and every table, but what it has to do to each row of a given table
+doesn't change. A :class:`TablePlan` records that: which source fields to
+fetch, which of them filter rows, and, for each destination field, the
+sequence of alteration functions to apply.
+
+"""
+
+import logging
+from typing import Any, Callable, List, Optional, Tuple, TYPE_CHECKING
+
+from sqlalchemy.sql.expression import Insert
+from sqlalchemy.sql.schema import Table
+
+from crate_anon.anonymise.altermethod import AlterFunc
+from crate_anon.anonymise.ddr import DataDictionaryRow
+
+if TYPE_CHECKING:
+    from crate_anon.anonymise.config import Config
+
+log = logging.getLogger(__name__)
+
+
+# =============================================================================
+# ColumnPlan
+# =============================================================================
+
+class ColumnPlan(object):
+    """
+    How to produce one destination field from a source row.
+    """
+    def __init__(self,
+                 index: int,
+                 ddr: DataDictionaryRow,
+                 ddrows: List[DataDictionaryRow],
+                 scrub_together: bool) -> None:
+        """
+        Args:
+            index:
+                index of the source value in each source row
+            ddr:
+                the :class:`crate_anon.anonymise.ddr.DataDictionaryRow`
+            ddrows:
+                all data dictionary rows for the table (in source row order)
+            scrub_together:
+                is the field's final alteration (scrubbing) to be done
+                separately, together with the row's other such fields? If so,
+                it is not included in :attr:`alter_funcs`.
+        """
+        self.index = index
+        self.dest_field = ddr.dest_field
+        self.primary_pid = ddr.primary_pid
+        self.master_pid = ddr.master_pid
+        self.scrub_together = scrub_together
+        self.extract_text_first = bool(
+            ddr.alter_methods and ddr.alter_methods[0].extract_text)
+        alter_methods = ddr.alter_methods
+        if scrub_together:
+            alter_methods = alter_methods[:-1]
+        self.alter_funcs = [
+            am.get_alter_func(ddr, ddrows) for am in alter_methods
+        ]  # type: List[AlterFunc]
+
+
+# =============================================================================
+# TablePlan
+# =============================================================================
+
+class TablePlan(object):
+    """
+    Everything about processing one source table that can be worked out in
+    advance from the data dictionary.
+    """
+    def __init__(self,
+                 config: "Config",
+                 sourcedbname: str,
+                 sourcetable: str,
+                 patient_table: bool,
+                 free_text_limit: int = None,
+                 exclude_scrubbed_fields: bool = False) -> None:
+        """
+        Args:
+            config:
+                :class:`crate_anon.anonymise.config.Config`
+            sourcedbname:
+                name (as per the data dictionary) of the source database
+            sourcetable:
+                name of the source table
+            patient_table:
+                will the table be processed for a patient (with a scrubber)?
+            free_text_limit:
+                if specified, any text field longer than this will be excluded
+            exclude_scrubbed_fields:
+                exclude all text fields which are being scrubbed?
+        """
+        self.sourcedbname = sourcedbname
+        self.sourcetable = sourcetable
+        self.timefield = config.timefield
+        self.add_mrid_wherever_rid_added = config.add_mrid_wherever_rid_added
+
+        ddrows = config.dd.get_rows_for_src_table(sourcedbname, sourcetable)
+        self.all_omitted = all(ddr.omit for ddr in ddrows)
+        self.addhash = any(ddr.add_src_hash for ddr in ddrows)
+        self.addtrid = any(ddr.primary_pid and not ddr.omit for ddr in ddrows)
+        self.constant = any(ddr.constant for ddr in ddrows)
+        # If addhash or constant is true AND we are not omitting all rows, then
+        # the non-omitted rows will include the source PK (by the data
+        # dictionary's validation process).
+        ddrows = [ddr for ddr in ddrows
+                  if (
+                      (not ddr.omit) or  # used for data
+                      (self.addhash and ddr.scrub_src) or  # used for hash
+                      ddr.inclusion_values or  # used for filter
+                      ddr.exclusion_values  # used for filter
+                  )]
+        # Exclude all text fields over a chosen length
+        if free_text_limit is not None:
+            ddrows = [ddr for ddr in ddrows
+                      if (ddr.src_textlength is None) or
+                      (ddr.src_textlength <= free_text_limit)]
+        # Exclude all scrubbed fields if requested
+        if exclude_scrubbed_fields:
+            ddrows = [ddr for ddr in ddrows
+                      if (not ddr.src_is_textual) or (not ddr.being_scrubbed)]
+
+        # The order of ddrows is the order of fields in source rows. We don't
+        # change it, since the source hash depends on it.
+        self.ddrows = ddrows
+        self.sourcefields = [ddr.src_field for ddr in ddrows]
+        self.pkfield_index = None  # type: Optional[int]
+        self.src_pk_name = None  # type: Optional[str]
+        self.dest_pk_name = None  # type: Optional[str]
+        self.dest_rid_name = None  # type: Optional[str]
+        for i, ddr in enumerate(ddrows):
+            if ddr.pk:
+                self.pkfield_index = i
+                self.src_pk_name = ddr.src_field
+                self.dest_pk_name = ddr.dest_field
+            if ddr.primary_pid and not ddr.omit:
+                self.dest_rid_name = ddr.dest_field
+
+        # Inclusion/exclusion filters, which are checked before any other work
+        # is done on a row.
+        self.filters = [
+            (i, ddr.skip_row_by_value)
+            for i, ddr in enumerate(ddrows)
+            if ddr.inclusion_values or ddr.exclusion_values
+        ]  # type: List[Tuple[int, Callable[[Any], bool]]]
+
+        # Fields whose final alteration is scrubbing are scrubbed together, in
+        # a single pass per row; see Patient.scrub_many().
+        self.columns = [
+            ColumnPlan(
+                index=i,
+                ddr=ddr,
+                ddrows=ddrows,
+                scrub_together=(
+                    patient_table and bool(ddr.alter_methods) and
+                    ddr.alter_methods[-1].scrub and
+                    not any(am.scrub for am in ddr.alter_methods[:-1])
+                )
+            )
+            for i, ddr in enumerate(ddrows)
+            if not ddr.omit
+        ]  # type: List[ColumnPlan]
+
+        # Fields whose first alteration is text extraction can have their
+        # documents converted ahead of time.
+        self.extract_indexes = [
+            c.index for c in self.columns if c.extract_text_first
+        ]
+
+        # Destination
+        self.dest_table = ddrows[0].dest_table if ddrows else None
+        self.sqla_table = None  # type: Optional[Table]
+        self.insert_statement = None  # type: Optional[Insert]
+        if ddrows:
+            self.sqla_table = config.dd.get_dest_sqla_table(
+                self.dest_table, self.timefield,
+                self.add_mrid_wherever_rid_added)
+            self.insert_statement = self.sqla_table.insert_on_duplicate()
+
+    @property
+    def nothing_to_do(self) -> bool:
+        """
+        Is there no destination data to produce from this table?
+        """
+        return self.all_omitted or not self.columns
+
+    def skip_row(self, row: List[Any]) -> bool:
+        """
+        Should we skip this source row, because of the inclusion/exclusion
+        values of its fields?
+        """
+        for i, skip_row_by_value in self.filters:
+            if skip_row_by_value(row[i]):
+                return True
+        return False
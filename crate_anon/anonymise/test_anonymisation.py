@@ -60,21 +60,27 @@ instead.
 # Imports
 # =============================================================================
 
-# from __future__ import print_function
+# The config singleton (and therefore anything that uses it, such as the
+# Patient class) is imported only when needed, because it reads the config
+# file named by an environment variable, which we set from the command line.
+
 import argparse
 import collections
 import csv
 import json
 import logging
+import multiprocessing
 import os
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 from cardinal_pythonlib.fileops import mkdir_p
 from cardinal_pythonlib.logs import configure_logger_for_colour
-from cardinal_pythonlib.typing_helpers import CSVWriterType
+from sqlalchemy.sql import column, func, select, table
+
+from crate_anon.anonymise.constants import ANON_CONFIG_ENV_VAR
 
-from crate_anon.anonymise.config_singleton import config
-from crate_anon.anonymise.patient import Patient
+if TYPE_CHECKING:
+    from crate_anon.anonymise.config import Config
 
 log = logging.getLogger(__name__)
 
@@ -86,6 +92,19 @@ log = logging.getLogger(__name__)
 DEFAULT_LIMIT = 100
 
 
+# =============================================================================
+# Config
+# =============================================================================
+
+def get_config() -> "Config":
+    """
+    Returns the config singleton (see
+    :mod:`crate_anon.anonymise.config_singleton`), importing it if necessary.
+    """
+    from crate_anon.anonymise.config_singleton import config
+    return config
+
+
 # =============================================================================
 # Specific tests
 # =============================================================================
@@ -113,6 +132,7 @@ class FieldInfo(object):
         Raises:
             :exc:`ValueError` if appropriate fields cannot be found
         """
+        config = get_config()
         ddrows = config.dd.get_rows_for_dest_table(table)
         if not ddrows:
             raise ValueError(
@@ -157,13 +177,14 @@ def get_patientnum_rawtext(docid: int,
     Raises:
         :exc:`ValueError` if appropriate fields cannot be found
     """
-    db = config.sources[fieldinfo.text_ddrow.src_db]
-    table = fieldinfo.text_ddrow.src_table
-    textfield = fieldinfo.text_ddrow.src_field
+    config = get_config()
     sourcedbname = fieldinfo.text_ddrow.src_db
+    session = config.sources[sourcedbname].session
+    tablename = fieldinfo.text_ddrow.src_table
+    textfield = fieldinfo.text_ddrow.src_field
     pidfield = fieldinfo.pid_ddrow.src_field
     pkfield = fieldinfo.pk_ddrow.src_field
-    src_ddrows = config.dd.get_rows_for_src_table(sourcedbname, table)
+    src_ddrows = config.dd.get_rows_for_src_table(sourcedbname, tablename)
     sourcefields = []  # type: List[str]
     idx_pidfield = None
     idx_textfield = None
@@ -177,20 +198,21 @@ def get_patientnum_rawtext(docid: int,
         raise ValueError("Unknown idx_pidfield")
     if idx_textfield is None:
         raise ValueError("Unknown idx_textfield")
-    query = f"""
-        SELECT {",".join(sourcefields)}
-        FROM {table}
-        WHERE {pkfield} = ?
-    """
-    # log.debug(f"RAW: {query}, {docid}")
-    row = db.fetchone(query, docid)
+    query = (
+        select([column(f) for f in sourcefields])
+        .select_from(table(tablename))
+        .where(column(pkfield) == docid)
+    )
+    row = session.execute(query).fetchone()
     if not row:
         return None, None
+    row = list(row)
     pid = row[idx_pidfield]
     text = row[idx_textfield]
     ddr = src_ddrows[idx_textfield]
     for altermethod in fieldinfo.text_ddrow.extracting_text_altermethods:
-        text, _ = altermethod.alter(config, text, ddr, row, src_ddrows)
+        text, _ = altermethod.alter(value=text, ddr=ddr, row=row,
+                                    ddrows=src_ddrows)
     return pid, text
 
 
@@ -208,18 +230,18 @@ def get_patientnum_anontext(docid: int,
     Returns:
         tuple: ``rid, text``, or ``None, None`` if none found
     """
-    db = config.destdb
-    table = fieldinfo.text_ddrow.dest_table
+    config = get_config()
+    session = config.destdb.session
+    tablename = fieldinfo.text_ddrow.dest_table
     textfield = fieldinfo.text_ddrow.dest_field
     ridfield = fieldinfo.pid_ddrow.dest_field
     pkfield = fieldinfo.pk_ddrow.dest_field
-    query = f"""
-        SELECT {ridfield}, {textfield}
-        FROM {table}
-        WHERE {pkfield} = ?
-    """
-    # log.debug(f"ANON: {query}, {docid}")
-    result = db.fetchone(query, docid)
+    query = (
+        select([column(ridfield), column(textfield)])
+        .select_from(table(tablename))
+        .where(column(pkfield) == docid)
+    )
+    result = session.execute(query).fetchone()
     if not result:
         return None, None
     rid, text = result
@@ -230,30 +252,35 @@ def process_doc(docid: int,
                 rawdir: str,
                 anondir: str,
                 fieldinfo: FieldInfo,
-                csvwriter: CSVWriterType,
-                first: bool,
-                scrubdict: Dict[int, Dict[str, Any]]) -> int:
+                scrubdict: Dict[int, Dict[str, Any]]) \
+        -> Tuple[Optional[int], Dict[str, Any]]:
     """
     For a given document ID, write the original and anonymised documents to
-    disk, plus some counts to a CSV file. Also saves scrubber information for
-    each patient.
+    disk, and summarize them. Also saves scrubber information for each
+    patient.
 
     Args:
         docid: integer PK for the document
         rawdir: directory to store raw documents in
         anondir: directory to store anonymised documents in
         fieldinfo: :class:`FieldInfo` describing the table
-        csvwriter: a ``csv.writer()`` object to write summary data to
-        first: is this the first document being processed? If so, we'll add
-            a CSV header
         scrubdict: a dictionary with ``{pid: scrubber_info}`` information,
             which is written to by this function. The scrubber information
             comes from
-            :meth:`crate_anon.anonymise.scrub.PersonalizedScrubber.get_raw_info`
+            :meth:`crate_anon.anonymise.scrub.PersonalizedScrubber.get_raw_info`.
+            A patient's scrubber is built only once (for their first
+            document).
 
     Returns:
-        the patient ID number (PID)
+        tuple: ``pid, summary``, where ``pid`` is the patient ID number (PID)
+        and ``summary`` is an ordered dictionary of summary data for a CSV
+        file
     """  # noqa
+    # Delayed import; see above.
+    from crate_anon.anonymise.patient import Patient
+
+    config = get_config()
+
     # Get stuff
     pid, rawtext = get_patientnum_rawtext(docid, fieldinfo)
     rid, anontext = get_patientnum_anontext(docid, fieldinfo)
@@ -311,20 +338,65 @@ def process_doc(docid: int,
     summary["confidential_visible_but_unknown_to_source"] = "?"
     summary["comments"] = ""
 
-    if first:
-        csvwriter.writerow(list(summary.keys()))
-    csvwriter.writerow(list(summary.values()))
+    return pid, summary
+
+
+def process_docs(dsttable: str,
+                 dstfield: str,
+                 docids: List[int],
+                 rawdir: str,
+                 anondir: str,
+                 resultsfile: str) -> Dict[int, Dict[str, Any]]:
+    """
+    Processes documents (see :func:`process_doc`), writing their summaries to
+    a CSV file. Used both for single-process runs and, with a subset of the
+    documents, by each worker process of a multiprocess run.
+
+    Args:
+        dsttable:
+            name of the destination table
+        dstfield:
+            name of the destination table's text field of interest
+        docids:
+            integer PKs for the documents
+        rawdir:
+            directory to store raw documents in
+        anondir:
+            directory to store anonymised documents in
+        resultsfile:
+            filename to store CSV summaries in
 
-    return pid
+    Returns:
+        a dictionary with ``{pid: scrubber_info}`` information; see
+        :func:`process_doc`
+    """
+    fieldinfo = FieldInfo(dsttable, dstfield)
+    scrubdict = {}  # type: Dict[int, Dict[str, Any]]
+    with open(resultsfile, 'w') as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter='\t')
+        first = True
+        for docid in docids:
+            _, summary = process_doc(
+                docid=docid,
+                rawdir=rawdir,
+                anondir=anondir,
+                fieldinfo=fieldinfo,
+                scrubdict=scrubdict
+            )
+            if first:
+                csvwriter.writerow(list(summary.keys()))
+                first = False
+            csvwriter.writerow(list(summary.values()))
+    return scrubdict
 
 
 def get_docids(fieldinfo: FieldInfo,
                uniquepatients: bool = True,
                limit: int = DEFAULT_LIMIT,
-               from_src: bool = True) -> List[int]:
+               from_src: bool = True) -> List[Tuple[int, Any]]:
     """
     Returns a limited number of document PKs (which we will use to summarize
-    anonymisation performance).
+    anonymisation performance), with the patient each belongs to.
 
     Args:
         fieldinfo:
@@ -339,35 +411,104 @@ def get_docids(fieldinfo: FieldInfo,
             database?
 
     Returns:
-        a list of document IDs
+        a list of ``docid, patient`` tuples, where ``patient`` is the PID (if
+        ``from_src``) or the RID
     """
+    config = get_config()
     if from_src:
-        db = config.sources[fieldinfo.text_ddrow.src_db]
-        table = fieldinfo.pk_ddrow.src_table
+        session = config.sources[fieldinfo.text_ddrow.src_db].session
+        tablename = fieldinfo.pk_ddrow.src_table
         pkfield = fieldinfo.pk_ddrow.src_field
         pidfield = fieldinfo.pid_ddrow.src_field
     else:
-        db = config.destdb
-        table = fieldinfo.pk_ddrow.dest_table
+        session = config.destdb.session
+        tablename = fieldinfo.pk_ddrow.dest_table
         pkfield = fieldinfo.pk_ddrow.dest_field
         pidfield = fieldinfo.pid_ddrow.dest_field
     if uniquepatients:
-        query = f"""
-            SELECT MIN({pkfield}), {pidfield}
-            FROM {table}
-            GROUP BY {pidfield}
-            ORDER BY {pidfield}
-            LIMIT {limit}
-        """
-        return db.fetchallfirstvalues(query)
+        query = (
+            select([func.min(column(pkfield)), column(pidfield)])
+            .select_from(table(tablename))
+            .group_by(column(pidfield))
+            .order_by(column(pidfield))
+            .limit(limit)
+        )
     else:
-        query = f"""
-            SELECT {pkfield}
-            FROM {table}
-            ORDER BY {pkfield}
-            LIMIT {limit}
-        """
-        return db.fetchallfirstvalues(query)
+        query = (
+            select([column(pkfield), column(pidfield)])
+            .select_from(table(tablename))
+            .order_by(column(pkfield))
+            .limit(limit)
+        )
+    return [(docid, patient) for docid, patient in session.execute(query)]
+
+
+def shard_docids_by_patient(docs: List[Tuple[int, Any]],
+                            nshards: int) -> List[List[int]]:
+    """
+    Divides documents between worker processes, keeping each patient's
+    documents together (so that each patient's scrubber is built only once),
+    and balancing the number of documents per worker.
+
+    Args:
+        docs: list of ``docid, patient`` tuples, from :func:`get_docids`
+        nshards: number of workers
+
+    Returns:
+        a list of lists of document IDs, one per worker (omitting any that
+        would be empty)
+    """
+    by_patient = collections.OrderedDict()  # type: Dict[Any, List[int]]
+    for docid, patient in docs:
+        by_patient.setdefault(patient, []).append(docid)
+    shards = [[] for _ in range(nshards)]  # type: List[List[int]]
+    # Largest patients first, each to the least-loaded worker.
+    for patient_docids in sorted(by_patient.values(), key=len, reverse=True):
+        min(shards, key=len).extend(patient_docids)
+    return [shard for shard in shards if shard]
+
+
+def merge_results(partfiles: List[str],
+                  resultsfile: str,
+                  docids: List[int]) -> None:
+    """
+    Merges the CSV files written by worker processes into one, with one header
+    row, and with rows in the original document order.
+
+    Args:
+        partfiles: CSV files written by :func:`process_docs`
+        resultsfile: CSV file to write
+        docids: document IDs, in the order wanted
+    """
+    order = {str(docid): i for i, docid in enumerate(docids)}
+    header = None  # type: Optional[List[str]]
+    rows = []  # type: List[List[str]]
+    for partfile in partfiles:
+        with open(partfile, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter='\t')
+            part_header = next(reader, None)
+            if part_header is None:
+                continue
+            header = part_header
+            rows.extend(reader)
+    with open(resultsfile, 'w') as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter='\t')
+        if header is None:
+            return
+        docid_idx = header.index("docid")
+        rows.sort(key=lambda r: order.get(r[docid_idx], len(order)))
+        csvwriter.writerow(header)
+        csvwriter.writerows(rows)
+
+
+def init_worker(loglevel: int) -> None:
+    """
+    Initializes a worker process for a multiprocess run: sets up logging, and
+    loads the config (from the environment variable set by the parent
+    process) and data dictionary.
+    """
+    configure_logger_for_colour(logging.getLogger(), loglevel)
+    get_config().load_dd(check_against_source_db=False)
 
 
 def test_anon(uniquepatients: bool,
@@ -378,7 +519,8 @@ def test_anon(uniquepatients: bool,
               scrubfile: str,
               resultsfile: str,
               dsttable: str,
-              dstfield: str) -> None:
+              dstfield: str,
+              nprocesses: int = 1) -> None:
     """
     Fetch raw and anonymised documents and store them in files for comparison,
     along with some summary information.
@@ -404,42 +546,54 @@ def test_anon(uniquepatients: bool,
             name of the destination table
         dstfield:
             name of the destination table's text field of interest
+        nprocesses:
+            number of worker processes to use; documents are divided between
+            them by patient
     """
     fieldinfo = FieldInfo(dsttable, dstfield)
-    docids = get_docids(
+    docs = get_docids(
         fieldinfo=fieldinfo,
         uniquepatients=uniquepatients,
         limit=limit,
         from_src=from_src
     )
+    docids = [docid for docid, _ in docs]
     mkdir_p(rawdir)
     mkdir_p(anondir)
-    scrubdict = {}  # type: Dict[int, Dict[str, Any]]
-    pidset = set()  # type: Set[int]
-    with open(resultsfile, 'w') as csvfile:
-        csvwriter = csv.writer(csvfile, delimiter='\t')
-        first = True
-        for docid in docids:
-            # noinspection PyTypeChecker
-            pid = process_doc(
-                docid=docid,
-                rawdir=rawdir,
-                anondir=anondir,
-                fieldinfo=fieldinfo,
-                csvwriter=csvwriter,
-                first=first,
-                scrubdict=scrubdict
-            )
-            first = False
-            pidset.add(pid)
+    shards = shard_docids_by_patient(docs, nprocesses)
+    if len(shards) > 1:
+        log.info(f"Using {len(shards)} worker processes")
+        partfiles = [f"{resultsfile}.part{i}" for i in range(len(shards))]
+        # "spawn", so that workers don't share our database connections.
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes=len(shards),
+                      initializer=init_worker,
+                      initargs=(logging.getLogger().getEffectiveLevel(),)) \
+                as pool:
+            scrubdicts = pool.starmap(process_docs, [
+                (dsttable, dstfield, shard, rawdir, anondir, partfile)
+                for shard, partfile in zip(shards, partfiles)
+            ])
+        merge_results(partfiles, resultsfile, docids)
+        for partfile in partfiles:
+            os.remove(partfile)
+        scrubdict = {}  # type: Dict[int, Dict[str, Any]]
+        for d in scrubdicts:
+            scrubdict.update(d)
+    else:
+        scrubdict = process_docs(dsttable, dstfield, docids, rawdir, anondir,
+                                 resultsfile)
+    # Patients in PID order, however the work was divided.
+    scrubdict = collections.OrderedDict(sorted(scrubdict.items()))
     with open(scrubfile, 'w') as f:
-        f.write(json.dumps(scrubdict, indent=4))
+        f.write(json.dumps(scrubdict, indent=4, default=str))
+        # ... default=str for scrub methods, which are enums
     log.info(f"Finished. See {resultsfile} for a summary.")
     log.info(
         f"Use meld to compare directories {rawdir} and {anondir}"
     )
     log.info("To install meld on Debian/Ubuntu: sudo apt-get install meld")
-    log.info(f"{len(docids)} documents, {len(pidset)} patients")
+    log.info(f"{len(docids)} documents, {len(scrubdict)} patients")
 
 
 # =============================================================================
@@ -470,6 +624,9 @@ def main() -> None:
                         help='Results output CSV file name')
     parser.add_argument('--scrubfile', default='testanon_scrubber.txt',
                         help='Scrubbing information text file name')
+    parser.add_argument('--nprocesses', type=int, default=1,
+                        help='Number of worker processes (documents are '
+                             'divided between them by patient)')
     parser.add_argument('--verbose', '-v', action='store_true',
                         help="Be verbose")
 
@@ -496,10 +653,14 @@ def main() -> None:
     configure_logger_for_colour(rootlogger, loglevel)
 
     log.info("Arguments: " + str(args))
+    if args.nprocesses < 1:
+        raise ValueError("--nprocesses must be at least 1")
 
     # Load/validate config
     log.info("Loading config...")
-    config.set(filename=args.config, load_destfields=False)
+    os.environ[ANON_CONFIG_ENV_VAR] = args.config
+    # ... also read by worker processes
+    get_config().load_dd(check_against_source_db=False)
     log.info("... config loaded")
 
     # Do it
@@ -509,6 +670,7 @@ def main() -> None:
         dsttable=args.dsttable,
         from_src=args.from_src,
         limit=args.limit,
+        nprocesses=args.nprocesses,
         rawdir=args.rawdir,
         resultsfile=args.resultsfile,
         scrubfile=args.scrubfile,
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/anonymise/textcache.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Content-addressed cache of text extracted from documents.**
+
+Documents are identified by a hash of their contents (for BLOBs) or by their
+path, modification time and size (for disk files), together with the text
+extraction settings. Cache keys are keyed hashes (HMACs), so they don't reveal
+which documents are present, and the cached text (which has not been scrubbed)
+is encrypted. Both keys are derived from
+:ref:`extracted_text_cache_encryption_phrase
+<anon_config_extracted_text_cache_encryption_phrase>`.
+
+"""
+
+import base64
+from functools import lru_cache
+import hashlib
+import hmac
+import logging
+import os
+from typing import Optional, Tuple, Union
+
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from crate_anon.anonymise.extracttext import TextExtractionSource
+from crate_anon.anonymise.models import ExtractedTextCacheEntry
+
+log = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+KEY_DERIVATION_SALT = b"crate_extracted_text_cache"
+KEY_DERIVATION_ITERATIONS = 100000
+
+
+# =============================================================================
+# Keys
+# =============================================================================
+
+@lru_cache(maxsize=None)
+def derive_text_cache_keys(passphrase: str) -> Tuple[bytes, bytes]:
+    """
+    Derives keys for the extracted text cache from a passphrase. (Slow, by
+    design, so cached.)
+
+    Args:
+        passphrase: the passphrase
+
+    Returns:
+        tuple: ``hmac_key, fernet_key``
+    """
+    material = hashlib.pbkdf2_hmac(
+        "sha256",
+        passphrase.encode("utf8"),
+        KEY_DERIVATION_SALT,
+        KEY_DERIVATION_ITERATIONS,
+        dklen=64
+    )
+    return material[:32], base64.urlsafe_b64encode(material[32:])
+
+
+# =============================================================================
+# ExtractedTextCache
+# =============================================================================
+
+class ExtractedTextCache(object):
+    """
+    Fetches and stores extracted text in the admin database (see
+    :class:`crate_anon.anonymise.models.ExtractedTextCacheEntry`).
+
+    Each fetch or store uses its own short transaction, committed at once,
+    rather than the admin session's long-lived one. Cache entries are shared
+    between processes (e.g. standard letters), and that way no process holds
+    locks on them for long. The cache is only an optimization, so database
+    errors are logged and otherwise ignored.
+    """
+    def __init__(self,
+                 engine: Engine,
+                 passphrase: str,
+                 plain: bool,
+                 width: int,
+                 pid: Union[int, str] = None) -> None:
+        """
+        Args:
+            engine:
+                SQLAlchemy engine for the secret admin database
+            passphrase:
+                passphrase from which to derive the cache's keys
+            plain:
+                text extraction setting (part of the cache key)
+            width:
+                text extraction setting (part of the cache key)
+            pid:
+                PID of the patient whose record we are processing, if any
+                (recorded with new entries, so they can be deleted on
+                opt-out)
+        """
+        assert passphrase, "Missing passphrase for extracted text cache"
+        self.engine = engine
+        self.plain = plain
+        self.width = width
+        self.pid = pid
+        self._hmac_key, fernet_key = derive_text_cache_keys(passphrase)
+        self._fernet = Fernet(fernet_key)
+
+    def get_cache_key(self, source: TextExtractionSource) -> Optional[str]:
+        """
+        Returns the cache key for a document, or ``None`` if we can't
+        identify it.
+        """
+        if source.blob is not None:
+            identity = "blob:" + hashlib.sha256(source.blob).hexdigest()
+        elif source.filename:
+            try:
+                st = os.stat(source.filename)
+            except OSError:
+                return None
+            identity = (
+                f"file:{os.path.abspath(source.filename)}:"
+                f"{st.st_mtime_ns}:{st.st_size}"
+            )
+        else:
+            return None
+        msg = "|".join([
+            identity,
+            str(source.extension),
+            f"plain={self.plain}",
+            f"width={self.width}",
+        ])
+        return hmac.new(self._hmac_key, msg.encode("utf8"),
+                        hashlib.sha256).hexdigest()
+
+    def fetch(self, source: TextExtractionSource) -> Optional[str]:
+        """
+        Returns cached text for a document, or ``None`` if there isn't any.
+        """
+        cache_key = self.get_cache_key(source)
+        if cache_key is None:
+            return None
+        try:
+            with self.engine.begin() as connection:
+                ciphertext = ExtractedTextCacheEntry.fetch(connection,
+                                                           cache_key)
+        except SQLAlchemyError as e:
+            log.warning(f"Unable to read extracted text cache: {e}")
+            return None
+        if ciphertext is None:
+            return None
+        try:
+            return self._fernet.decrypt(ciphertext).decode("utf8")
+        except InvalidToken:
+            log.warning("Unable to decrypt extracted text cache entry; "
+                        "ignoring it")
+            return None
+
+    def store(self, source: TextExtractionSource, text: str) -> None:
+        """
+        Stores text extracted from a document.
+        """
+        if text is None:
+            return
+        cache_key = self.get_cache_key(source)
+        if cache_key is None:
+            return
+        ciphertext = self._fernet.encrypt(text.encode("utf8"))
+        try:
+            with self.engine.begin() as connection:
+                ExtractedTextCacheEntry.store(connection,
+                                              cache_key=cache_key,
+                                              pid=self.pid,
+                                              ciphertext=ciphertext)
+        except IntegrityError:
+            pass  # another process has just stored the same document
+        except SQLAlchemyError as e:
+            log.warning(f"Unable to write to extracted text cache: {e}")
@@ -381,7 +381,9 @@ class ExtendedConfigParser(configparser.ConfigParser):
                      srccfg: "DatabaseSafeConfig" = None,
                      with_session: bool = False,
                      with_conn: bool = False,
-                     reflect: bool = False) -> DatabaseHolder:
+                     reflect: bool = False,
+                     reflection_cache_dir: str = None,
+                     reflection_threads: int = 1) -> DatabaseHolder:
         """
         Gets a database description from the config file.
 
@@ -393,6 +395,9 @@ class ExtendedConfigParser(configparser.ConfigParser):
             with_session: create an SQLAlchemy Session?
             with_conn: create an SQLAlchemy connection (via an Engine)?
             reflect: read the database structure (when required)?
+            reflection_cache_dir: directory in which to cache the database
+                structure, or ``None``
+            reflection_threads: number of threads to use for reflection
 
         Returns:
             a :class:`crate_anon.anonymise.dbholder.DatabaseHolder` object
@@ -406,7 +411,9 @@ class ExtendedConfigParser(configparser.ConfigParser):
                               with_session=with_session,
                               with_conn=with_conn,
                               reflect=reflect,
-                              echo=echo)
+                              echo=echo,
+                              reflection_cache_dir=reflection_cache_dir,
+                              reflection_threads=reflection_threads)
 
     def get_env_dict(
             self,
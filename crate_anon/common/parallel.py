@@ -28,8 +28,9 @@ crate_anon/common/parallel.py
 
 """
 
+import heapq
 import logging
-from typing import Any
+from typing import Any, List, Sequence, Tuple
 
 from cardinal_pythonlib.hash import hash64
 
@@ -109,3 +110,33 @@ def is_my_job_by_hash_prehashed(hashed_value: int,
 
     """
     return hashed_value % ntasks == tasknum
+
+
+def allocate_longest_first(costs: Sequence[float],
+                           ntasks: int) -> List[List[int]]:
+    """
+    Allocates jobs of (estimated) different sizes to tasks, using
+    longest-processing-time-first scheduling: jobs are taken in descending
+    order of cost, and each is given to the task with the least work so far.
+
+    The allocation is deterministic, so several processes can each work out
+    the same plan independently.
+
+    Args:
+        costs: estimated cost of each job
+        ntasks: how many tasks are there in total?
+
+    Returns:
+        a list, one entry per task, of that task's job indexes (indexes into
+        ``costs``), largest first
+
+    """
+    assert ntasks >= 1
+    allocation = [[] for _ in range(ntasks)]  # type: List[List[int]]
+    loads = [(0, tasknum) for tasknum in range(ntasks)]  # type: List[Tuple[float, int]]  # noqa
+    order = sorted(range(len(costs)), key=lambda i: (-costs[i], i))
+    for jobnum in order:
+        load, tasknum = heapq.heappop(loads)
+        allocation[tasknum].append(jobnum)
+        heapq.heappush(loads, (load + costs[jobnum], tasknum))
+    return allocation
@@ -32,7 +32,9 @@ from collections import OrderedDict
 import functools
 import logging
 import re
-from typing import Any, Dict, Iterable, List, Tuple, Union, Optional
+from typing import (
+    Any, Callable, Dict, Iterable, List, Tuple, Union, Optional,
+)
 
 from cardinal_pythonlib.json.serialize import (
     METHOD_PROVIDES_INIT_KWARGS,
@@ -63,6 +65,7 @@ from sqlalchemy.engine.base import Engine
 from sqlalchemy.engine.interfaces import Dialect
 from sqlalchemy.orm.session import Session
 from sqlalchemy.schema import Column, Table
+from sqlalchemy.sql.expression import Insert
 
 from crate_anon.common.stringfunc import get_spec_match_regex
 
@@ -80,6 +83,7 @@ SqlArgsTupleType = Tuple[str, List[Any]]
 # =============================================================================
 
 TIMING_COMMIT = "commit"
+TIMING_INSERT = "insert"
 
 SQL_OPS_VALUE_UNNECESSARY = ['IS NULL', 'IS NOT NULL']
 SQL_OPS_MULTIPLE_VALUES = ['IN', 'NOT IN']
@@ -1551,7 +1555,8 @@ class TransactionSizeLimiter(object):
     """
     def __init__(self, session: Session,
                  max_rows_before_commit: int = None,
-                 max_bytes_before_commit: int = None) -> None:
+                 max_bytes_before_commit: int = None,
+                 before_commit: Callable[[], None] = None) -> None:
         """
         Args:
             session: SQLAlchemy database Session
@@ -1559,10 +1564,15 @@ class TransactionSizeLimiter(object):
                 triggering a COMMIT? ``None`` for no limit.
             max_bytes_before_commit: how many bytes should we insert before
                 triggering a COMMIT? ``None`` for no limit.
+            before_commit: optional function to be called just before each
+                COMMIT; for example, to write out buffered rows (see
+                :class:`BatchedInserter`) that must be committed no later
+                than this transaction.
         """
         self._session = session
         self._max_rows_before_commit = max_rows_before_commit
         self._max_bytes_before_commit = max_bytes_before_commit
+        self._before_commit = before_commit
         self._bytes_in_transaction = 0
         self._rows_in_transaction = 0
 
@@ -1572,6 +1582,8 @@ class TransactionSizeLimiter(object):
 
         (Measures some timing information, too.)
         """
+        if self._before_commit:
+            self._before_commit()
         with MultiTimerContext(timer, TIMING_COMMIT):
             self._session.commit()
         self._bytes_in_transaction = 0
@@ -1614,6 +1626,89 @@ class TransactionSizeLimiter(object):
             self.commit()
 
 
+class BatchedInserter(object):
+    """
+    Class to collect rows destined for a single table and ``INSERT`` them in
+    batches, rather than one statement per row.
+
+    Each batch is executed as a single call with a list of parameter
+    dictionaries, so SQLAlchemy uses the DB-API ``executemany()`` call. Some
+    drivers (e.g. ``mysqlclient``) rewrite this as a multi-row ``INSERT ...
+    VALUES (...), (...)`` statement. The statement itself (e.g. an
+    ``INSERT ... ON DUPLICATE KEY UPDATE``) is unchanged, so upsert behaviour
+    is preserved.
+
+    All rows added to one inserter must have the same set of keys.
+    """
+    def __init__(self,
+                 session: Session,
+                 statement: Insert,
+                 max_rows_per_batch: int = None,
+                 max_bytes_per_batch: int = None,
+                 on_flush: Callable[[int, int], None] = None) -> None:
+        """
+        Args:
+            session: SQLAlchemy database Session
+            statement: the SQLAlchemy ``INSERT`` statement (without values)
+            max_rows_per_batch: how many rows should we buffer before
+                executing? ``None`` for no limit; 1 to insert every row
+                immediately.
+            max_bytes_per_batch: how many (approximate) bytes should we buffer
+                before executing? ``None`` for no limit.
+            on_flush: optional function to be called as ``on_flush(n_rows,
+                n_bytes)`` after each batch has been executed; for example,
+                :meth:`TransactionSizeLimiter.notify`.
+        """
+        self._session = session
+        self._statement = statement
+        self._max_rows_per_batch = max_rows_per_batch
+        self._max_bytes_per_batch = max_bytes_per_batch
+        self._on_flush = on_flush
+        self._rows = []  # type: List[Dict[str, Any]]
+        self._n_bytes = 0
+
+    def add(self, values: Dict[str, Any], n_bytes: int = 0) -> None:
+        """
+        Adds a row to the buffer, executing the batch if a limit is reached.
+
+        Args:
+            values: dictionary mapping column names to values
+            n_bytes: approximate size of the row, in bytes
+        """
+        self._rows.append(values)
+        self._n_bytes += n_bytes
+        if ((self._max_rows_per_batch is not None and
+                len(self._rows) >= self._max_rows_per_batch) or
+                (self._max_bytes_per_batch is not None and
+                 self._n_bytes >= self._max_bytes_per_batch)):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Executes any buffered rows. Call this before committing.
+        """
+        if not self._rows:
+            return
+        rows = self._rows
+        n_bytes = self._n_bytes
+        self._rows = []  # type: List[Dict[str, Any]]
+        self._n_bytes = 0
+        with MultiTimerContext(timer, TIMING_INSERT):
+            if len(rows) == 1:
+                self._session.execute(self._statement.values(rows[0]))
+            else:
+                self._session.execute(self._statement, rows)
+        if self._on_flush:
+            self._on_flush(len(rows), n_bytes)
+
+    @property
+    def n_rows_pending(self) -> int:
+        """
+        Number of rows buffered but not yet executed.
+        """
+        return len(self._rows)
+
+
 # =============================================================================
 # Specification matching
 # =============================================================================
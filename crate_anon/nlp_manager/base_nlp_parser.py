@@ -34,8 +34,8 @@ import json
 import logging
 import sys
 from typing import (
-    Any, Dict, Generator, Iterable, List, Optional, TextIO, Tuple,
-    TYPE_CHECKING,
+    Any, Dict, FrozenSet, Generator, Iterable, List, Optional, Set, TextIO,
+    Tuple, TYPE_CHECKING,
 )
 
 from cardinal_pythonlib.reprfunc import auto_repr
@@ -57,6 +57,7 @@ from sqlalchemy.sql.schema import MetaData
 from sqlalchemy.types import Integer, Text
 
 from crate_anon.anonymise.dbholder import DatabaseHolder
+from crate_anon.common.sql import BatchedInserter
 from crate_anon.common.stringfunc import does_text_contain_word_chars
 from crate_anon.nlp_manager.constants import (
     FN_NLPDEF,
@@ -90,7 +91,6 @@ log = logging.getLogger(__name__)
 
 DEFAULT_NLPRP_SQL_DIALECT = SqlDialects.MYSQL
 TIMING_DELETE_DEST_RECORD = "BaseNlpParser_delete_dest_record"
-TIMING_INSERT = "BaseNlpParser_sql_insert"
 TIMING_PARSE = "parse"
 TIMING_HANDLE_PARSED = "handled_parsed"
 
@@ -642,6 +642,69 @@ class BaseNlpParser(TableMaker):
                  friendly_name: str = "?") -> None:
         super().__init__(nlpdef, cfg_processor_name, commit,
                          friendly_name=friendly_name)
+        self._output_column_names = {}  # type: Dict[str, Set[str]]
+        self._output_inserters = {}  # type: Dict[Tuple[str, FrozenSet[str]], BatchedInserter]  # noqa
+
+    # -------------------------------------------------------------------------
+    # Output buffering
+    # -------------------------------------------------------------------------
+
+    def get_output_column_names(self, tablename: str) -> Set[str]:
+        """
+        Returns the set of column names for a given destination table of this
+        NLP processor (cached, since we check every output row against it).
+        """
+        try:
+            return self._output_column_names[tablename]
+        except KeyError:
+            table = self.get_table(tablename)
+            column_names = set(c.name for c in table.columns)
+            self._output_column_names[tablename] = column_names
+            return column_names
+
+    def _get_output_inserter(self, tablename: str,
+                             column_names: FrozenSet[str]) -> BatchedInserter:
+        """
+        Returns (or creates and returns) the buffer for output rows destined
+        for a given destination table.
+
+        Rows in a single ``executemany()`` batch must share the same columns,
+        and NLP processors are not obliged to return the same set of values
+        every time, so there is one buffer per table per set of columns.
+        """
+        key = (tablename, column_names)
+        try:
+            return self._output_inserters[key]
+        except KeyError:
+            session = self.dest_session
+
+            def notify(n_rows: int, n_bytes: int) -> None:
+                self._nlpdef.notify_transaction(
+                    session,
+                    n_rows=n_rows,
+                    n_bytes=n_bytes,
+                    force_commit=self._commit
+                )
+
+            inserter = BatchedInserter(
+                session=session,
+                statement=self.get_table(tablename).insert(),
+                max_rows_per_batch=self._nlpdef.max_rows_per_insert,
+                on_flush=notify  # may trigger a COMMIT
+            )
+            self._output_inserters[key] = inserter
+            return inserter
+
+    def flush_output(self) -> None:
+        """
+        Writes any buffered output rows to the destination database (within
+        its current transaction). This must happen before the progress
+        records for the corresponding source records are committed; the
+        :class:`crate_anon.nlp_manager.nlp_definition.NlpDefinition` ensures
+        that.
+        """
+        for inserter in self._output_inserters.values():
+            inserter.flush()
 
     # -------------------------------------------------------------------------
     # NLP processing
@@ -676,7 +739,8 @@ class BaseNlpParser(TableMaker):
         The core function that takes a single piece of text and feeds it
         through a single NLP processor. This may produce zero, one, or many
         output records. Those records are then merged with information about
-        their source (etc)., and inserted into the destination database.
+        their source (etc)., and inserted into the destination database (in
+        batches; see :meth:`flush_output`).
 
         Args:
             text:
@@ -699,7 +763,6 @@ class BaseNlpParser(TableMaker):
             # ... the warning occurs frequently so slows down processing
             return
         starting_fields_values[FN_NLPDEF] = self._nlpdef.name
-        session = self.dest_session
         n_values = 0
         with MultiTimerContext(timer, TIMING_PARSE):
             for tablename, nlp_values in self.parse(text):
@@ -707,7 +770,6 @@ class BaseNlpParser(TableMaker):
                     # Merge dictionaries so EXISTING FIELDS/VALUES
                     # (starting_fields_values) HAVE PRIORITY.
                     nlp_values.update(starting_fields_values)
-                    sqla_table = self.get_table(tablename)
                     # If we have superfluous keys in our dictionary, SQLAlchemy
                     # will choke ("Unconsumed column names", reporting the
                     # thing that's in our dictionary that it doesn't know
@@ -717,19 +779,15 @@ class BaseNlpParser(TableMaker):
                     # the SQLA column names to lower case. That happens in
                     # InputFieldConfig.get_copy_columns and
                     # InputFieldConfig.get_copy_indexes
-                    column_names = [c.name for c in sqla_table.columns]
+                    column_names = self.get_output_column_names(tablename)
                     final_values = {k: v for k, v in nlp_values.items()
                                     if k in column_names}
-                    # log.critical(repr(sqla_table))
-                    insertquery = sqla_table.insert().values(final_values)
-                    with MultiTimerContext(timer, TIMING_INSERT):
-                        session.execute(insertquery)
-                    self._nlpdef.notify_transaction(
-                        session,
-                        n_rows=1,
-                        n_bytes=sys.getsizeof(final_values),
-                        force_commit=self._commit
-                    )
+                    # The row is buffered, and INSERTed in a batch with others
+                    # for the same table; see flush_output().
+                    inserter = self._get_output_inserter(
+                        tablename, frozenset(final_values))
+                    inserter.add(final_values,
+                                 n_bytes=sys.getsizeof(final_values))
                     n_values += 1
         log.debug(
             f"NLP processor {self.nlpdef_name}/{self.friendly_name}:"
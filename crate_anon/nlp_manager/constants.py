@@ -105,6 +105,7 @@ class NlpDefConfigKeys(object):
     TEMPORARY_TABLENAME = "temporary_tablename"
     MAX_ROWS_BEFORE_COMMIT = "max_rows_before_commit"
     MAX_BYTES_BEFORE_COMMIT = "max_bytes_before_commit"
+    MAX_ROWS_PER_INSERT = "max_rows_per_insert"
     TRUNCATE_TEXT_AT = "truncate_text_at"
     RECORD_TRUNCATED_VALUES = "record_truncated_values"
     CLOUD_CONFIG = "cloud_config"
@@ -29,7 +29,7 @@ crate_anon/nlp_manager/input_field_config.py
 """
 
 import logging
-# import sys
+import sys
 from typing import Any, Dict, Generator, List, Optional, Tuple
 
 from cardinal_pythonlib.datetimefunc import get_now_utc_notz_datetime
@@ -48,7 +48,9 @@ from cardinal_pythonlib.timing import MultiTimerContext, timer
 from sqlalchemy import BigInteger, Column, DateTime, Index, String, Table
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm.session import Session
-from sqlalchemy.sql import and_, column, exists, null, or_, select, table
+from sqlalchemy.sql import (
+    and_, bindparam, column, exists, null, or_, select, table, update,
+)
 from sqlalchemy.sql.schema import MetaData
 
 from crate_anon.common.parallel import is_my_job_by_hash_prehashed
@@ -87,6 +89,9 @@ TIMING_GEN_TEXT_SQL_SELECT = "gen_text_sql_select"
 TIMING_PROCESS_GEN_TEXT = "process_generated_text"
 TIMING_PROGRESS_DB_SELECT = "progress_db_select"
 TIMING_PROGRESS_DB_DELETE = "progress_db_delete"
+TIMING_PROGRESS_DB_WRITE = "progress_db_write"
+
+PROGRESS_HASH_CHUNK_SIZE = 10000
 
 
 # =============================================================================
@@ -398,11 +403,17 @@ class InputFieldConfig(object):
         return pk_is_integer
 
     def gen_text(self, tasknum: int = 0,
-                 ntasks: int = 1) -> \
+                 ntasks: int = 1,
+                 sort_by_pk: bool = False) -> \
             Generator[Tuple[str, Dict[str, Any]], None, None]:
         """
         Generate text strings from the source database.
 
+        Args:
+            tasknum: which task number am I?
+            ntasks: how many tasks are there in total?
+            sort_by_pk: fetch source records in order of their PK?
+
         Yields:
             tuple: ``text, dict``, where ``text`` is the source text and
             ``dict`` is a column-to-value mapping for all other fields (source
@@ -448,9 +459,11 @@ class InputFieldConfig(object):
             selectcols.append(column(extracol))
 
         query = select(selectcols).select_from(table(self._srctable))
-        # not ordered...
+        # not ordered, unless we need that...
         # if self._fetch_sorted:
         #     query = query.order_by(pkcol)
+        if sort_by_pk:
+            query = query.order_by(pkcol)
 
         # ---------------------------------------------------------------------
         # Plan our parallel-processing approach
@@ -561,6 +574,84 @@ class InputFieldConfig(object):
             # This was surprisingly slow under SQL Server testing.
             return query.one_or_none()
 
+    def gen_progress_hashes(
+            self,
+            tasknum: int = 0,
+            ntasks: int = 1,
+            chunk_size: int = PROGRESS_HASH_CHUNK_SIZE) \
+            -> Generator[Tuple[int, str], None, None]:
+        """
+        Generates ``srcpkval, srchash`` tuples from the progress records for
+        this input field/NLP definition, in ``srcpkval`` order. Only useful
+        for source tables with an integer PK (where ``srcpkval`` is the PK).
+
+        The records are fetched in chunks (each starting after the last PK of
+        the previous chunk), so no query is left open on the progress session
+        while we are writing to it.
+
+        Args:
+            tasknum: which task number am I?
+            ntasks: how many tasks are there in total?
+            chunk_size: number of progress records to fetch per query
+        """
+        session = self._progress_session
+        last_pkval = None  # type: Optional[int]
+        while True:
+            query = (
+                select([NlpRecord.srcpkval, NlpRecord.srchash]).
+                where(NlpRecord.srcdb == self._srcdb).
+                where(NlpRecord.srctable == self._srctable).
+                where(NlpRecord.srcfield == self._srcfield).
+                where(NlpRecord.nlpdef == self._nlpdef.name).
+                order_by(NlpRecord.srcpkval).
+                limit(chunk_size)
+            )
+            if ntasks > 1:
+                # Same division of work as gen_text() uses for integer PKs.
+                query = query.where(NlpRecord.srcpkval % ntasks == tasknum)
+            if last_pkval is not None:
+                query = query.where(NlpRecord.srcpkval > last_pkval)
+            with MultiTimerContext(timer, TIMING_PROGRESS_DB_SELECT):
+                rows = session.execute(query).fetchall()
+            for row in rows:
+                yield row[0], row[1]
+            if len(rows) < chunk_size:
+                return
+            last_pkval = rows[-1][0]
+
+    def gen_text_with_progress_hash(
+            self,
+            tasknum: int = 0,
+            ntasks: int = 1) \
+            -> Generator[Tuple[str, Dict[str, Any], bool, Optional[str]],
+                         None, None]:
+        """
+        As for :meth:`gen_text`, but the source records are fetched in PK
+        order and merge-joined with the progress records (see
+        :meth:`gen_progress_hashes`), so that we can tell which records have
+        been processed before without querying the progress database for
+        every record. Only for source tables with an integer PK.
+
+        Yields:
+            tuple: ``text, dict, progress_exists, srchash``, where ``text``
+            and ``dict`` are as for :meth:`gen_text`, ``progress_exists`` is
+            whether there is an existing progress record, and ``srchash`` is
+            the source hash from that record (``None`` if there is no record,
+            or if the record has no hash)
+        """
+        progress = self.gen_progress_hashes(tasknum=tasknum, ntasks=ntasks)
+        prog_pkval, prog_hash = next(progress, (None, None))
+        for text, other_values in self.gen_text(tasknum=tasknum,
+                                                ntasks=ntasks,
+                                                sort_by_pk=True):
+            pkval = other_values[FN_SRCPKVAL]
+            while prog_pkval is not None and prog_pkval < pkval:
+                prog_pkval, prog_hash = next(progress, (None, None))
+            if prog_pkval == pkval:
+                yield text, other_values, True, prog_hash
+            else:
+                yield text, other_values, False, None
+
     def gen_src_pks(self) -> Generator[Tuple[int, Optional[str]], None, None]:
         """
         Generate integer PKs from the source table.
@@ -649,3 +740,150 @@ class InputFieldConfig(object):
         with MultiTimerContext(timer, TIMING_PROGRESS_DB_DELETE):
             prog_deletion_query.delete(synchronize_session=False)
         self._nlpdef.commit(progsession)
+
+
+# =============================================================================
+# Batched writing of progress records
+# =============================================================================
+
+class ProgressRecordWriter(object):
+    """
+    Writes progress records (see
+    :class:`crate_anon.nlp_manager.models.NlpRecord`) for one input field/NLP
+    definition in batches, using Core bulk ``INSERT`` (for new records) and
+    ``UPDATE`` (for existing records) statements, rather than one ORM object
+    per source record.
+
+    Our callers already know whether each record exists, so we don't need an
+    "upsert" (and ``INSERT ... ON DUPLICATE KEY UPDATE`` wouldn't work here
+    anyway, as the unique index includes ``srcpkstr``, which is ``NULL`` for
+    tables with integer PKs).
+
+    Each batch is followed by a notification to the progress database's
+    transaction limiter, which may trigger a COMMIT. Before any such COMMIT,
+    the :class:`crate_anon.nlp_manager.nlp_definition.NlpDefinition` writes
+    any buffered NLP output and commits the destination databases, so
+    progress records are never committed ahead of the output they describe.
+    """
+    def __init__(self,
+                 nlpdef: NlpDefinition,
+                 ifconfig: InputFieldConfig,
+                 max_rows_per_batch: int = None,
+                 force_commit: bool = False) -> None:
+        """
+        Args:
+            nlpdef: the :class:`NlpDefinition`
+            ifconfig: the :class:`InputFieldConfig` whose records we are
+                writing
+            max_rows_per_batch: how many records should we buffer before
+                writing? ``None`` for no limit (until :meth:`flush` is
+                called); 1 to write every record immediately.
+            force_commit: COMMIT after each batch?
+        """
+        self._nlpdef = nlpdef
+        self._ifconfig = ifconfig
+        self._max_rows_per_batch = max_rows_per_batch
+        self._force_commit = force_commit
+        self._inserts = []  # type: List[Dict[str, Any]]
+        self._updates_intpk = []  # type: List[Dict[str, Any]]
+        self._updates_strpk = []  # type: List[Dict[str, Any]]
+
+        nlpt = NlpRecord.__table__
+        self._insert_statement = nlpt.insert()
+        update_statement = (
+            update(nlpt).
+            where(nlpt.c.srcdb == ifconfig.srcdb).
+            where(nlpt.c.srctable == ifconfig.srctable).
+            where(nlpt.c.srcpkval == bindparam("b_srcpkval")).
+            where(nlpt.c.srcfield == ifconfig.srcfield).
+            where(nlpt.c.nlpdef == nlpdef.name).
+            values(whenprocessedutc=bindparam("b_whenprocessedutc"),
+                   srchash=bindparam("b_srchash"))
+        )
+        # A single executemany() call needs a single SQL statement, and
+        # "srcpkstr = NULL" is never true, so there is one statement for
+        # integer PKs and one for string PKs:
+        self._update_statement_intpk = update_statement.where(
+            nlpt.c.srcpkstr.is_(None))
+        self._update_statement_strpk = update_statement.where(
+            nlpt.c.srcpkstr == bindparam("b_srcpkstr"))
+
+    @property
+    def n_rows_pending(self) -> int:
+        """
+        Number of records buffered but not yet written.
+        """
+        return (len(self._inserts) + len(self._updates_intpk) +
+                len(self._updates_strpk))
+
+    def add(self,
+            srcpkval: int,
+            srcpkstr: Optional[str],
+            srchash: str,
+            exists_already: bool) -> None:
+        """
+        Adds a progress record to the buffer, writing the batch if it is
+        full.
+
+        Args:
+            srcpkval: integer primary key (PK) value (or hash of a string PK)
+            srcpkstr: for tables with string PKs: the string PK value
+            srchash: hash of the source text
+            exists_already: is there an existing progress record for this
+                source record (to be updated, rather than inserted)?
+        """
+        ifconfig = self._ifconfig
+        nlpdef = self._nlpdef
+        if exists_already:
+            values = {
+                "b_srcpkval": srcpkval,
+                "b_whenprocessedutc": nlpdef.now,
+                "b_srchash": srchash,
+            }
+            if srcpkstr is None:
+                self._updates_intpk.append(values)
+            else:
+                values["b_srcpkstr"] = srcpkstr
+                self._updates_strpk.append(values)
+        else:
+            self._inserts.append({
+                # Quasi-key fields:
+                "srcdb": ifconfig.srcdb,
+                "srctable": ifconfig.srctable,
+                "srcpkval": srcpkval,
+                "srcpkstr": srcpkstr,
+                "srcfield": ifconfig.srcfield,
+                "nlpdef": nlpdef.name,
+                # Other fields:
+                "srcpkfield": ifconfig.srcpkfield,
+                "whenprocessedutc": nlpdef.now,
+                "srchash": srchash,
+            })
+        if (self._max_rows_per_batch is not None and
+                self.n_rows_pending >= self._max_rows_per_batch):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes any buffered progress records, and notifies the progress
+        database's transaction limiter (which may COMMIT).
+        """
+        n_rows = self.n_rows_pending
+        if not n_rows:
+            return
+        session = self._nlpdef.progressdb_session
+        n_bytes = 0
+        with MultiTimerContext(timer, TIMING_PROGRESS_DB_WRITE):
+            for statement, rows in (
+                    (self._insert_statement, self._inserts),
+                    (self._update_statement_intpk, self._updates_intpk),
+                    (self._update_statement_strpk, self._updates_strpk)):
+                if rows:
+                    session.execute(statement, rows)
+                    n_bytes += sum(sys.getsizeof(r) for r in rows)  # approx
+        self._inserts = []  # type: List[Dict[str, Any]]
+        self._updates_intpk = []  # type: List[Dict[str, Any]]
+        self._updates_strpk = []  # type: List[Dict[str, Any]]
+        self._nlpdef.notify_transaction(
+            session=session, n_rows=n_rows, n_bytes=n_bytes,
+            force_commit=self._force_commit)
@@ -51,6 +51,7 @@ from sqlalchemy.schema import MetaData
 from crate_anon.anonymise.constants import (
     DEFAULT_MAX_BYTES_BEFORE_COMMIT,
     DEFAULT_MAX_ROWS_BEFORE_COMMIT,
+    DEFAULT_MAX_ROWS_PER_INSERT,
 )
 from crate_anon.anonymise.dbholder import DatabaseHolder
 from crate_anon.common.constants import EnvVar
@@ -316,6 +317,7 @@ def demo_nlp_config() -> str:
 # {NlpDefConfigKeys.RECORD_TRUNCATED_VALUES} = False
 {NlpDefConfigKeys.MAX_ROWS_BEFORE_COMMIT} = {DEFAULT_MAX_ROWS_BEFORE_COMMIT}
 {NlpDefConfigKeys.MAX_BYTES_BEFORE_COMMIT} = {DEFAULT_MAX_BYTES_BEFORE_COMMIT}
+{NlpDefConfigKeys.MAX_ROWS_PER_INSERT} = {DEFAULT_MAX_ROWS_PER_INSERT}
 
 # -----------------------------------------------------------------------------
 # Cloud NLP demo
@@ -865,6 +867,9 @@ class NlpDefinition(object):
         self._max_bytes_before_commit = self._cfg.opt_int_positive(
             NlpDefConfigKeys.MAX_BYTES_BEFORE_COMMIT,
             DEFAULT_MAX_BYTES_BEFORE_COMMIT)
+        self.max_rows_per_insert = self._cfg.opt_int_positive(
+            NlpDefConfigKeys.MAX_ROWS_PER_INSERT,
+            DEFAULT_MAX_ROWS_PER_INSERT)
         self._now = get_now_utc_notz_datetime()
         self.truncate_text_at = self._cfg.opt_int_positive(
             NlpDefConfigKeys.TRUNCATE_TEXT_AT,
@@ -1117,10 +1122,17 @@ class NlpDefinition(object):
 
         """
         if session not in self._transaction_limiters:
+            if session is self.progressdb_session:
+                # Progress records must not be committed before the NLP
+                # output that they describe.
+                before_commit = self.flush_and_commit_output
+            else:
+                before_commit = None
             self._transaction_limiters[session] = TransactionSizeLimiter(
                 session,
                 max_rows_before_commit=self._max_rows_before_commit,
-                max_bytes_before_commit=self._max_bytes_before_commit)
+                max_bytes_before_commit=self._max_bytes_before_commit,
+                before_commit=before_commit)
         return self._transaction_limiters[session]
 
     def notify_transaction(self, session: Session,
@@ -1149,6 +1161,21 @@ class NlpDefinition(object):
         tl = self.get_transation_limiter(session)
         tl.commit()
 
+    def flush_and_commit_output(self) -> None:
+        """
+        Writes any NLP output rows buffered by our local processors, and
+        commits all databases other than the progress database. Called
+        automatically before each COMMIT on the progress database, so that
+        a crash can never leave a source record marked as processed when its
+        NLP output has not been saved.
+        """
+        for processor in self.noncloud_processors:
+            processor.flush_output()
+        progress_session = self.progressdb_session
+        for db in self._databases.values():
+            if db.session is not progress_session:
+                self.commit(db.session)
+
     # -------------------------------------------------------------------------
     # Input fields
     # -------------------------------------------------------------------------
@@ -110,6 +110,7 @@ from crate_anon.nlp_manager.constants import (
 )
 from crate_anon.nlp_manager.input_field_config import (
     InputFieldConfig,
+    ProgressRecordWriter,
     FN_SRCDB,
     FN_SRCTABLE,
     FN_SRCPKFIELD,
@@ -474,7 +475,6 @@ def process_nlp(nlpdef: NlpDefinition,
         ntasks: how many tasks are there in total?
     """
     log.info(SEP + "NLP")
-    session = nlpdef.progressdb_session
     if not nlpdef.noncloud_processors:
         errmsg = (
             f"Can't use NLP definition {nlpdef.name!r} as it has no "
@@ -484,12 +484,58 @@ def process_nlp(nlpdef: NlpDefinition,
         log.critical(errmsg)
         raise ValueError(errmsg)
 
+    # In incremental mode, do we commit immediately, because other
+    # processes may need this table promptly... ?
+
+    # force_commit = False  # definitely wrong; crashes as below
+    # force_commit = incremental
+    force_commit = ntasks > 1
+
+    # - A single source record should not be processed by >1 CRATE
+    #   process. So in theory there should be no conflicts.
+    # - However, databases can lock in various ways. Can we
+    #   guarantee it'll do something sensible?
+    # - See also
+    #   https://en.wikipedia.org/wiki/Isolation_(database_systems)
+    #   http://skien.cc/blog/2014/02/06/sqlalchemy-and-race-conditions-follow-up/  # noqa
+    #   http://docs.sqlalchemy.org/en/latest/core/connections.html?highlight=execution_options#sqlalchemy.engine.Connection.execution_options  # noqa
+    # - However, empirically, setting this to False gives
+    #   "Transaction (Process ID xx) was deadlocked on lock
+    #   resources with another process and has been chosen as the
+    #   deadlock victim. Rerun the transaction." -- with a SELECT
+    #   query.
+    # - SQL Server uses READ COMMITTED as the default isolation
+    #   level.
+    # - https://technet.microsoft.com/en-us/library/jj856598(v=sql.110).aspx  # noqa
+    # - Progress records are now written in batches, so with
+    #   force_commit we COMMIT once per batch, not once per record.
+
     for ifconfig in nlpdef.inputfieldconfigs:
+        progress_writer = ProgressRecordWriter(
+            nlpdef=nlpdef,
+            ifconfig=ifconfig,
+            max_rows_per_batch=nlpdef.max_rows_per_insert,
+            force_commit=force_commit
+        )
         i = 0  # record count within this process
         recnum = tasknum  # record count overall
         totalcount = ifconfig.get_count()  # total number of records in table
-        for text, other_values in ifconfig.gen_text(tasknum=tasknum,
-                                                    ntasks=ntasks):
+        # In incremental mode, for tables with integer PKs, we fetch the
+        # hashes of previously processed records in bulk, alongside the
+        # source records; otherwise, we look up each record's progress record
+        # individually. (String PKs may sort differently in the source and
+        # progress databases, so can't be merged in this way.)
+        bulk_progress = incremental and ifconfig.is_pk_integer()
+        if bulk_progress:
+            records = ifconfig.gen_text_with_progress_hash(tasknum=tasknum,
+                                                           ntasks=ntasks)
+        else:
+            records = (
+                (text, other_values, False, None)
+                for text, other_values in ifconfig.gen_text(tasknum=tasknum,
+                                                            ntasks=ntasks)
+            )
+        for text, other_values, progress_exists, prev_srchash in records:
             log.debug(len(text))
             i += 1
             pkval = other_values[FN_SRCPKVAL]
@@ -522,9 +568,17 @@ def process_nlp(nlpdef: NlpDefinition,
             # log.critical("other_values={}".format(repr(other_values)))
             srchash = nlpdef.hash(text)
 
-            progrec = None
-            if incremental:
+            if bulk_progress:
+                if not progress_exists:
+                    log.debug("Record is new")
+                elif prev_srchash == srchash:
+                    log.debug("Record previously processed; skipping")
+                    continue
+                else:
+                    log.debug("Record has changed")
+            elif incremental:
                 progrec = ifconfig.get_progress_record(pkval, pkstr)
+                progress_exists = progrec is not None
                 if progrec is not None:
                     if progrec.srchash == srchash:
                         log.debug("Record previously processed; skipping")
@@ -563,54 +617,12 @@ def process_nlp(nlpdef: NlpDefinition,
             # source record.
             truncated = other_values[TRUNCATED_FLAG]
             if not truncated or nlpdef.record_truncated_values:
-                if progrec:  # modifying an existing record
-                    progrec.whenprocessedutc = nlpdef.now
-                    progrec.srchash = srchash
-                else:  # creating a new record
-                    progrec = NlpRecord(
-                        # Quasi-key fields:
-                        srcdb=ifconfig.srcdb,
-                        srctable=ifconfig.srctable,
-                        srcpkval=pkval,
-                        srcpkstr=pkstr,
-                        srcfield=ifconfig.srcfield,
-                        nlpdef=nlpdef.name,
-                        # Other fields:
-                        srcpkfield=ifconfig.srcpkfield,
-                        whenprocessedutc=nlpdef.now,
-                        srchash=srchash,
-                    )
-                    with MultiTimerContext(timer, TIMING_PROGRESS_DB_ADD):
-                        session.add(progrec)
+                progress_writer.add(srcpkval=pkval,
+                                    srcpkstr=pkstr,
+                                    srchash=srchash,
+                                    exists_already=progress_exists)
 
-                # In incremental mode, do we commit immediately, because other
-                # processes may need this table promptly... ?
-
-                # force_commit = False  # definitely wrong; crashes as below
-                # force_commit = incremental
-                force_commit = ntasks > 1
-
-                # - A single source record should not be processed by >1 CRATE
-                #   process. So in theory there should be no conflicts.
-                # - However, databases can lock in various ways. Can we
-                #   guarantee it'll do something sensible?
-                # - See also
-                #   https://en.wikipedia.org/wiki/Isolation_(database_systems)
-                #   http://skien.cc/blog/2014/02/06/sqlalchemy-and-race-conditions-follow-up/  # noqa
-                #   http://docs.sqlalchemy.org/en/latest/core/connections.html?highlight=execution_options#sqlalchemy.engine.Connection.execution_options  # noqa
-                # - However, empirically, setting this to False gives
-                #   "Transaction (Process ID xx) was deadlocked on lock
-                #   resources with another process and has been chosen as the
-                #   deadlock victim. Rerun the transaction." -- with a SELECT
-                #   query.
-                # - SQL Server uses READ COMMITTED as the default isolation
-                #   level.
-                # - https://technet.microsoft.com/en-us/library/jj856598(v=sql.110).aspx  # noqa
-
-                nlpdef.notify_transaction(
-                    session=session, n_rows=1,
-                    n_bytes=sys.getsizeof(progrec),  # approx
-                    force_commit=force_commit)
+        progress_writer.flush()
 
     nlpdef.commit_all()
 
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/tests/__init__.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Unit tests that use a temporary SQLite database.**
+
+Tests that import the anonymiser need its config singleton, which (in the
+absence of a config file) needs the environment variable
+``CRATE_RUN_WITHOUT_LOCAL_SETTINGS=1``. Run them with e.g.
+
+.. code-block:: bash
+
+    CRATE_RUN_WITHOUT_LOCAL_SETTINGS=1 pytest crate_anon/tests
+
+"""
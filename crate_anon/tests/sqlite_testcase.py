@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/tests/sqlite_testcase.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Base class for tests that use a temporary SQLite database.**
+
+"""
+
+import os
+import tempfile
+from typing import List
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm.session import Session, sessionmaker
+
+
+class SqliteTestCase(unittest.TestCase):
+    """
+    Provides a temporary SQLite database file for each test, with an engine
+    (``self.engine``) and a session (``self.session``). Further engines (each
+    with their own connections, e.g. to act as other processes) and sessions
+    can be made with :meth:`make_engine` and :meth:`make_session`.
+    """
+
+    def setUp(self) -> None:
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.url = "sqlite:///" + os.path.join(self._tempdir.name,
+                                               "test.sqlite")
+        self._engines = []  # type: List[Engine]
+        self._sessions = []  # type: List[Session]
+        self.engine = self.make_engine()
+        self.session = self.make_session(self.engine)
+        self.n_selects = 0
+
+    def tearDown(self) -> None:
+        for session in self._sessions:
+            session.close()
+        for engine in self._engines:
+            engine.dispose()
+        self._tempdir.cleanup()
+
+    def make_engine(self) -> Engine:
+        """
+        Returns a new engine for our database.
+        """
+        engine = create_engine(self.url)
+        self._engines.append(engine)
+        return engine
+
+    def make_session(self, engine: Engine = None) -> Session:
+        """
+        Returns a new session, using ``engine`` (by default, ours).
+        """
+        session = sessionmaker(bind=engine or self.engine)()
+        self._sessions.append(session)
+        return session
+
+    def count_selects(self, engine: Engine = None) -> None:
+        """
+        From now on, count the ``SELECT`` statements executed via ``engine``
+        (by default, ours) in ``self.n_selects``.
+        """
+        # noinspection PyUnusedLocal
+        def count_select(conn, cursor, statement, *args) -> None:
+            if statement.lstrip().upper().startswith("SELECT"):
+                self.n_selects += 1
+
+        event.listen(engine or self.engine, "before_cursor_execute",
+                     count_select)
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/tests/test_anonymise.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Tests for the anonymiser's use of the destination and admin databases
+(see :mod:`crate_anon.anonymise.anonymise`).**
+
+"""
+
+from types import SimpleNamespace
+from typing import Any, List
+from unittest import mock
+
+from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy.sql import column, select
+
+from crate_anon.anonymise.anonymise import (
+    config,
+    DestinationRecordLookup,
+    gen_uncompleted_pid_batches,
+    get_int_pk_ranges,
+    requeue_unfinished_work,
+    wipe_destination_data_for_nonpatient_unit,
+    wipe_destination_data_for_patients,
+)
+from crate_anon.anonymise.models import (
+    ProgressLedgerEntry,
+    WorkQueueItem,
+    WorkQueueKind,
+)
+from crate_anon.tests.sqlite_testcase import SqliteTestCase
+
+
+class TestDestinationRecordLookup(SqliteTestCase):
+    """
+    Checks :class:`DestinationRecordLookup` against a SQLite destination
+    table, including which queries it makes as PKs cross window boundaries.
+    """
+
+    HASH = "_src_hash"
+
+    def setUp(self) -> None:
+        super().setUp()
+        metadata = MetaData()
+        self.table = Table("dest", metadata,
+                           Column("pk", Integer, primary_key=True),
+                           Column("rid", String(10)),
+                           Column(self.HASH, String(64)))
+        metadata.create_all(self.engine)
+        # PKs 0-24, except 7; PK 12 has no hash.
+        self.engine.execute(self.table.insert(), [
+            {"pk": pk, "rid": "A" if pk < 10 else "B",
+             self.HASH: None if pk == 12 else f"h{pk}"}
+            for pk in range(25) if pk != 7
+        ])
+        self.count_selects()
+        for patcher in (
+                mock.patch.object(config, "destdb",
+                                  SimpleNamespace(session=self.session)),
+                mock.patch.object(config, "source_hash_fieldname",
+                                  self.HASH)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _lookup(self, **kwargs: Any) -> DestinationRecordLookup:
+        return DestinationRecordLookup("dest", "pk", **kwargs)
+
+    def test_windows(self) -> None:
+        lookup = self._lookup(with_hash=True, window_size=10)
+        for pk in range(30):
+            expected = pk < 25 and pk not in (7, 12)
+            self.assertEqual(lookup.exists_by_hash(pk, f"h{pk}"), expected,
+                             f"PK {pk}")
+        # One query per window: [0, 10), [10, 20), [20, 30).
+        self.assertEqual(self.n_selects, 3)
+        self.assertFalse(lookup.exists_by_hash(29, "h29"))
+        self.assertFalse(lookup.exists_by_hash(24, "h23"))
+        self.assertEqual(self.n_selects, 3)
+        # Going back to an earlier window fetches it again.
+        self.assertTrue(lookup.exists_by_hash(9, "h9"))
+        self.assertEqual(self.n_selects, 4)
+
+    def test_windows_by_pk(self) -> None:
+        lookup = self._lookup(with_hash=False, window_size=10)
+        self.assertTrue(lookup.exists_by_pk(9))
+        self.assertTrue(lookup.exists_by_pk(10))
+        self.assertTrue(lookup.exists_by_pk(12))  # no hash, but present
+        self.assertFalse(lookup.exists_by_pk(7))
+        self.assertEqual(self.n_selects, 3)
+
+    def test_windows_divided_by_task(self) -> None:
+        lookup = self._lookup(with_hash=False, window_size=10,
+                              tasknum=1, ntasks=2, pk_range=(5, 14))
+        self.assertEqual([pk for pk in range(20) if lookup.exists_by_pk(pk)],
+                         [5, 9, 11, 13])
+        self.assertEqual(self.n_selects, 2)
+
+    def test_restriction(self) -> None:
+        lookup = self._lookup(with_hash=True,
+                              restriction=column("rid") == "B",
+                              window_size=10)
+        self.assertTrue(lookup.exists_by_hash(24, "h24"))
+        self.assertTrue(lookup.exists_by_hash(10, "h10"))
+        self.assertFalse(lookup.exists_by_hash(3, "h3"))  # other patient
+        self.assertEqual(self.n_selects, 1)
+
+    def test_fallback_per_row(self) -> None:
+        lookup = self._lookup(with_hash=True)
+        self.assertTrue(lookup.exists_by_hash(3, "h3"))
+        self.assertFalse(lookup.exists_by_hash(3, "h4"))
+        self.assertTrue(lookup.exists_by_pk(12))
+        self.assertFalse(lookup.exists_by_pk(7))
+        self.assertEqual(self.n_selects, 4)
+
+
+class TestResume(SqliteTestCase):
+    """
+    Checks that resuming a run skips the patients recorded as completed in
+    the progress ledger, and only those.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        # noinspection PyUnresolvedReferences
+        ProgressLedgerEntry.__table__.create(self.engine)
+        ProgressLedgerEntry.record_patients(self.session, "PATIENT",
+                                            [2, 3, 5])
+        ProgressLedgerEntry.record_patients(self.session, "OTHER", [1, 4])
+        ProgressLedgerEntry.record_unit(self.session, "PATIENT", "db.t")
+        self.session.commit()
+
+    def test_skip_completed_patients(self) -> None:
+        completed_pids = ProgressLedgerEntry.completed_pids(self.session,
+                                                            "PATIENT")
+        self.assertEqual(completed_pids, {2, 3, 5})
+        batches = [[1, 2], [3], [4, 5, 6], [7]]
+        self.assertEqual(
+            list(gen_uncompleted_pid_batches(batches, completed_pids)),
+            [[1], [4, 6], [7]])
+
+    def test_units(self) -> None:
+        self.assertTrue(ProgressLedgerEntry.unit_completed(
+            self.session, "PATIENT", "db.t"))
+        self.assertFalse(ProgressLedgerEntry.unit_completed(
+            self.session, "OTHER", "db.t"))
+
+    def test_new_run(self) -> None:
+        ProgressLedgerEntry.clear(self.session)
+        self.session.commit()
+        self.assertEqual(ProgressLedgerEntry.completed_pids(self.session,
+                                                            "PATIENT"),
+                         set())
+
+    def test_wipe_interrupted_patients(self) -> None:
+        # A run committed destination data for patients 1 and 4, then was
+        # killed before recording them in the ledger.
+        metadata = MetaData()
+        dest_table = Table("dest", metadata,
+                           Column("pk", Integer, primary_key=True),
+                           Column("rid", String(10)))
+        metadata.create_all(self.engine)
+        self.session.execute(dest_table.insert(), [
+            {"pk": pk, "rid": f"rid{pid}"}
+            for pk, pid in ((10, 1), (11, 1), (12, 2), (13, 4))
+        ])
+        self.session.commit()
+        dd = SimpleNamespace(
+            get_dest_tables_with_patient_info=lambda: ["dest"],
+            get_dest_sqla_table=lambda *args: dest_table)
+        with mock.patch.multiple(
+                config,
+                dd=dd,
+                destdb=SimpleNamespace(session=self.session),
+                research_id_fieldname="rid",
+                encrypt_primary_pid=lambda pid: f"rid{pid}",
+                commit_dest_db=self.session.commit):
+            completed_pids = ProgressLedgerEntry.completed_pids(
+                self.session, "PATIENT")
+            for pids in gen_uncompleted_pid_batches([[1, 2], [4]],
+                                                    completed_pids):
+                wipe_destination_data_for_patients(pids)
+                # Reprocessing them doesn't clash with what was there.
+                self.session.execute(dest_table.insert(), [
+                    {"pk": 10 + pid, "rid": f"rid{pid}"} for pid in pids])
+                self.session.commit()
+        self.assertEqual(
+            [tuple(row) for row in self.session.execute(
+                select([dest_table.c.pk, dest_table.c.rid]).
+                order_by(dest_table.c.pk))],
+            [(11, "rid1"), (12, "rid2"), (14, "rid4")])
+
+
+class TestInterruptedNonPatientWork(SqliteTestCase):
+    """
+    Checks that the destination data for non-patient work that an interrupted
+    run may have partly done is deleted before the work is repeated.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        metadata = MetaData()
+        self.dest_table = Table("dest", metadata,
+                                Column("pk", Integer, primary_key=True),
+                                Column("rid", String(10)))
+        metadata.create_all(self.engine)
+        # noinspection PyUnresolvedReferences
+        WorkQueueItem.__table__.create(self.engine)
+        self.session.execute(self.dest_table.insert(), [
+            {"pk": pk, "rid": f"rid{pk // 10}"} for pk in range(10, 40)
+        ])
+        self.session.commit()
+        dd = SimpleNamespace(
+            get_dest_tables_with_patient_info=lambda: ["dest"],
+            get_dest_table_for_src_db_table=lambda *args: "dest",
+            get_dest_sqla_table=lambda *args: self.dest_table,
+            get_int_pk_ddr=lambda *args: SimpleNamespace(dest_field="pk",
+                                                         alter_methods=[]))
+        patcher = mock.patch.multiple(
+            config,
+            dd=dd,
+            admindb=SimpleNamespace(session=self.session),
+            destdb=SimpleNamespace(session=self.session),
+            research_id_fieldname="rid",
+            encrypt_primary_pid=lambda pid: f"rid{pid}",
+            commit_dest_db=self.session.commit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _dest_pks(self) -> List[int]:
+        return [row[0] for row in self.session.execute(
+            select([self.dest_table.c.pk]).order_by(self.dest_table.c.pk))]
+
+    def test_wipe_pk_range(self) -> None:
+        wipe_destination_data_for_nonpatient_unit("db", "t", pkname="pk",
+                                                  pk_range=(15, 24))
+        self.assertEqual(self._dest_pks(),
+                         list(range(10, 15)) + list(range(25, 40)))
+
+    def test_wipe_task_share(self) -> None:
+        wipe_destination_data_for_nonpatient_unit("db", "t", pkname="pk",
+                                                  tasknum=1, ntasks=3)
+        self.assertEqual(self._dest_pks(),
+                         [pk for pk in range(10, 40) if pk % 3 != 1])
+
+    def test_wipe_table(self) -> None:
+        wipe_destination_data_for_nonpatient_unit("db", "t")
+        self.assertEqual(self._dest_pks(), [])
+
+    def test_requeue(self) -> None:
+        WorkQueueItem.add_patients(self.session, [1, 2])
+        WorkQueueItem.add_table(self.session, "db", "t", pk_name="pk",
+                                pk_first=30, pk_last=34)
+        WorkQueueItem.add_table(self.session, "db", "t", pk_name="pk",
+                                pk_first=35, pk_last=39)
+        self.session.commit()
+        # Patient 1 and the first range were finished. Patient 2 and the
+        # second range were claimed, and partly done, by a process that was
+        # then killed.
+        patients = WorkQueueItem.claim_items(self.session,
+                                             WorkQueueKind.PATIENT, 2)
+        ranges = WorkQueueItem.claim_items(self.session,
+                                           WorkQueueKind.TABLE, 2)
+        WorkQueueItem.mark_done(self.session, [patients[0], ranges[0]])
+        requeue_unfinished_work()
+        self.assertEqual(self._dest_pks(),
+                         list(range(10, 20)) + list(range(30, 35)))
+        items = WorkQueueItem.claim_items(self.session,
+                                          WorkQueueKind.TABLE, 2)
+        self.assertEqual([(item.pk_first, item.pk_last) for item in items],
+                         [(35, 39)])
+
+    def test_requeue_incremental(self) -> None:
+        WorkQueueItem.add_patients(self.session, [1])
+        self.session.commit()
+        WorkQueueItem.claim_items(self.session, WorkQueueKind.PATIENT, 1)
+        requeue_unfinished_work(incremental=True)
+        self.assertEqual(self._dest_pks(), list(range(10, 40)))
+
+
+class TestIntPkRanges(SqliteTestCase):
+    """
+    Checks the division of a table into ranges of its integer PK.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        metadata = MetaData()
+        src_table = Table("src", metadata,
+                          Column("pk", Integer, primary_key=True))
+        metadata.create_all(self.engine)
+        self.session.execute(src_table.insert(), [
+            {"pk": pk} for pk in (-150, -5, 5, 99, 100, 1000000, 1000001)
+        ])
+        self.session.commit()
+        patcher = mock.patch.object(
+            config, "sources", {"db": SimpleNamespace(session=self.session)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_skip_empty_ranges(self) -> None:
+        self.assertEqual(get_int_pk_ranges("db", "src", "pk", 100), [
+            (-200, -101),
+            (-100, -1),
+            (0, 99),
+            (100, 199),
+            (1000000, 1000099),
+        ])
+
+    def test_max_ranges(self) -> None:
+        self.assertEqual(
+            get_int_pk_ranges("db", "src", "pk", 100, max_ranges=2),
+            [(-200, 99), (100, 1000099)])
+        self.assertEqual(
+            get_int_pk_ranges("db", "src", "pk", 100, max_ranges=5),
+            get_int_pk_ranges("db", "src", "pk", 100))
+
+    def test_empty_table(self) -> None:
+        self.session.execute("DELETE FROM src")
+        self.assertEqual(get_int_pk_ranges("db", "src", "pk", 100), [])
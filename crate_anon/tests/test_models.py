@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/tests/test_models.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Tests for the work queue (see :mod:`crate_anon.anonymise.models`).**
+
+"""
+
+from typing import List
+
+from sqlalchemy import event
+
+from crate_anon.anonymise.models import WorkQueueItem, WorkQueueKind
+from crate_anon.tests.sqlite_testcase import SqliteTestCase
+
+
+class TestWorkQueue(SqliteTestCase):
+    """
+    Checks that two processes (here, sessions with their own connections to a
+    SQLite database) never claim the same work queue items.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        # noinspection PyUnresolvedReferences
+        WorkQueueItem.__table__.create(self.engine)
+        self.session1 = self.session
+        self.engine2 = self.make_engine()
+        self.session2 = self.make_session(self.engine2)
+        WorkQueueItem.add_patients(self.session1, range(1, 8))
+        self.session1.commit()
+
+    @staticmethod
+    def _pids(items: List[WorkQueueItem]) -> List[int]:
+        return [item.pid for item in items]
+
+    def test_claim_in_turn(self) -> None:
+        items1 = WorkQueueItem.claim_items(self.session1,
+                                           WorkQueueKind.PATIENT, 3)
+        items2 = WorkQueueItem.claim_items(self.session2,
+                                           WorkQueueKind.PATIENT, 3)
+        items3 = WorkQueueItem.claim_items(self.session1,
+                                           WorkQueueKind.PATIENT, 3)
+        self.assertEqual(self._pids(items1), [1, 2, 3])
+        self.assertEqual(self._pids(items2), [4, 5, 6])
+        self.assertEqual(self._pids(items3), [7])
+        self.assertEqual(WorkQueueItem.claim_items(
+            self.session2, WorkQueueKind.PATIENT, 3), [])
+        self.assertEqual(WorkQueueItem.claim_items(
+            self.session1, WorkQueueKind.TABLE, 3), [])
+
+    def test_claim_race(self) -> None:
+        claimed_by_2 = []  # type: List[WorkQueueItem]
+
+        # noinspection PyUnusedLocal
+        def interrupt(conn, cursor, statement, *args) -> None:
+            # The second process claims the same candidates just before the
+            # first process tries to.
+            if statement.lstrip().upper().startswith("UPDATE") and \
+                    not claimed_by_2:
+                claimed_by_2.extend(WorkQueueItem.claim_items(
+                    self.session2, WorkQueueKind.PATIENT, 3))
+
+        event.listen(self.engine, "before_cursor_execute", interrupt)
+        items1 = WorkQueueItem.claim_items(self.session1,
+                                           WorkQueueKind.PATIENT, 3)
+        self.assertEqual(self._pids(claimed_by_2), [1, 2, 3])
+        self.assertEqual(self._pids(items1), [4, 5, 6])
+
+    def test_done_and_release(self) -> None:
+        items1 = WorkQueueItem.claim_items(self.session1,
+                                           WorkQueueKind.PATIENT, 3)
+        WorkQueueItem.claim_items(self.session2, WorkQueueKind.PATIENT, 3)
+        WorkQueueItem.mark_done(self.session1, items1)
+        # The second process was interrupted; its items are claimable again.
+        self.assertEqual(WorkQueueItem.release_unfinished(self.session1), 3)
+        self.session1.commit()
+        items = WorkQueueItem.claim_items(self.session2,
+                                          WorkQueueKind.PATIENT, 10)
+        self.assertEqual(self._pids(items), [4, 5, 6, 7])
+
+    def test_table_ranges(self) -> None:
+        WorkQueueItem.add_table_ranges(self.session1, "db", "t", "pk",
+                                       [(0, 99), (200, 299), (300, 399)],
+                                       chunksize=2)
+        self.session1.commit()
+        items = WorkQueueItem.claim_items(self.session2, WorkQueueKind.TABLE,
+                                          10)
+        self.assertEqual(
+            [(item.src_db, item.src_table, item.pk_name, item.pk_first,
+              item.pk_last) for item in items],
+            [("db", "t", "pk", 0, 99), ("db", "t", "pk", 200, 299),
+             ("db", "t", "pk", 300, 399)])
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/tests/test_nlp_progress.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Tests for NLP progress records (see
+:mod:`crate_anon.nlp_manager.input_field_config`).**
+
+"""
+
+import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, Generator, List, Optional, Tuple
+from unittest import mock
+
+from sqlalchemy import Integer, MetaData
+from sqlalchemy.orm.session import Session
+from sqlalchemy.sql import select
+
+from crate_anon.nlp_manager.constants import FN_SRCPKSTR, FN_SRCPKVAL
+from crate_anon.nlp_manager.input_field_config import (
+    InputFieldConfig,
+    ProgressRecordWriter,
+)
+from crate_anon.nlp_manager.models import NlpRecord
+from crate_anon.tests.sqlite_testcase import SqliteTestCase
+
+
+class TestProgressRecords(SqliteTestCase):
+    """
+    Checks the bulk reading (for incremental runs) and writing of progress
+    records, against a SQLite progress database.
+    """
+
+    NLPDEF = "mynlp"
+
+    def setUp(self) -> None:
+        super().setUp()
+        # SQLite only autoincrements an INTEGER (not BIGINT) PK, so create an
+        # equivalent table with one.
+        progress_table = NlpRecord.__table__.tometadata(MetaData())
+        progress_table.c.pk.type = Integer()
+        progress_table.create(self.engine)
+        self.notifications = []  # type: List[Tuple[int, bool]]
+        self.nlpdef = SimpleNamespace(
+            name=self.NLPDEF,
+            now=datetime.datetime(2020, 1, 1),
+            progressdb_session=self.session,
+            notify_transaction=self._notify_transaction,
+        )
+        ifconfig = InputFieldConfig.__new__(InputFieldConfig)
+        ifconfig._nlpdef = self.nlpdef
+        ifconfig._srcdb = "srcdb"
+        ifconfig._srctable = "notes"
+        ifconfig._srcpkfield = "note_id"
+        ifconfig._srcfield = "note"
+        self.ifconfig = ifconfig
+        # Existing progress records. PK 3's has no hash. Another NLP
+        # definition has processed PK 4.
+        self._add_record(2, "h2")
+        self._add_record(3, None)
+        self._add_record(4, "h4", nlpdef="othernlp")
+        self._add_record(5, "h5")
+        self._add_record(100, "h100", srcpkstr="abc")
+        self.session.commit()
+
+    # noinspection PyUnusedLocal
+    def _notify_transaction(self, session: Session, n_rows: int,
+                            n_bytes: int, force_commit: bool) -> None:
+        self.notifications.append((n_rows, force_commit))
+
+    def _add_record(self, srcpkval: int, srchash: Optional[str],
+                    srcpkstr: str = None, nlpdef: str = NLPDEF) -> None:
+        self.session.execute(NlpRecord.__table__.insert().values(
+            srcdb="srcdb", srctable="notes", srcpkfield="note_id",
+            srcpkval=srcpkval, srcpkstr=srcpkstr, srcfield="note",
+            nlpdef=nlpdef, srchash=srchash))
+
+    def _records(self) -> List[Tuple[int, Optional[str], str,
+                                     Optional[str]]]:
+        nlpt = NlpRecord.__table__
+        return [
+            tuple(row) for row in self.session.execute(
+                select([nlpt.c.srcpkval, nlpt.c.srcpkstr, nlpt.c.nlpdef,
+                        nlpt.c.srchash]).
+                order_by(nlpt.c.srcpkval, nlpt.c.nlpdef)
+            )
+        ]
+
+    def _source(self, pkvals: List[int]) \
+            -> Generator[Tuple[str, Dict[str, Any]], None, None]:
+        for pkval in pkvals:
+            yield f"text{pkval}", {FN_SRCPKVAL: pkval, FN_SRCPKSTR: None}
+
+    def test_progress_hashes(self) -> None:
+        self.assertEqual(
+            list(self.ifconfig.gen_progress_hashes(chunk_size=2)),
+            [(2, "h2"), (3, None), (5, "h5"), (100, "h100")])
+        self.assertEqual(
+            list(self.ifconfig.gen_progress_hashes(tasknum=1, ntasks=2,
+                                                   chunk_size=1)),
+            [(3, None), (5, "h5")])
+
+    def test_merge_with_source(self) -> None:
+        with mock.patch.object(self.ifconfig, "gen_text",
+                               return_value=self._source(range(1, 7))):
+            results = [
+                (other_values[FN_SRCPKVAL], progress_exists, srchash)
+                for _, other_values, progress_exists, srchash in
+                self.ifconfig.gen_text_with_progress_hash()
+            ]
+        self.assertEqual(results, [
+            (1, False, None),
+            (2, True, "h2"),
+            (3, True, None),  # record exists, though without a hash
+            (4, False, None),  # processed by another NLP definition only
+            (5, True, "h5"),
+            (6, False, None),
+        ])
+
+    def test_write(self) -> None:
+        writer = ProgressRecordWriter(self.nlpdef, self.ifconfig,
+                                      max_rows_per_batch=3, force_commit=True)
+        writer.add(1, None, "new1", exists_already=False)
+        writer.add(2, None, "new2", exists_already=True)
+        writer.add(3, None, "new3", exists_already=True)  # NULL hash before
+        self.assertEqual(writer.n_rows_pending, 0)
+        self.assertEqual(self.notifications, [(3, True)])
+        writer.add(100, "abc", "new100", exists_already=True)
+        writer.add(101, "def", "new101", exists_already=False)
+        self.assertEqual(writer.n_rows_pending, 2)
+        writer.flush()
+        writer.flush()  # nothing left to do
+        self.assertEqual(self.notifications, [(3, True), (2, True)])
+        self.assertEqual(self._records(), [
+            (1, None, self.NLPDEF, "new1"),
+            (2, None, self.NLPDEF, "new2"),
+            (3, None, self.NLPDEF, "new3"),
+            (4, None, "othernlp", "h4"),
+            (5, None, self.NLPDEF, "h5"),
+            (100, "abc", self.NLPDEF, "new100"),
+            (101, "def", self.NLPDEF, "new101"),
+        ])
+
+    def test_incremental_update(self) -> None:
+        # As for an incremental run (see
+        # crate_anon.nlp_manager.nlp_manager.process_nlp): records that are
+        # new or changed are written, once each.
+        writer = ProgressRecordWriter(self.nlpdef, self.ifconfig)
+        with mock.patch.object(self.ifconfig, "gen_text",
+                               return_value=self._source([2, 3, 4, 5])):
+            for text, other_values, progress_exists, prev_srchash in \
+                    self.ifconfig.gen_text_with_progress_hash():
+                srchash = "h5" if text == "text5" else "changed"
+                if progress_exists and prev_srchash == srchash:
+                    continue
+                writer.add(other_values[FN_SRCPKVAL], None, srchash,
+                           exists_already=progress_exists)
+        writer.flush()
+        self.assertEqual(self.notifications, [(3, False)])
+        self.assertEqual(self._records(), [
+            (2, None, self.NLPDEF, "changed"),
+            (3, None, self.NLPDEF, "changed"),
+            (4, None, self.NLPDEF, "changed"),
+            (4, None, "othernlp", "h4"),
+            (5, None, self.NLPDEF, "h5"),
+            (100, "abc", self.NLPDEF, "h100"),
+        ])
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/tests/test_patient.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Tests for fetching patients' identifiable information (see
+:mod:`crate_anon.anonymise.patient`).**
+
+"""
+
+from types import SimpleNamespace
+from typing import Any, Dict, List
+from unittest import mock
+
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+from crate_anon.anonymise.config_singleton import config
+from crate_anon.anonymise.patient import get_all_values_for_patients
+from crate_anon.tests.sqlite_testcase import SqliteTestCase
+
+
+class TestBatchValues(SqliteTestCase):
+    """
+    Checks that fetching identifiable values for a batch of patients assigns
+    each row to the right patient.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        metadata = MetaData()
+        self.table = Table("src", metadata,
+                           Column("id", Integer, primary_key=True),
+                           # compared case-insensitively, as by many
+                           # databases
+                           Column("pid", String(10, collation="NOCASE")),
+                           Column("name", String(10)))
+        metadata.create_all(self.engine)
+        srcdb = SimpleNamespace(
+            session=self.session,
+            srccfg=SimpleNamespace(ddgen_per_table_pid_field="pid"))
+        patcher = mock.patch.object(config, "sources", {"db": srcdb})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _add(self, *rows: Any) -> None:
+        self.session.execute(self.table.insert(), [
+            {"pid": pid, "name": name} for pid, name in rows])
+
+    def _values(self, pids: List[Any]) -> Dict[str, List[List[Any]]]:
+        return dict(get_all_values_for_patients("db", "src", ["name"], pids))
+
+    def test_int_pids(self) -> None:
+        self._add(("1", "Alice"), ("2", "Bob"), ("1", "Carol"))
+        self.assertEqual(self._values([1, 2, 3]), {
+            "1": [["Alice"], ["Carol"]],
+            "2": [["Bob"]],
+        })
+
+    def test_case_differs(self) -> None:
+        self._add(("abc", "Alice"), ("ABC", "Bob"), ("Abc", "Carol"))
+        self.assertEqual(self._values(["abc", "ABC"]), {
+            "abc": [["Alice"]],
+            "ABC": [["Bob"]],
+        })
+        with self.assertLogs("crate_anon.anonymise.patient") as logs:
+            self.assertEqual(self._values(["aBC"]), {})
+        self.assertIn("3 rows of db.src matched the requested PIDs only "
+                      "inexactly", logs.output[0])
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/tests/test_sql.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Tests for batched inserts (see :mod:`crate_anon.common.sql`).**
+
+"""
+
+from typing import List, Tuple
+
+from sqlalchemy import Column, event, Integer, MetaData, String, Table
+from sqlalchemy.orm.session import Session
+
+from crate_anon.common.sql import BatchedInserter, TransactionSizeLimiter
+from crate_anon.tests.sqlite_testcase import SqliteTestCase
+
+
+class TestBatchedInserter(SqliteTestCase):
+    """
+    Checks when :class:`BatchedInserter` executes its batches, and how that
+    drives COMMITs via :class:`TransactionSizeLimiter`.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        metadata = MetaData()
+        self.table = Table("t", metadata,
+                           Column("id", Integer, primary_key=True),
+                           Column("v", String(10)))
+        metadata.create_all(self.engine)
+        self.n_commits = 0
+        self.flushes = []  # type: List[Tuple[int, int]]
+
+        def count_commit(_session: Session) -> None:
+            self.n_commits += 1
+
+        event.listen(self.session, "after_commit", count_commit)
+
+    def _record_flush(self, n_rows: int, n_bytes: int) -> None:
+        self.flushes.append((n_rows, n_bytes))
+
+    def _n_rows_in_table(self) -> int:
+        return self.session.query(self.table).count()
+
+    def _add_rows(self, inserter: BatchedInserter, n: int,
+                  n_bytes: int = 0, start: int = 0) -> None:
+        for i in range(start, start + n):
+            inserter.add(dict(id=i, v=str(i)), n_bytes=n_bytes)
+
+    def test_flush_by_rows(self) -> None:
+        inserter = BatchedInserter(self.session, self.table.insert(),
+                                   max_rows_per_batch=3,
+                                   on_flush=self._record_flush)
+        self._add_rows(inserter, 7)
+        self.assertEqual(self.flushes, [(3, 0), (3, 0)])
+        self.assertEqual(inserter.n_rows_pending, 1)
+        self.assertEqual(self._n_rows_in_table(), 6)
+        inserter.flush()
+        inserter.flush()  # nothing left to do
+        self.assertEqual(self.flushes, [(3, 0), (3, 0), (1, 0)])
+        self.assertEqual(inserter.n_rows_pending, 0)
+        self.assertEqual(self._n_rows_in_table(), 7)
+
+    def test_flush_by_bytes(self) -> None:
+        inserter = BatchedInserter(self.session, self.table.insert(),
+                                   max_bytes_per_batch=100,
+                                   on_flush=self._record_flush)
+        self._add_rows(inserter, 5, n_bytes=40)
+        self.assertEqual(self.flushes, [(3, 120)])
+        self.assertEqual(inserter.n_rows_pending, 2)
+
+    def test_every_row(self) -> None:
+        inserter = BatchedInserter(self.session, self.table.insert(),
+                                   max_rows_per_batch=1,
+                                   on_flush=self._record_flush)
+        self._add_rows(inserter, 2)
+        self.assertEqual(self.flushes, [(1, 0), (1, 0)])
+
+    def test_commits(self) -> None:
+        limiter = TransactionSizeLimiter(self.session,
+                                         max_rows_before_commit=5)
+        inserter = BatchedInserter(self.session, self.table.insert(),
+                                   max_rows_per_batch=4,
+                                   on_flush=limiter.notify)
+        # Batches of 4 rows: the limiter commits after the second batch.
+        self._add_rows(inserter, 12)
+        self.assertEqual(self.n_commits, 1)
+        self.assertEqual(inserter.n_rows_pending, 0)
+        self._add_rows(inserter, 3, start=12)
+        self.assertEqual(self.n_commits, 1)
+        self.assertEqual(inserter.n_rows_pending, 3)
+
+    def test_flush_before_commit(self) -> None:
+        inserter = BatchedInserter(self.session, self.table.insert(),
+                                   max_rows_per_batch=10,
+                                   on_flush=self._record_flush)
+        limiter = TransactionSizeLimiter(self.session,
+                                         before_commit=inserter.flush)
+        self._add_rows(inserter, 3)
+        self.assertEqual(self.flushes, [])
+        limiter.commit()
+        self.assertEqual(self.flushes, [(3, 0)])
+        self.assertEqual(self.n_commits, 1)
+        self.session.rollback()  # nothing to lose; the rows were committed
+        self.assertEqual(self._n_rows_in_table(), 3)
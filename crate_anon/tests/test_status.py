@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+crate_anon/tests/test_status.py
+
+===============================================================================
+
+    Copyright (C) 2015-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CRATE.
+
+    CRATE is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CRATE is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CRATE. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Tests for publishing progress (see :mod:`crate_anon.anonymise.status`).**
+
+"""
+
+from types import SimpleNamespace
+
+from crate_anon.anonymise.models import ProcessStatus
+from crate_anon.anonymise.status import ProcessPhase, StatusPublisher
+from crate_anon.tests.sqlite_testcase import SqliteTestCase
+
+
+class TestStatusPublisher(SqliteTestCase):
+    """
+    Checks publishing progress to an admin database made by an older version
+    of CRATE, without the status table.
+    """
+
+    def _publisher(self, process: int) -> StatusPublisher:
+        progress = SimpleNamespace(src_rows_read=0, dest_rows_written=0,
+                                   src_bytes_read=0, dest_bytes_written=0)
+        return StatusPublisher(engine=self.engine, progress=progress,
+                               process_cluster="cluster", process=process,
+                               nprocesses=2, interval_s=10)
+
+    def test_creates_table(self) -> None:
+        publishers = [self._publisher(0), self._publisher(1)]
+        for publisher in publishers:
+            publisher.start()
+        publishers[1].set_phase(ProcessPhase.PATIENTS)
+        self.assertEqual(
+            [(record.process, record.phase) for record in (
+                self.session.query(ProcessStatus).
+                order_by(ProcessStatus.process)
+            )],
+            [(0, ""), (1, ProcessPhase.PATIENTS)])
+
+    def test_warns_once(self) -> None:
+        publisher = self._publisher(0)
+        publisher.start()
+        # noinspection PyUnresolvedReferences
+        ProcessStatus.__table__.drop(self.engine)
+        with self.assertLogs("crate_anon.anonymise.status",
+                             level="DEBUG") as logs:
+            publisher.publish()
+            publisher.publish()
+        self.assertEqual([record.levelname for record in logs.records],
+                         ["WARNING", "DEBUG"])
@@ -101,6 +101,8 @@ def main():
     # -------------------------------------------------------------------------
     # ancillary
     # -------------------------------------------------------------------------
+    run_cmd(["crate_benchmark_anonymisation", "--help"],
+            join(ANCILLARY_DIR, "_crate_benchmark_anonymisation_help.txt"))
     run_cmd(["crate_make_demo_database", "--help"],
             join(ANCILLARY_DIR, "_crate_make_demo_database_help.txt"))
     run_cmd(["crate_test_anonymisation", "--help"],
@@ -115,6 +117,8 @@ def main():
             join(ANON_DIR, "_crate_anonymise_help.txt"))
     run_cmd(["crate_anonymise_multiprocess", "--help"],
             join(ANON_DIR, "_crate_anonymise_multiprocess_help.txt"))
+    run_cmd(["crate_anonymise_status", "--help"],
+            join(ANON_DIR, "_crate_anonymise_status_help.txt"))
     run_cmd(["crate_anonymise", "--democonfig"],
             join(ANON_DIR, "_specimen_anonymiser_config.ini"))
     log.info("Manually generated: minimal_anonymiser_config.ini")
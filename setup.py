@@ -397,6 +397,8 @@ setup(
 
             "crate_anonymise=crate_anon.anonymise.anonymise_cli:main",
             "crate_anonymise_multiprocess=crate_anon.anonymise.launch_multiprocess_anonymiser:main",  # noqa
+            "crate_anonymise_status=crate_anon.anonymise.status_cli:main",
+            "crate_benchmark_anonymisation=crate_anon.anonymise.benchmark_anonymisation:main",  # noqa
             "crate_fetch_wordlists=crate_anon.anonymise.fetch_wordlists:main",
             "crate_make_demo_database=crate_anon.anonymise.make_demo_database:main",  # noqa
             "crate_test_anonymisation=crate_anon.anonymise.test_anonymisation:main",  # noqa